@@ -0,0 +1,576 @@
+import argparse
+import csv
+import gzip
+import http.client
+import json
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+import timeit
+import urllib.parse
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from db import DB, compile_filters
+from schema import Column, TableSchema
+
+# Type definitions
+KV = Dict[str, Any]  # Key-value pairs
+
+#
+# Benchmarks for the REST service in main.py.
+#
+#   seed     creates the student and employee tables and fills them with rows synthesized from
+#            people_info.csv, scaled up to any number of rows
+#   load     drives the CRUD and list endpoints with a configurable concurrency and operation mix
+#   micro    times the query builders and, given a database, execute_query
+#   compare  compares two reports and exits with status 1 if a metric regressed
+#
+# Every command writes a JSON report, so runs can be diffed and checked in review, e.g.
+#
+#   python bench.py seed --students 1000000 --employees 1000000
+#   python bench.py load --serve --concurrency 32 --duration 60 --output load.json
+#   python bench.py micro --output micro.json
+#   python bench.py compare baseline.json micro.json
+#
+# The service reads s24_hw2 on localhost:3306 as root (see main.py). Without a MySQL install,
+# a throwaway server works as a stand-in:
+#
+#   docker run --rm -d -p 3306:3306 -e MYSQL_ROOT_PASSWORD=dbuserdbuser mysql:8
+#
+# Runs are reproducible for a given --seed: the synthesized rows and each worker's sequence of
+# operations are the same every time. Reseed with --reset between load runs, since they write.
+
+PEOPLE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "people_info.csv")
+
+ENROLLMENT_YEARS = range(2016, 2024)
+EMPLOYEE_TYPES = ("Professor", "Lecturer", "Staff")
+
+SCHEMA = {
+	"student": """
+		CREATE TABLE IF NOT EXISTS student (
+			student_id INT AUTO_INCREMENT PRIMARY KEY,
+			first_name VARCHAR(64),
+			middle_name VARCHAR(64),
+			last_name VARCHAR(64),
+			email VARCHAR(255) NOT NULL UNIQUE,
+			enrollment_year INT CHECK (enrollment_year BETWEEN 2016 AND 2023)
+		)
+	""",
+	"employee": """
+		CREATE TABLE IF NOT EXISTS employee (
+			employee_id INT AUTO_INCREMENT PRIMARY KEY,
+			first_name VARCHAR(64),
+			middle_name VARCHAR(64),
+			last_name VARCHAR(64),
+			email VARCHAR(255) NOT NULL UNIQUE,
+			employee_type ENUM('Professor', 'Lecturer', 'Staff')
+		)
+	""",
+}
+ID_COLUMNS = {"student": "student_id", "employee": "employee_id"}
+
+OPERATIONS = ("get", "list", "create", "update", "delete")
+DEFAULT_MIX = "get=60,list=15,create=10,update=10,delete=5"
+
+# Report keys compared by compare: throughputs, which regress when they drop, and timings, which regress when they rise
+METRIC_HIGHER_IS_BETTER = re.compile(r"(requests|ops)_per_second$")
+METRIC_LOWER_IS_BETTER = re.compile(r"(\.p50|\.p95|\.p99|\.mean|ns_per_op|round_trips_per_request)$")
+
+
+# --- Data ---
+
+def read_people(file_name: str = PEOPLE_FILE) -> List[Dict[str, str]]:
+	with open(file_name, "r", newline="") as in_file:
+		return list(csv.DictReader(in_file))
+
+
+def synthesize(people: List[Dict[str, str]], table: str, n: int, seed: int = 0) -> Iterator[Dict[str, Any]]:
+	"""Yields n rows for table, mixing the names of people, with unique emails derived from theirs.
+
+	The same people, table, n and seed always yield the same rows.
+	"""
+	rng = random.Random(f"{seed}:{table}")
+	for i in range(n):
+		first, middle, last, other = (rng.choice(people) for _ in range(4))
+		local, _, domain = other["email"].partition("@")
+		row = {
+			"first_name": first["first_name"],
+			"middle_name": middle["middle_name"] or None,
+			"last_name": last["last_name"],
+			"email": f"{local}.{i}@{domain}",
+		}
+		if table == "student":
+			row["enrollment_year"] = rng.choice(ENROLLMENT_YEARS)
+		else:
+			row["employee_type"] = rng.choice(EMPLOYEE_TYPES)
+		yield row
+
+
+def seed_database(
+	db: DB,
+	counts: Dict[str, int],
+	people_file: str = PEOPLE_FILE,
+	seed: int = 0,
+	reset: bool = False,
+	chunk_size: int = 5000,
+) -> Dict[str, Any]:
+	"""Creates the tables if needed and inserts counts[table] synthesized rows into each.
+
+	:param reset: If True, the tables are emptied first, so IDs start at 1 again
+	:returns: The rows inserted into each table, and the time taken
+	"""
+	people = read_people(people_file)
+	report: Dict[str, Any] = {}
+	for table, n in counts.items():
+		db.execute_query(SCHEMA[table], [], ret_result=False)
+		if reset:
+			db.execute_query(f"TRUNCATE TABLE {table}", [], ret_result=False)
+		start = time.perf_counter()
+		rows = db.insert_many(table, synthesize(people, table, n, seed), chunk_size=chunk_size)
+		seconds = time.perf_counter() - start
+		report[table] = {"rows": rows, "seconds": seconds, "rows_per_second": rows / max(seconds, 1e-9)}
+	return report
+
+
+# --- Load test ---
+
+def parse_mix(spec: str) -> Dict[str, float]:
+	"""Parses an operation mix such as "get=60,list=15,create=10" into normalized weights."""
+	weights = {}
+	for part in spec.split(","):
+		name, _, weight = part.partition("=")
+		name = name.strip()
+		if name not in OPERATIONS:
+			raise ValueError(f"unknown operation {name!r}, expected one of {', '.join(OPERATIONS)}")
+		weights[name] = float(weight)
+	total = sum(weights.values())
+	if total <= 0:
+		raise ValueError("the mix needs a positive weight")
+	return {name: w / total for name, w in weights.items() if w > 0}
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+	"""Returns the nearest-rank p-th percentile of sorted_values."""
+	if not sorted_values:
+		return 0.0
+	rank = max(1, -(-len(sorted_values) * p // 100))
+	return sorted_values[int(rank) - 1]
+
+
+def summarize(latencies: List[float], seconds: float) -> Dict[str, Any]:
+	latencies = sorted(latencies)
+	ms = [v * 1000 for v in latencies]
+	return {
+		"requests": len(latencies),
+		"requests_per_second": len(latencies) / max(seconds, 1e-9),
+		"latency_ms": {
+			"p50": percentile(ms, 50),
+			"p95": percentile(ms, 95),
+			"p99": percentile(ms, 99),
+			"mean": sum(ms) / len(ms) if ms else 0.0,
+			"max": ms[-1] if ms else 0.0,
+		},
+	}
+
+
+def parse_metrics(text: str) -> Dict[str, float]:
+	"""Sums the samples of each metric in a Prometheus text exposition, across their labels."""
+	totals: Dict[str, float] = {}
+	for line in text.splitlines():
+		if not line or line.startswith("#"):
+			continue
+		name_labels, _, value = line.rpartition(" ")
+		name = name_labels.split("{", 1)[0]
+		totals[name] = totals.get(name, 0.0) + float(value)
+	return totals
+
+
+class Client:
+	def __init__(self, url: str, timeout: float = 30.0):
+		"""One keep-alive HTTP connection to the service."""
+		parsed = urllib.parse.urlsplit(url)
+		self.host = parsed.hostname
+		self.port = parsed.port or 80
+		self.timeout = timeout
+		self.conn: Optional[http.client.HTTPConnection] = None
+
+	def request(self, method: str, path: str, body: Any = None) -> Tuple[int, bytes]:
+		if self.conn is None:
+			self.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+		headers = {"Accept-Encoding": "gzip"}
+		data = None
+		if body is not None:
+			data = json.dumps(body).encode()
+			headers["Content-Type"] = "application/json"
+		try:
+			self.conn.request(method, path, body=data, headers=headers)
+			response = self.conn.getresponse()
+			content = response.read()
+		except Exception:
+			self.close()
+			raise
+		if response.getheader("Content-Encoding") == "gzip":
+			content = gzip.decompress(content)
+		return response.status, content
+
+	def close(self):
+		if self.conn is not None:
+			self.conn.close()
+			self.conn = None
+
+
+def make_request(op: str, table: str, rng: random.Random, max_id: int, serial: str) -> Tuple[str, str, Any]:
+	"""Returns the (method, path, body) of one operation on table. IDs are drawn from 1..max_id."""
+	path = f"/{table}s"
+	row_id = rng.randint(1, max(max_id, 1))
+	if op == "get":
+		return "GET", f"{path}/{row_id}", None
+	if op == "list":
+		if table == "student":
+			query = f"enrollment_year={rng.choice(ENROLLMENT_YEARS)}"
+		else:
+			query = f"employee_type={rng.choice(EMPLOYEE_TYPES)}"
+		return "GET", f"{path}?{query}&limit=100", None
+	if op == "create":
+		body = {"first_name": "Bench", "last_name": serial, "email": f"bench.{serial}@example.com"}
+		if table == "student":
+			body["enrollment_year"] = rng.choice(ENROLLMENT_YEARS)
+		else:
+			body["employee_type"] = rng.choice(EMPLOYEE_TYPES)
+		return "POST", path, body
+	if op == "update":
+		return "PUT", f"{path}/{row_id}", {"middle_name": serial}
+	return "DELETE", f"{path}/{row_id}", None
+
+
+def run_load(
+	url: str,
+	max_ids: Dict[str, int],
+	mix: Dict[str, float],
+	concurrency: int = 8,
+	duration: float = 30.0,
+	warmup: float = 5.0,
+	seed: int = 0,
+) -> Dict[str, Any]:
+	"""Sends requests from concurrency threads, each on its own keep-alive connection, for warmup + duration seconds.
+
+	Only requests that start after the warmup are reported. Operations are spread evenly over the
+	tables in max_ids. Requests that fail to complete or get a 5xx are counted as errors; 4xx
+	responses (e.g. a get of a row another worker deleted) are expected and only counted by status.
+	DB round trips come from the service's /metrics, so they are only exact when nothing else uses it.
+	"""
+	ops = [(table, op) for table in max_ids for op in mix]
+	weights = [mix[op] / len(max_ids) for _, op in ops]
+	lock = threading.Lock()
+	samples: Dict[str, List[float]] = {f"{table}.{op}": [] for table, op in ops}
+	statuses: Dict[str, Dict[str, int]] = {name: {} for name in samples}
+	errors: Dict[str, int] = {name: 0 for name in samples}
+	run_id = f"{seed}-{int(time.time() * 1000)}"
+
+	start = time.perf_counter()
+	measure_from = start + warmup
+	stop_at = measure_from + duration
+
+	def worker(n: int):
+		rng = random.Random(f"{seed}:{n}")
+		client = Client(url)
+		local = {name: [] for name in samples}
+		local_statuses: Dict[str, Dict[str, int]] = {name: {} for name in samples}
+		local_errors = {name: 0 for name in samples}
+		i = 0
+		try:
+			while True:
+				t0 = time.perf_counter()
+				if t0 >= stop_at:
+					break
+				(table, op), = rng.choices(ops, weights)
+				name = f"{table}.{op}"
+				method, path, body = make_request(op, table, rng, max_ids[table], f"{run_id}-{n}-{i}")
+				i += 1
+				try:
+					code, _ = client.request(method, path, body)
+				except Exception:
+					code = None
+				t1 = time.perf_counter()
+				if t0 < measure_from:
+					continue
+				local[name].append(t1 - t0)
+				key = str(code) if code is not None else "failed"
+				local_statuses[name][key] = local_statuses[name].get(key, 0) + 1
+				if code is None or code >= 500:
+					local_errors[name] += 1
+		finally:
+			client.close()
+		with lock:
+			for name in samples:
+				samples[name].extend(local[name])
+				errors[name] += local_errors[name]
+				for key, count in local_statuses[name].items():
+					statuses[name][key] = statuses[name].get(key, 0) + count
+
+	metrics_client = Client(url)
+	threads = [threading.Thread(target=worker, args=(n,), daemon=True) for n in range(concurrency)]
+	for t in threads:
+		t.start()
+	time.sleep(max(0.0, measure_from - time.perf_counter()))
+	before = fetch_metrics(metrics_client)
+	for t in threads:
+		t.join()
+	after = fetch_metrics(metrics_client)
+	metrics_client.close()
+	seconds = time.perf_counter() - measure_from
+
+	report = summarize([v for values in samples.values() for v in values], seconds)
+	report["seconds"] = seconds
+	report["errors"] = sum(errors.values())
+	report["db_round_trips_per_request"] = None
+	if before is not None and after is not None and report["requests"]:
+		trips = after.get("db_query_duration_seconds_count", 0) - before.get("db_query_duration_seconds_count", 0)
+		report["db_round_trips_per_request"] = trips / report["requests"]
+	report["operations"] = {}
+	for name, values in samples.items():
+		report["operations"][name] = {**summarize(values, seconds), "errors": errors[name], "statuses": statuses[name]}
+	return report
+
+
+def fetch_metrics(client: Client) -> Optional[Dict[str, float]]:
+	try:
+		code, body = client.request("GET", "/metrics")
+	except Exception:
+		return None
+	return parse_metrics(body.decode()) if code == 200 else None
+
+
+def start_server(port: int, timeout: float = 30.0) -> subprocess.Popen:
+	"""Starts main.py's app under uvicorn on port, and waits until it answers."""
+	server = subprocess.Popen(
+		[sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+		 "--log-level", "warning"],
+		cwd=os.path.dirname(os.path.abspath(__file__)),
+	)
+	client = Client(f"http://127.0.0.1:{port}", timeout=1.0)
+	deadline = time.monotonic() + timeout
+	try:
+		while True:
+			if server.poll() is not None:
+				raise RuntimeError(f"server exited with status {server.returncode}")
+			try:
+				if client.request("GET", "/")[0] == 200:
+					return server
+			except OSError:
+				pass
+			if time.monotonic() > deadline:
+				server.terminate()
+				raise RuntimeError(f"server didn't answer within {timeout}s")
+			time.sleep(0.2)
+	finally:
+		client.close()
+
+
+def max_row_ids(db: DB, tables: List[str]) -> Dict[str, int]:
+	ids = {}
+	for table in tables:
+		rows = db.execute_query(f"SELECT MAX({ID_COLUMNS[table]}) AS max_id FROM {table}", [], ret_result=True)
+		ids[table] = rows[0]["max_id"] or 0
+	return ids
+
+
+# --- Micro-benchmarks ---
+
+def time_call(func: Callable[[], Any], min_seconds: float = 0.2, repeat: int = 5) -> Dict[str, float]:
+	"""Times func with timeit: the loop count is grown until a run takes min_seconds, then the best of repeat runs is kept."""
+	timer = timeit.Timer(func)
+	number = 1
+	while timer.timeit(number) < min_seconds:
+		number *= 10
+	best = min(timer.repeat(repeat=repeat, number=number)) / number
+	return {"ns_per_op": best * 1e9, "ops_per_second": 1 / best, "loops": number}
+
+
+def builder_benchmarks() -> Dict[str, Callable[[], Any]]:
+	row = {"first_name": "John", "middle_name": None, "last_name": "Doe", "email": "jd@columbia.edu",
+		   "enrollment_year": 2020}
+	rows = [dict(row, email=f"jd{i}@columbia.edu") for i in range(100)]
+	filters = {"enrollment_year__gte": 2018, "last_name__startswith": "D", "student_id__in": [1, 2, 3]}
+	schema = TableSchema(
+		"student",
+		[Column("student_id", "int", False), Column("first_name", "varchar"), Column("middle_name", "varchar"),
+		 Column("last_name", "varchar"), Column("email", "varchar", False), Column("enrollment_year", "int")],
+		{"PRIMARY": (("student_id",), True), "email": (("email",), True)},
+	)
+	query_filters = {"enrollment_year__gte": "2018", "last_name__startswith": "D", "student_id__in": "1,2,3"}
+	return {
+		"compile_filters": lambda: compile_filters(filters),
+		"build_select_query": lambda: DB.build_select_query("student", ["first_name", "email"], {"student_id": 1}),
+		"build_select_query.filters": lambda: DB.build_select_query("student", [], filters),
+		"build_select_query.schema": lambda: DB.build_select_query(
+			"student", ["first_name", "email"], query_filters, schema=schema),
+		"build_select_query.keyset": lambda: DB.build_select_query(
+			"student", [], {"enrollment_year": 2018}, order_by="student_id", limit=100, after=500),
+		"build_insert_query": lambda: DB.build_insert_query("student", row),
+		"build_insert_many_query.100": lambda: DB.build_insert_many_query("student", rows),
+		"build_update_query": lambda: DB.build_update_query("student", {"first_name": "Joe"}, {"student_id": 1}),
+		"build_delete_query": lambda: DB.build_delete_query("student", {"student_id": 1}),
+	}
+
+
+def execute_benchmarks(db: DB, max_id: int) -> Dict[str, Callable[[], Any]]:
+	rng = random.Random(0)
+	return {
+		"execute_query.select_1": lambda: db.execute_query("SELECT 1", [], ret_result=True),
+		"execute_query.by_id": lambda: db.execute_query(
+			"SELECT * FROM student WHERE student_id = %s", [rng.randint(1, max(max_id, 1))], ret_result=True),
+		"execute_query.page": lambda: db.execute_query(
+			"SELECT * FROM student WHERE enrollment_year = %s ORDER BY student_id LIMIT %s", [2018, 100],
+			ret_result=True),
+	}
+
+
+def run_micro(db: Optional[DB] = None, min_seconds: float = 0.2, repeat: int = 5) -> Dict[str, Any]:
+	benchmarks = builder_benchmarks()
+	if db is not None:
+		benchmarks.update(execute_benchmarks(db, max_row_ids(db, ["student"])["student"]))
+	return {name: time_call(func, min_seconds, repeat) for name, func in benchmarks.items()}
+
+
+# --- Reports ---
+
+def environment() -> Dict[str, Any]:
+	return {
+		"python": platform.python_version(),
+		"platform": platform.platform(),
+		"cpus": os.cpu_count(),
+		"time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+	}
+
+
+def flatten(report: Any, prefix: str = "") -> Dict[str, float]:
+	"""Flattens the numeric values of a report into dotted keys, e.g. operations.student.get.latency_ms.p99."""
+	if isinstance(report, dict):
+		values = {}
+		for k, v in report.items():
+			values.update(flatten(v, f"{prefix}.{k}" if prefix else k))
+		return values
+	if isinstance(report, (int, float)) and not isinstance(report, bool):
+		return {prefix: float(report)}
+	return {}
+
+
+def compare(baseline: KV, current: KV, threshold: float = 0.1) -> List[Dict[str, Any]]:
+	"""Returns the metrics of current that are worse than baseline's by more than threshold (a fraction).
+
+	Throughputs regress when they drop and latencies, times per operation and round trips when they rise.
+	Other values, such as counts and the environment, are ignored.
+	"""
+	old, new = flatten(baseline.get("results")), flatten(current.get("results"))
+	regressions = []
+	for key in sorted(old.keys() & new.keys()):
+		if METRIC_HIGHER_IS_BETTER.search(key):
+			change = (old[key] - new[key]) / old[key] if old[key] else 0.0
+		elif METRIC_LOWER_IS_BETTER.search(key):
+			change = (new[key] - old[key]) / old[key] if old[key] else 0.0
+		else:
+			continue
+		if change > threshold:
+			regressions.append({"metric": key, "baseline": old[key], "current": new[key], "change": change})
+	return regressions
+
+
+def write_report(report: KV, output: Optional[str]):
+	text = json.dumps(report, indent=2, sort_keys=True)
+	if output:
+		with open(output, "w") as out_file:
+			out_file.write(text + "\n")
+	else:
+		print(text)
+
+
+def main(argv: Optional[List[str]] = None):
+	common = argparse.ArgumentParser(add_help=False)
+	common.add_argument("--host", default="localhost")
+	common.add_argument("--port", type=int, default=3306)
+	common.add_argument("--user", default="root")
+	common.add_argument("--password", default="dbuserdbuser")
+	common.add_argument("--database", default="s24_hw2")
+	common.add_argument("--seed", type=int, default=0, help="seed for the synthesized rows and the request sequence")
+	common.add_argument("--output", help="file the JSON report is written to, instead of stdout")
+
+	parser = argparse.ArgumentParser(description="Benchmarks the HW2 REST service. See the top of bench.py.")
+	commands = parser.add_subparsers(dest="command", required=True)
+
+	seed = commands.add_parser("seed", parents=[common], help="create and fill the student and employee tables")
+	seed.add_argument("--students", type=int, default=1000000)
+	seed.add_argument("--employees", type=int, default=1000000)
+	seed.add_argument("--people", default=PEOPLE_FILE, help="CSV the rows are synthesized from")
+	seed.add_argument("--reset", action="store_true", help="empty the tables first")
+	seed.add_argument("--chunk-size", type=int, default=5000, help="rows per INSERT")
+
+	load = commands.add_parser("load", parents=[common], help="drive the REST endpoints")
+	load.add_argument("--url", default="http://127.0.0.1:8002", help="the running service")
+	load.add_argument("--serve", action="store_true", help="start main.py under uvicorn instead of using --url")
+	load.add_argument("--serve-port", type=int, default=8099)
+	load.add_argument("--concurrency", type=int, default=8, help="client threads, one connection each")
+	load.add_argument("--duration", type=float, default=30.0, help="seconds measured")
+	load.add_argument("--warmup", type=float, default=5.0, help="seconds run before measuring")
+	load.add_argument("--mix", default=DEFAULT_MIX, help=f"operation weights, from {', '.join(OPERATIONS)}")
+	load.add_argument("--tables", default="student,employee")
+
+	micro = commands.add_parser("micro", parents=[common], help="time the query builders and execute_query")
+	micro.add_argument("--no-db", action="store_true", help="only time the query builders")
+	micro.add_argument("--min-seconds", type=float, default=0.2, help="minimum time of one timing run")
+	micro.add_argument("--repeat", type=int, default=5, help="timing runs, of which the best is kept")
+
+	comp = commands.add_parser("compare", parents=[common], help="exit with status 1 if current regressed from baseline")
+	comp.add_argument("baseline")
+	comp.add_argument("current")
+	comp.add_argument("--threshold", type=float, default=0.1, help="allowed relative slowdown")
+
+	args = parser.parse_args(argv)
+
+	if args.command == "compare":
+		with open(args.baseline) as f:
+			baseline = json.load(f)
+		with open(args.current) as f:
+			current = json.load(f)
+		regressions = compare(baseline, current, args.threshold)
+		write_report({"threshold": args.threshold, "regressions": regressions}, args.output)
+		sys.exit(1 if regressions else 0)
+
+	db = None
+	if not (args.command == "micro" and args.no_db):
+		db = DB(host=args.host, port=args.port, user=args.user, password=args.password, database=args.database)
+	report: Dict[str, Any] = {"command": args.command, "config": {k: v for k, v in vars(args).items() if k != "password"}, "environment": environment()}
+	try:
+		if args.command == "seed":
+			counts = {"student": args.students, "employee": args.employees}
+			report["results"] = seed_database(db, counts, args.people, args.seed, args.reset, args.chunk_size)
+		elif args.command == "load":
+			tables = [t.strip() for t in args.tables.split(",")]
+			for table in tables:
+				if table not in ID_COLUMNS:
+					parser.error(f"unknown table {table!r}")
+			max_ids = max_row_ids(db, tables)
+			server = start_server(args.serve_port) if args.serve else None
+			url = f"http://127.0.0.1:{args.serve_port}" if server else args.url
+			try:
+				report["results"] = run_load(
+					url, max_ids, parse_mix(args.mix), args.concurrency, args.duration, args.warmup, args.seed)
+			finally:
+				if server:
+					server.terminate()
+					server.wait()
+		else:
+			report["results"] = run_micro(db, args.min_seconds, args.repeat)
+	finally:
+		if db is not None:
+			db.close()
+	write_report(report, args.output)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,85 @@
+import random
+import unittest
+
+from bench import compare, make_request, parse_metrics, parse_mix, percentile, synthesize
+
+
+class BenchTest(unittest.TestCase):
+    def test_synthesize(self):
+        people = [
+            {"first_name": "A", "middle_name": "", "last_name": "X", "email": "a@x.com"},
+            {"first_name": "B", "middle_name": "M", "last_name": "Y", "email": "b@y.org"},
+        ]
+        rows = list(synthesize(people, "student", 1000, seed=1))
+        self.assertEqual(rows, list(synthesize(people, "student", 1000, seed=1)))
+        self.assertNotEqual(rows, list(synthesize(people, "student", 1000, seed=2)))
+        self.assertEqual(1000, len({r["email"] for r in rows}))
+        self.assertTrue(all(2016 <= r["enrollment_year"] <= 2023 for r in rows))
+        self.assertEqual({None, "M"}, {r["middle_name"] for r in rows})
+
+        rows = list(synthesize(people, "employee", 10))
+        self.assertTrue(all(r["employee_type"] in ("Professor", "Lecturer", "Staff") for r in rows))
+        self.assertTrue(all("enrollment_year" not in r for r in rows))
+
+    def test_parse_mix(self):
+        self.assertEqual({"get": 0.75, "delete": 0.25}, parse_mix("get=3, delete=1,list=0"))
+        with self.assertRaises(ValueError):
+            parse_mix("get=1,patch=1")
+        with self.assertRaises(ValueError):
+            parse_mix("get=0")
+
+    def test_make_request(self):
+        rng = random.Random(0)
+        method, path, body = make_request("get", "student", rng, 10, "s")
+        self.assertEqual("GET", method)
+        self.assertTrue(1 <= int(path.rsplit("/", 1)[1]) <= 10)
+        self.assertIsNone(body)
+
+        method, path, body = make_request("create", "employee", rng, 10, "s1")
+        self.assertEqual(("POST", "/employees", "bench.s1@example.com"), (method, path, body["email"]))
+        self.assertIn("employee_type", body)
+
+        self.assertTrue(make_request("list", "student", rng, 10, "s")[1].startswith("/students?enrollment_year="))
+
+    def test_percentile(self):
+        values = [float(v) for v in range(1, 101)]
+        self.assertEqual(50.0, percentile(values, 50))
+        self.assertEqual(99.0, percentile(values, 99))
+        self.assertEqual(100.0, percentile(values, 100))
+        self.assertEqual(7.0, percentile([7.0], 95))
+        self.assertEqual(0.0, percentile([], 50))
+
+    def test_parse_metrics(self):
+        text = "\n".join([
+            "# TYPE db_query_duration_seconds histogram",
+            'db_query_duration_seconds_count{statement="SELECT 1"} 3',
+            'db_query_duration_seconds_count{statement="SELECT {x} 2"} 4',
+            "db_slow_queries_total 1",
+            "",
+        ])
+        self.assertEqual(
+            {"db_query_duration_seconds_count": 7.0, "db_slow_queries_total": 1.0}, parse_metrics(text)
+        )
+
+    def test_compare(self):
+        baseline = {"results": {
+            "requests_per_second": 100.0,
+            "latency_ms": {"p99": 10.0},
+            "requests": 1000,
+            "build_select_query": {"ns_per_op": 500.0},
+        }}
+        current = {"results": {
+            "requests_per_second": 80.0,
+            "latency_ms": {"p99": 10.5},
+            "requests": 10,
+            "build_select_query": {"ns_per_op": 1000.0},
+        }}
+        regressions = compare(baseline, current, threshold=0.1)
+        self.assertEqual(
+            ["build_select_query.ns_per_op", "requests_per_second"], [r["metric"] for r in regressions]
+        )
+        self.assertEqual([], compare(current, baseline, threshold=0.1))
+
+
+if __name__ == '__main__':
+    unittest.main()
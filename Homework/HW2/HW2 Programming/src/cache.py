@@ -0,0 +1,143 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Set, Tuple
+
+# Type definitions
+# Key-value pairs
+KV = Dict[str, Any]
+# A cache key: (table, columns, sorted filter items, page)
+Key = Tuple[str, Tuple[str, ...], Tuple[Tuple[str, Hashable], ...], Tuple]
+
+
+def estimate_size(rows: List[KV]) -> int:
+	"""Roughly estimates the memory held by a list of rows, in bytes."""
+	size = sys.getsizeof(rows)
+	for row in rows:
+		size += sys.getsizeof(row)
+		for k, v in row.items():
+			size += sys.getsizeof(k) + sys.getsizeof(v)
+	return size
+
+
+class ResultCache:
+	def __init__(self, ttl: float = 30.0, max_entries: int = 10000, max_bytes: int = 64 * 1024 * 1024):
+		"""An in-process, thread-safe cache of select results with TTL and LRU eviction.
+
+		Entries are grouped by table so that a write to a table can drop every cached result for it.
+
+		:param ttl: Seconds an entry stays valid
+		:param max_entries: The maximum number of cached results
+		:param max_bytes: The maximum estimated memory held by cached results
+		"""
+		self.ttl = ttl
+		self.max_entries = max_entries
+		self.max_bytes = max_bytes
+
+		self._lock = threading.Lock()
+		# key -> (expires_at, size, rows), least recently used first
+		self._entries: "OrderedDict[Key, Tuple[float, int, List[KV]]]" = OrderedDict()
+		self._by_table: Dict[str, Set[Key]] = {}
+		# Bumped on every invalidation so that a select that raced a write doesn't store stale rows
+		self._versions: Dict[str, int] = {}
+		self._bytes = 0
+
+		self._hits = 0
+		self._misses = 0
+		self._evictions = 0
+		self._invalidations = 0
+
+	@staticmethod
+	def make_key(table: str, columns: List[str], filters: KV, page: Tuple = ()) -> Optional[Key]:
+		"""Returns the cache key for a select, or None if a filter value can't be hashed. Lists count as tuples.
+
+		:param page: Anything else that shapes the result, such as the ordering and limit
+		"""
+		try:
+			items = tuple(sorted((k, tuple(v) if isinstance(v, list) else v) for k, v in filters.items()))
+			key = (table, tuple(columns), items, page)
+			hash(key)
+		except TypeError:
+			return None
+		return key
+
+	def version(self, table: str) -> int:
+		"""Returns the table's write version. Pass it to put to detect writes made during the select."""
+		with self._lock:
+			return self._versions.get(table, 0)
+
+	def get(self, key: Key) -> Optional[List[KV]]:
+		"""Returns a copy of the cached rows, or None on a miss."""
+		with self._lock:
+			entry = self._entries.get(key)
+			if entry is not None and entry[0] < time.monotonic():
+				self._remove(key)
+				entry = None
+			if entry is None:
+				self._misses += 1
+				return None
+			self._entries.move_to_end(key)
+			self._hits += 1
+			rows = entry[2]
+		return [dict(row) for row in rows]
+
+	def put(self, key: Key, rows: List[KV], version: int):
+		"""Caches rows, unless the table was written to since version was read."""
+		size = estimate_size(rows)
+		if size > self.max_bytes:
+			return
+		rows = [dict(row) for row in rows]
+		table = key[0]
+		with self._lock:
+			if self._versions.get(table, 0) != version:
+				return
+			if key in self._entries:
+				self._remove(key)
+			self._entries[key] = (time.monotonic() + self.ttl, size, rows)
+			self._by_table.setdefault(table, set()).add(key)
+			self._bytes += size
+			while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+				self._remove(next(iter(self._entries)))
+				self._evictions += 1
+
+	def invalidate(self, table: str):
+		"""Drops every cached result for table."""
+		with self._lock:
+			self._versions[table] = self._versions.get(table, 0) + 1
+			for key in self._by_table.pop(table, set()):
+				self._remove(key)
+				self._invalidations += 1
+
+	def clear(self):
+		with self._lock:
+			for table in list(self._by_table):
+				self._versions[table] = self._versions.get(table, 0) + 1
+			self._entries.clear()
+			self._by_table.clear()
+			self._bytes = 0
+
+	def _remove(self, key: Key):
+		_, size, _ = self._entries.pop(key)
+		self._bytes -= size
+		keys = self._by_table.get(key[0])
+		if keys is not None:
+			keys.discard(key)
+
+	def stats(self) -> KV:
+		"""Returns a snapshot of the cache's counters.
+
+		:returns: A dict with the current entries and estimated bytes, and cumulative hits, misses,
+					hit_ratio, evictions and invalidations
+		"""
+		with self._lock:
+			lookups = self._hits + self._misses
+			return {
+				"entries": len(self._entries),
+				"bytes": self._bytes,
+				"hits": self._hits,
+				"misses": self._misses,
+				"hit_ratio": self._hits / lookups if lookups else 0.0,
+				"evictions": self._evictions,
+				"invalidations": self._invalidations,
+			}
@@ -0,0 +1,48 @@
+import unittest
+
+from cache import ResultCache
+
+
+class ResultCacheTest(unittest.TestCase):
+    def test_hit_and_invalidate(self):
+        cache = ResultCache()
+        key = cache.make_key("student", [], {"student_id": 1})
+        self.assertIsNone(cache.get(key))
+
+        cache.put(key, [{"student_id": 1}], cache.version("student"))
+        self.assertEqual([{"student_id": 1}], cache.get(key))
+
+        cache.invalidate("student")
+        self.assertIsNone(cache.get(key))
+        self.assertEqual({"hits": 1, "misses": 2, "invalidations": 1},
+                         {k: cache.stats()[k] for k in ("hits", "misses", "invalidations")})
+
+    def test_put_after_concurrent_write_is_dropped(self):
+        cache = ResultCache()
+        key = cache.make_key("student", [], {})
+        version = cache.version("student")
+        cache.invalidate("student")
+
+        cache.put(key, [{"student_id": 1}], version)
+        self.assertIsNone(cache.get(key))
+
+    def test_expiry_and_eviction(self):
+        cache = ResultCache(ttl=0, max_entries=2)
+        key = cache.make_key("student", [], {})
+        cache.put(key, [], 0)
+        self.assertIsNone(cache.get(key))
+
+        cache = ResultCache(max_entries=2)
+        keys = [cache.make_key("student", [], {"student_id": i}) for i in range(3)]
+        for key in keys:
+            cache.put(key, [], 0)
+        self.assertIsNone(cache.get(keys[0]))
+        self.assertEqual([], cache.get(keys[2]))
+        self.assertEqual(1, cache.stats()["evictions"])
+
+    def test_unhashable_filters_are_not_cached(self):
+        self.assertIsNone(ResultCache.make_key("student", [], {"student_id": {"a": 1}}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,21 @@
-from typing import Any, Dict, List, Tuple, Union
+import asyncio
+import functools
+import logging
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple, Union
 
 import pymysql
+from pymysql.constants import CLIENT
+
+from cache import ResultCache
+from metrics import QueryMetrics
+from pool import ConnectionPool
+from schema import COLUMNS_QUERY, INDEXES_QUERY, SchemaError, TableSchema, build_schemas
 
 # Type definitions
 # Key-value pairs
@@ -8,21 +23,423 @@ KV = Dict[str, Any]
 # A Query consists of a string (possibly with placeholders) and a list of values to be put in the placeholders
 Query = Tuple[str, List]
 
+logger = logging.getLogger(__name__)
+
+# Conservative default for the server's max_allowed_packet (MySQL 5.7 ships with 4 MB)
+MAX_PACKET_BYTES = 4 * 1024 * 1024
+# The number of distinct statement shapes kept by each SQL template cache
+STATEMENT_CACHE_SIZE = 1024
+# Statements that are EXPLAINed when they are slow (see metrics.QueryMetrics)
+EXPLAINABLE_STATEMENTS = ("select", "insert", "update", "delete", "replace")
+
+# MySQL error codes that _execute raises as DuplicateKey or ConstraintViolation
+ER_DUP_ENTRY = 1062
+CONSTRAINT_ERRORS = {
+	1048,  # ER_BAD_NULL_ERROR: NULL in a NOT NULL column
+	1216, 1217, 1451, 1452,  # Foreign key violations
+	1264,  # ER_WARN_DATA_OUT_OF_RANGE (strict mode)
+	1265,  # WARN_DATA_TRUNCATED, e.g. a value that isn't one of an ENUM's (strict mode)
+	3819,  # ER_CHECK_CONSTRAINT_VIOLATED
+	4025,  # MariaDB's ER_CONSTRAINT_FAILED
+}
+_DUPLICATE_ENTRY = re.compile(r"Duplicate entry '(.*)' for key '(?:[^']*\.)?([^'.]*)'", re.S)
+# Table and column names that may be put into SQL text: letters, digits, _ and $, not starting with a digit
+_IDENTIFIER = re.compile(r"[A-Za-z_$][A-Za-z0-9_$]*")
+
+
+class ConstraintViolation(pymysql.err.IntegrityError):
+	"""A write broke a constraint, e.g. NOT NULL or a CHECK. Its args are the MySQL error code and message."""
+
+	@property
+	def code(self) -> int:
+		return self.args[0]
+
+	@property
+	def message(self) -> str:
+		return self.args[1] if len(self.args) > 1 else ""
+
+
+class DuplicateKey(ConstraintViolation):
+	"""A write would have duplicated a PRIMARY KEY or UNIQUE value.
+
+	key is the name of the violated index (for a single-column UNIQUE constraint, usually the column's name)
+	and value the duplicated value, as reported by MySQL.
+	"""
+
+	def __init__(self, *args):
+		super().__init__(*args)
+		m = _DUPLICATE_ENTRY.search(self.message)
+		self.value, self.key = m.groups() if m else (None, None)
+
+
+class RowsNotFound(LookupError):
+	"""A batch update or delete matched fewer rows than it named, e.g. because another process deleted them."""
+
+
+def translate_error(e: Exception) -> Exception:
+	"""Returns the DuplicateKey or ConstraintViolation for a MySQL constraint error, or e itself for anything else."""
+	if not isinstance(e, pymysql.err.MySQLError) or not e.args:
+		return e
+	if e.args[0] == ER_DUP_ENTRY:
+		return DuplicateKey(*e.args)
+	if e.args[0] in CONSTRAINT_ERRORS:
+		return ConstraintViolation(*e.args)
+	return e
+
+
+# Filter operators. A filter key may end in __<operator>, e.g. {"enrollment_year__gte": 2020}.
+# Keys without an operator compare with =.
+COMPARISON_OPERATORS = {"eq": "=", "ne": "<>", "gt": ">", "gte": ">=", "lt": "<", "lte": "<="}
+LIKE_OPERATORS = {"startswith": "{}%", "endswith": "%{}", "contains": "%{}%"}
+FILTER_OPERATORS = set(COMPARISON_OPERATORS) | set(LIKE_OPERATORS) | {"in", "isnull"}
+# Operators that can narrow a lookup with an index on their column. <>, and LIKE patterns that start with a
+# wildcard, can't.
+INDEXABLE_OPERATORS = (set(COMPARISON_OPERATORS) - {"ne"}) | {"in", "isnull", "startswith"}
+
+# The shape of compiled filters: (attribute, operator, n) per filter, where n is the number of values
+# for in, 1 or 0 for isnull true or false, and 0 otherwise
+FilterShape = Tuple[Tuple[str, str, int], ...]
+
+
+def quote_identifier(name: str) -> str:
+	"""Returns a table or column name quoted for SQL text, e.g. first_name -> `first_name`.
+
+	Names are checked even when no schema is loaded, since they may come from a request.
+
+	:raises SchemaError: If name isn't a plain identifier
+	"""
+	if not isinstance(name, str) or not _IDENTIFIER.fullmatch(name):
+		raise SchemaError(f"{name!r} is not a valid table or column name")
+	return f"`{name}`"
+
+
+def split_filter_key(key: str) -> Tuple[str, str]:
+	"""Splits a filter key into its attribute and operator, e.g. "email__startswith" -> ("email", "startswith")."""
+	column, sep, op = key.rpartition("__")
+	if sep and op in FILTER_OPERATORS:
+		return column, op
+	return key, "eq"
+
+
+def escape_like(value: Any) -> str:
+	return str(value).replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def compile_filters(filters: KV) -> Tuple[FilterShape, List]:
+	"""Compiles filters into their shape, which determines the SQL, and their placeholder arguments.
+
+	in takes a list or a comma-separated string. isnull takes a bool or "true"/"false".
+	"""
+	shape, args = [], []
+	for key, value in filters.items():
+		column, op = split_filter_key(key)
+		n = 0
+		if op == "in":
+			values = value.split(",") if isinstance(value, str) else list(value)
+			n = len(values)
+			args.extend(values)
+		elif op == "isnull":
+			n = int(value is True or str(value).lower() in ("1", "true", "yes"))
+		elif op in LIKE_OPERATORS:
+			args.append(LIKE_OPERATORS[op].format(escape_like(value)))
+		else:
+			args.append(value)
+		shape.append((column, op, n))
+	return tuple(shape), args
+
+
+def parse_bool(value: Any) -> bool:
+	if isinstance(value, bool):
+		return value
+	text = str(value).lower()
+	if text in ("1", "true", "yes"):
+		return True
+	if text in ("0", "false", "no"):
+		return False
+	raise ValueError(value)
+
+
+def coerce_filters(schema: TableSchema, filters: KV) -> KV:
+	"""Checks that every filter is on one of schema's columns and converts its values to the column's type.
+
+	in becomes a list of converted values, isnull a bool and the LIKE operators a string.
+
+	:raises SchemaError: For an unknown column or a value that can't be converted
+	"""
+	coerced = {}
+	for key, value in filters.items():
+		name, op = split_filter_key(key)
+		column = schema.column(name)
+		if op == "in":
+			values = value.split(",") if isinstance(value, str) else list(value)
+			coerced[key] = [column.convert(v) for v in values]
+		elif op == "isnull":
+			try:
+				coerced[key] = parse_bool(value)
+			except ValueError:
+				raise SchemaError(f"{key} must be true or false") from None
+		elif op in LIKE_OPERATORS:
+			coerced[key] = str(value)
+		else:
+			coerced[key] = column.convert(value)
+	return coerced
+
+
+def unindexed_filters(schema: TableSchema, filters: KV) -> List[str]:
+	"""Returns the filter keys if none of them can use an index, so the query would scan the whole table.
+
+	:returns: An empty list if a filter can use an index, or there are no filters
+	:raises SchemaError: If a filter isn't on one of schema's columns
+	"""
+	keys = []
+	for key in filters:
+		name, op = split_filter_key(key)
+		schema.column(name)
+		if op in INDEXABLE_OPERATORS and schema.is_indexed(name):
+			return []
+		keys.append(key)
+	return keys
+
+
+def _filter_template(column: str, op: str, n: int) -> str:
+	column = quote_identifier(column)
+	if op == "in":
+		return f"{column} IN ({', '.join(['%s'] * n)})" if n else "FALSE"
+	if op == "isnull":
+		return f"{column} IS NULL" if n else f"{column} IS NOT NULL"
+	if op in LIKE_OPERATORS:
+		return f"{column} LIKE %s"
+	return f"{column} {COMPARISON_OPERATORS[op]} %s"
+
+
+# SQL templates, memoized on the statement's shape (table, columns, filter shape) so that repeated
+# queries only need their argument lists assembled.
+
+@functools.lru_cache(maxsize=STATEMENT_CACHE_SIZE)
+def _where_template(filters: FilterShape) -> str:
+	if not filters:
+		return ""
+	return " WHERE " + " AND ".join(_filter_template(*f) for f in filters)
+
+
+@functools.lru_cache(maxsize=STATEMENT_CACHE_SIZE)
+def _select_template(
+	table: str,
+	columns: Tuple[str, ...],
+	filters: FilterShape,
+	order_by: Optional[str] = None,
+	limit: bool = False,
+	seek: bool = False,
+) -> str:
+	selected = ", ".join(map(quote_identifier, columns)) if columns else "*"
+	query = f"SELECT {selected} FROM {quote_identifier(table)}" + _where_template(filters)
+	if order_by:
+		descending = order_by.startswith("-")
+		column = quote_identifier(order_by[1:] if descending else order_by)
+		if seek:
+			query += (" AND " if filters else " WHERE ") + f"{column} {'<' if descending else '>'} %s"
+		query += f" ORDER BY {column}{' DESC' if descending else ''}"
+	if limit:
+		query += " LIMIT %s"
+	return query
+
+
+@functools.lru_cache(maxsize=STATEMENT_CACHE_SIZE)
+def _insert_template(table: str, columns: Tuple[str, ...]) -> str:
+	return (
+		f"INSERT INTO {quote_identifier(table)} ({', '.join(map(quote_identifier, columns))}) "
+		f"VALUES ({', '.join(['%s'] * len(columns))})"
+	)
+
+
+@functools.lru_cache(maxsize=STATEMENT_CACHE_SIZE)
+def _update_template(table: str, columns: Tuple[str, ...], filters: FilterShape) -> str:
+	assignments = ", ".join(f"{quote_identifier(k)} = %s" for k in columns)
+	return f"UPDATE {quote_identifier(table)} SET {assignments}" + _where_template(filters)
+
+
+@functools.lru_cache(maxsize=STATEMENT_CACHE_SIZE)
+def _delete_template(table: str, filters: FilterShape) -> str:
+	return f"DELETE FROM {quote_identifier(table)}" + _where_template(filters)
+
+
+_TEMPLATES = {
+	"select": _select_template,
+	"insert": _insert_template,
+	"update": _update_template,
+	"delete": _delete_template,
+}
+
+
 class DB:
-	def __init__(self, host: str, port: int, user: str, password: str, database: str):
-		conn = pymysql.connect(
-			host=host,
-			port=port,
-			user=user,
-			password=password,
-			database=database,
-			cursorclass=pymysql.cursors.DictCursor,
-			autocommit=True,
+	def __init__(
+		self,
+		host: str,
+		port: int,
+		user: str,
+		password: str,
+		database: str,
+		min_size: int = 1,
+		max_size: int = 10,
+		timeout: float = 10.0,
+		max_idle: float = 300.0,
+		max_lifetime: float = 3600.0,
+		cache: Optional[ResultCache] = None,
+		local_infile: bool = False,
+		metrics: Optional[QueryMetrics] = None,
+		reject_unindexed: bool = False,
+	):
+		"""Connects to a database through a bounded connection pool.
+
+		:param min_size: Connections opened up front and kept open while idle
+		:param max_size: Upper bound on open connections
+		:param timeout: Seconds to wait for a free connection before raising pool.PoolTimeout
+		:param max_idle: Seconds an idle connection (beyond min_size) is kept before it is closed
+		:param max_lifetime: Seconds after which a connection is replaced
+		:param cache: If given, select results are cached in it. insert, insert_many, update, delete and
+						prepared writes invalidate the cached results of the table they write to; statements
+						run directly through execute_query do not.
+		:param local_infile: Allows LOAD DATA LOCAL INFILE on the pooled connections
+		:param metrics: If given, every statement's latency, rows and errors are recorded in it, and slow
+						statements are logged with their EXPLAIN output
+		:param reject_unindexed: If True, a select, update or delete whose filters can't use an index raises
+						SchemaError instead of scanning the table. If refresh_schemas hasn't been called, the
+						schemas are loaded on first use, and a table that isn't in them is rejected too.
+		"""
+		def connect():
+			return pymysql.connect(
+				host=host,
+				port=port,
+				user=user,
+				password=password,
+				database=database,
+				cursorclass=pymysql.cursors.DictCursor,
+				autocommit=True,
+				local_infile=local_infile,
+				# UPDATE reports the rows matched rather than changed, so 0 always means nothing matched
+				client_flag=CLIENT.FOUND_ROWS,
+			)
+
+		self.pool = ConnectionPool(
+			connect,
+			min_size=min_size,
+			max_size=max_size,
+			timeout=timeout,
+			max_idle=max_idle,
+			max_lifetime=max_lifetime,
 		)
-		self.conn = conn
+		self.cache = cache
+		self.metrics = metrics
+		self.reject_unindexed = reject_unindexed
+		# Table schemas from information_schema, see refresh_schemas. None until they are loaded.
+		self.schemas: Optional[Dict[str, TableSchema]] = None
+		self._schemas_lock = threading.Lock()
+		# (table, filter keys) of the unindexed filters already logged
+		self._unindexed_logged: Set[Tuple[str, Tuple[str, ...]]] = set()
+		# Per-table write counters, see write_version. The epoch tells this DB's counters from another process's.
+		self._epoch = uuid.uuid4().hex[:8]
+		self._versions: Dict[str, int] = {}
+		self._versions_lock = threading.Lock()
 
-	def get_cursor(self):
-		return self.conn.cursor()
+	@contextmanager
+	def connection(self) -> Iterator[pymysql.connections.Connection]:
+		"""Borrows a pooled connection for the duration of a with block."""
+		with self.pool.connection() as conn:
+			yield conn
+
+	@contextmanager
+	def transaction(self) -> Iterator[pymysql.connections.Connection]:
+		"""Borrows a pooled connection and runs the with block in one transaction.
+
+		The transaction is committed if the block succeeds and rolled back if it raises.
+		"""
+		with self.connection() as conn:
+			conn.begin()
+			try:
+				yield conn
+			except BaseException:
+				conn.rollback()
+				raise
+			else:
+				conn.commit()
+
+	def invalidate(self, table: str):
+		"""Drops the cached select results for table and bumps its write version.
+
+		Call it after writing to table through execute_query.
+		"""
+		with self._versions_lock:
+			self._versions[table] = self._versions.get(table, 0) + 1
+		if self.cache is not None:
+			self.cache.invalidate(table)
+
+	def write_version(self, table: str) -> str:
+		"""Returns a token that changes whenever this DB writes to table.
+
+		The version is bumped after the write commits, so a token read before a select is never newer than
+		the rows the select returns. Writes made by other processes, or through execute_query without
+		invalidate, don't change it.
+		"""
+		with self._versions_lock:
+			return f"{self._epoch}.{self._versions.get(table, 0)}"
+
+	def cache_stats(self) -> Optional[KV]:
+		"""Returns the result cache's counters (see ResultCache.stats), or None if there is no cache."""
+		return self.cache.stats() if self.cache is not None else None
+
+	def pool_stats(self) -> KV:
+		"""Returns the connection pool's counters. See ConnectionPool.stats."""
+		return self.pool.stats()
+
+	def close(self):
+		self.pool.close()
+
+	def refresh_schemas(self) -> Dict[str, TableSchema]:
+		"""Loads the columns and indexes of every table in the database from information_schema.
+
+		Call it once at startup, and again after changing the tables. Until it is called, queries aren't
+		checked, unless reject_unindexed is set, which loads the schemas on first use. Afterwards, the query builders and the methods that run them check the columns and
+		filters of every table in the database, and convert filter values to the columns' types.
+		"""
+		columns = self.execute_query(COLUMNS_QUERY, [], ret_result=True)
+		indexes = self.execute_query(INDEXES_QUERY, [], ret_result=True)
+		self.schemas = build_schemas(columns, indexes)
+		return self.schemas
+
+	def table_schema(self, table: str) -> Optional[TableSchema]:
+		"""Returns table's cached schema, or None if the schemas aren't loaded or table wasn't in the database then."""
+		return self.schemas.get(table) if self.schemas is not None else None
+
+	def _load_schemas(self) -> Dict[str, TableSchema]:
+		"""Returns the schemas, loading them first if they haven't been. Concurrent callers load them once."""
+		with self._schemas_lock:
+			if self.schemas is None:
+				self.refresh_schemas()
+			return self.schemas
+
+	def _checked_schema(self, table: str, filters: KV) -> Optional[TableSchema]:
+		"""Returns table's schema, after flagging filters that can't use an index. See reject_unindexed."""
+		schema = self.table_schema(table)
+		if schema is None:
+			if not self.reject_unindexed:
+				return None
+			# Fail closed: a filter that can't be checked might scan the table
+			schema = self._load_schemas().get(table)
+			if schema is None:
+				raise SchemaError(f"{table} has no schema, so its filters can't be checked for an index")
+		keys = unindexed_filters(schema, filters)
+		if not keys:
+			return schema
+
+		if self.metrics is not None:
+			self.metrics.record_unindexed(table, keys)
+		shape = (table, tuple(sorted(keys)))
+		if shape not in self._unindexed_logged:
+			self._unindexed_logged.add(shape)
+			logger.warning("no index on %s can serve filters %s; the query scans the table", table, ", ".join(keys))
+		if self.reject_unindexed:
+			raise SchemaError(f"no index on {table} can serve filters {', '.join(keys)}")
+		return schema
 
 	def execute_query(self, query: str, args: List, ret_result: bool) -> Union[List[KV], int]:
 		"""Executes a query.
@@ -35,47 +452,282 @@ class DB:
 							of rows affected.
 		:returns: a list of dicts or a number, depending on ret_result
 		"""
-		cur = self.get_cursor()
-		count = cur.execute(query, args=args)
-		if ret_result:
-			return cur.fetchall()
-		else:
-			return count
+		with self.connection() as conn:
+			with conn.cursor() as cur:
+				count, rows = self._execute(cur, query, args, fetch=ret_result)
+				if ret_result:
+					return rows
+				else:
+					return count
+
+	def _execute(
+		self,
+		cur: pymysql.cursors.Cursor,
+		query: str,
+		args: Any,
+		fetch: bool = False,
+		many: bool = False,
+		explain: bool = True,
+	) -> Tuple[int, Optional[List[KV]]]:
+		"""Runs cur.execute (or cur.executemany if many), recording it in self.metrics.
+
+		Constraint errors are raised as DuplicateKey or ConstraintViolation, see translate_error.
 
+		:param fetch: If True, the rows are fetched too, and counted instead of the rows affected
+		:param explain: If False, a slow statement is logged without EXPLAIN, e.g. on an unbuffered
+						cursor whose rows haven't been read yet
+		:returns: The number of rows affected, and the rows if fetch is True
+		"""
+		start = time.perf_counter()
+		try:
+			count = cur.executemany(query, args) if many else cur.execute(query, args)
+			rows = cur.fetchall() if fetch else None
+		except Exception as e:
+			if self.metrics is not None:
+				self.metrics.record(query, time.perf_counter() - start, 0, error=True)
+			typed = translate_error(e)
+			if typed is e:
+				raise
+			raise typed from e
+		if self.metrics is None:
+			return count, rows
+
+		seconds = time.perf_counter() - start
+		n = len(rows) if fetch else count
+		if self.metrics.record(query, seconds, n):
+			plan = None
+			if explain and not many and query.lstrip()[:7].lower().startswith(EXPLAINABLE_STATEMENTS) \
+					and self.metrics.should_explain(query):
+				try:
+					cur.execute("EXPLAIN " + query, args)
+					plan = cur.fetchall()
+				except Exception:
+					pass
+			self.metrics.log_slow(query, seconds, n, plan)
+		return count, rows
 
-	# TODO: all methods below
+	@staticmethod
+	def statement_cache_stats() -> KV:
+		"""Returns the hit/miss counters of the SQL template caches.
 
+		:returns: A dict with the total hits, misses and cached shapes, plus the same counters per statement kind
+		"""
+		stats: KV = {"hits": 0, "misses": 0, "size": 0}
+		for kind, template in _TEMPLATES.items():
+			info = template.cache_info()
+			stats[kind] = {"hits": info.hits, "misses": info.misses, "size": info.currsize}
+			stats["hits"] += info.hits
+			stats["misses"] += info.misses
+			stats["size"] += info.currsize
+		return stats
 
 	@staticmethod
-	def build_select_query(table: str, columns: List[str], filters: KV) -> Query:
+	def clear_statement_cache():
+		for template in _TEMPLATES.values():
+			template.cache_clear()
+		_where_template.cache_clear()
+
+	def prepare(
+		self, kind: str, table: str, columns: Sequence[str] = (), filter_keys: Sequence[str] = ()
+	) -> Callable[..., Union[List[KV], int]]:
+		"""Builds a statement once and returns a callable that runs it with new arguments.
+
+		For instance,
+			get_student = db.prepare("select", "student", [], ["student_id"])
+			get_student(1)
+		runs SELECT * FROM `student` WHERE `student_id` = %s with [1].
+
+		:param kind: One of select, insert, update or delete
+		:param table: The table the statement runs against
+		:param columns: The attributes to select (select), insert (insert) or set (update). Ignored for delete.
+		:param filter_keys: The filter keys the rows must satisfy (select, update and delete). Ignored for insert.
+							Only the comparison operators (eq, ne, gt, gte, lt, lte) can be prepared.
+		:returns: A callable that takes the column values (insert and update) followed by the filter
+					values (select, update and delete) as positional arguments. It returns the selected rows
+					for select and the number of rows affected otherwise.
+		"""
+		columns = tuple(columns)
+		filters = tuple((*split_filter_key(k), 0) for k in filter_keys)
+		if any(op not in COMPARISON_OPERATORS for _, op, _ in filters):
+			raise ValueError("only comparison operators can be prepared")
+		if kind == "select":
+			query, arity = _select_template(table, columns, filters), len(filters)
+		elif kind == "insert":
+			query, arity = _insert_template(table, columns), len(columns)
+		elif kind == "update":
+			query, arity = _update_template(table, columns, filters), len(columns) + len(filters)
+		elif kind == "delete":
+			query, arity = _delete_template(table, filters), len(filters)
+		else:
+			raise ValueError(f"unknown statement kind {kind!r}")
+		ret_result = kind == "select"
+
+		def run(*args) -> Union[List[KV], int]:
+			if len(args) != arity:
+				raise TypeError(f"{query!r} takes {arity} arguments but {len(args)} were given")
+			if ret_result:
+				return self.execute_query(query, list(args), ret_result)
+			try:
+				return self.execute_query(query, list(args), ret_result)
+			finally:
+				self.invalidate(table)
+
+		run.query = query
+		return run
+
+	@staticmethod
+	def build_select_query(
+		table: str,
+		columns: List[str],
+		filters: KV,
+		order_by: Optional[str] = None,
+		limit: Optional[int] = None,
+		after: Any = None,
+		schema: Optional[TableSchema] = None,
+	) -> Query:
 		"""Builds a query that selects rows. See db_test for examples.
 
 		:param table: The table to be selected from
 		:param columns: The attributes to select. If empty, then selects all columns.
-		:param filters: Key-value pairs that the rows from table must satisfy
+		:param filters: Key-value pairs that the rows from table must satisfy. A key may end in __<operator>,
+						e.g. enrollment_year__gte or student_id__in. See FILTER_OPERATORS.
+		:param order_by: An attribute to sort by, prefixed with - for descending order
+		:param limit: The maximum number of rows to select
+		:param after: For keyset (seek) pagination: only select rows whose order_by attribute comes after
+						this value. Pass the last row of the previous page, so that every page costs
+						the same index range scan no matter how deep it is.
+		:param schema: If given, columns, order_by and filters are checked against it and filter values are
+						converted to their columns' types. See coerce_filters.
 		:returns: A query string and any placeholder arguments
 		"""
-		pass
+		if after is not None and not order_by:
+			raise ValueError("after requires order_by")
+		if schema is not None:
+			schema.check_columns(columns)
+			if order_by:
+				schema.column(order_by.lstrip("-"))
+			filters = coerce_filters(schema, filters)
+
+		shape, args = compile_filters(filters)
+		query = _select_template(table, tuple(columns), shape, order_by, limit is not None, after is not None)
+		if after is not None:
+			args.append(after)
+		if limit is not None:
+			args.append(limit)
+		return query, args
 
-	def select(self, table: str, columns: List[str], filters: KV) -> List[KV]:
+	def select(
+		self,
+		table: str,
+		columns: List[str],
+		filters: KV,
+		order_by: Optional[str] = None,
+		limit: Optional[int] = None,
+		after: Any = None,
+		cached: bool = True,
+	) -> List[KV]:
 		"""Runs a select statement. You should use build_select_query and execute_query.
 
 		:param table: The table to be selected from
 		:param columns: The attributes to select. If empty, then selects all columns.
 		:param filters: Key-value pairs that the rows to be selected must satisfy
+		:param order_by: An attribute to sort by, prefixed with - for descending order
+		:param limit: The maximum number of rows to select
+		:param after: Only select rows whose order_by attribute comes after this value. See build_select_query.
+		:param cached: If False, the rows are read from the database even if the result cache holds them,
+						e.g. to validate a write against rows that another process may have changed
 		:returns: The selected rows
 		"""
-		pass
+		schema = self._checked_schema(table, filters)
+		page = (order_by, limit, after)
+		key = self.cache.make_key(table, columns, filters, page) if self.cache is not None and cached else None
+		if key is None:
+			query, args = self.build_select_query(table, columns, filters, *page, schema=schema)
+			return self.execute_query(query, args, ret_result=True)
+
+		rows = self.cache.get(key)
+		if rows is None:
+			version = self.cache.version(table)
+			query, args = self.build_select_query(table, columns, filters, *page, schema=schema)
+			rows = self.execute_query(query, args, ret_result=True)
+			self.cache.put(key, rows, version)
+		return rows
+
+	def select_by_ids(
+		self, table: str, id_column: str, ids: Iterable[Any], columns: List[str] = (), chunk_size: int = 1000
+	) -> Dict[Any, KV]:
+		"""Selects many rows by primary key with one WHERE id IN (...) query per chunk of IDs.
+
+		The rows are read from the database, not the result cache, so they reflect writes made by other
+		processes since the last cached select.
+
+		:param table: The table to be selected from
+		:param id_column: The table's primary key
+		:param ids: The IDs to be matched. Duplicates are looked up once.
+		:param columns: The attributes to select. If empty, then selects all columns.
+		:param chunk_size: The maximum number of IDs per query
+		:returns: The found rows keyed by ID. IDs that don't exist are absent.
+		"""
+		ids = list(dict.fromkeys(ids))
+		hide_id = bool(columns) and id_column not in columns
+		columns = list(columns) + [id_column] if hide_id else list(columns)
+
+		found = {}
+		for i in range(0, len(ids), chunk_size):
+			for row in self.select(table, columns, {f"{id_column}__in": ids[i:i + chunk_size]}, cached=False):
+				found[row.pop(id_column) if hide_id else row[id_column]] = row
+		return found
+
+	def iter_select_batches(
+		self, table: str, columns: List[str], filters: KV, batch_size: int = 1000
+	) -> Iterator[List[KV]]:
+		"""Runs a select statement on an unbuffered server-side cursor and yields the rows in batches.
+
+		Only one batch is held in client memory at a time. The generator holds a pooled connection until it
+		is exhausted or closed. If it is closed before the last batch, the connection is discarded rather
+		than returned to the pool: closing the cursor would read the rest of the result, a full scan.
+
+		:param table: The table to be selected from
+		:param columns: The attributes to select. If empty, then selects all columns.
+		:param filters: Key-value pairs that the rows to be selected must satisfy
+		:param batch_size: The number of rows fetched from the server at a time
+		:returns: A generator of lists of at most batch_size rows
+		"""
+		schema = self._checked_schema(table, filters)
+		query, args = self.build_select_query(table, columns, filters, schema=schema)
+		conn = self.pool.acquire()
+		discard = True
+		try:
+			cur = conn.cursor(pymysql.cursors.SSDictCursor)
+			self._execute(cur, query, args, explain=False)
+			while True:
+				batch = cur.fetchmany(batch_size)
+				if not batch:
+					cur.close()
+					discard = False
+					return
+				yield batch
+		finally:
+			# Closing the connection makes the server abandon the rest of the query
+			self.pool.release(conn, discard=discard)
+
+	def iter_select(self, table: str, columns: List[str], filters: KV, batch_size: int = 1000) -> Iterator[KV]:
+		"""Like select, but streams the rows one at a time. See iter_select_batches."""
+		for batch in self.iter_select_batches(table, columns, filters, batch_size):
+			yield from batch
 
 	@staticmethod
-	def build_insert_query(table: str, values: KV) -> Query:
+	def build_insert_query(table: str, values: KV, schema: Optional[TableSchema] = None) -> Query:
 		"""Builds a query that inserts a row. See db_test for examples.
 
 		:param table: The table to be inserted into
 		:param values: Key-value pairs that represent the values to be inserted
+		:param schema: If given, values are checked against it and converted to their columns' types
 		:returns: A query string and any placeholder arguments
 		"""
-		pass
+		if schema is not None:
+			values = schema.convert_row(values)
+		return _insert_template(table, tuple(values)), list(values.values())
 
 	def insert(self, table: str, values: KV) -> int:
 		"""Runs an insert statement. You should use build_insert_query and execute_query.
@@ -84,18 +736,129 @@ class DB:
 		:param values: Key-value pairs that represent the values to be inserted
 		:returns: The number of rows affected
 		"""
-		pass
+		query, args = self.build_insert_query(table, values, self.table_schema(table))
+		try:
+			return self.execute_query(query, args, ret_result=False)
+		finally:
+			self.invalidate(table)
+
+	@staticmethod
+	def build_insert_many_query(table: str, rows: List[KV], schema: Optional[TableSchema] = None) -> Query:
+		"""Builds a query that inserts several rows with one multi-row VALUES list. See db_test for examples.
+
+		The columns are the union of the rows' keys, in the order they are first seen. A row that
+		lacks one of the columns gets DEFAULT for it.
+
+		:param table: The table to be inserted into
+		:param rows: Key-value pairs that represent the values to be inserted, one dict per row
+		:param schema: If given, rows are checked against it and converted to their columns' types
+		:returns: A query string and any placeholder arguments
+		"""
+		if schema is not None:
+			rows = [schema.convert_row(row) for row in rows]
+		columns = list(dict.fromkeys(k for row in rows for k in row))
+		tuples, args = [], []
+		for row in rows:
+			placeholders = []
+			for c in columns:
+				if c in row:
+					placeholders.append("%s")
+					args.append(row[c])
+				else:
+					placeholders.append("DEFAULT")
+			tuples.append(f"({', '.join(placeholders)})")
+		names = ", ".join(map(quote_identifier, columns))
+		return f"INSERT INTO {quote_identifier(table)} ({names}) VALUES {', '.join(tuples)}", args
+
+	@staticmethod
+	def chunk_rows(rows: Iterable[KV], chunk_size: int, max_bytes: int = MAX_PACKET_BYTES) -> Iterator[List[KV]]:
+		"""Splits rows into chunks of at most chunk_size rows whose estimated statement size stays under max_bytes.
+
+		A row's size is estimated from the length of its keys and values plus a few bytes of slack for
+		quoting and separators.
+		"""
+		chunk, size = [], 0
+		for row in rows:
+			row_size = sum(len(str(k)) + len(str(v)) + 8 for k, v in row.items())
+			if chunk and (len(chunk) >= chunk_size or size + row_size > max_bytes):
+				yield chunk
+				chunk, size = [], 0
+			chunk.append(row)
+			size += row_size
+		if chunk:
+			yield chunk
+
+	def insert_many(
+		self,
+		table: str,
+		rows: Iterable[KV],
+		chunk_size: int = 1000,
+		max_bytes: int = MAX_PACKET_BYTES,
+		use_executemany: bool = False,
+	) -> int:
+		"""Inserts many rows with one statement per chunk instead of one per row.
+
+		Each chunk runs in its own transaction, so a failing chunk leaves earlier chunks committed.
+
+		:param table: The table to be inserted into
+		:param rows: Key-value pairs that represent the values to be inserted, one dict per row
+		:param chunk_size: The maximum number of rows per statement
+		:param max_bytes: The maximum estimated statement size. Keep it under the server's max_allowed_packet.
+		:param use_executemany: If True, each chunk is sent through cursor.executemany, which lets pymysql
+								build the multi-row VALUES list itself. Rows are grouped by key set since
+								executemany needs one shape per statement.
+		:returns: The number of rows affected
+		"""
+		count = 0
+		schema = self.table_schema(table)
+		try:
+			for chunk in self.chunk_rows(rows, chunk_size, max_bytes):
+				with self.transaction() as conn:
+					with conn.cursor() as cur:
+						count += self._insert_chunk(cur, table, chunk, use_executemany, schema)
+		finally:
+			self.invalidate(table)
+		return count
+
+	def _insert_chunk(
+		self,
+		cur: pymysql.cursors.Cursor,
+		table: str,
+		chunk: List[KV],
+		use_executemany: bool,
+		schema: Optional[TableSchema] = None,
+	) -> int:
+		if not use_executemany:
+			query, args = self.build_insert_many_query(table, chunk, schema)
+			return self._execute(cur, query, args)[0]
+
+		if schema is not None:
+			chunk = [schema.convert_row(row) for row in chunk]
+		count = 0
+		shapes: Dict[Tuple[str, ...], List[KV]] = {}
+		for row in chunk:
+			shapes.setdefault(tuple(row), []).append(row)
+		for shaped in shapes.values():
+			query, _ = self.build_insert_query(table, shaped[0])
+			count += self._execute(cur, query, [list(row.values()) for row in shaped], many=True)[0]
+		return count
 
 	@staticmethod
-	def build_update_query(table: str, values: KV, filters: KV) -> Query:
+	def build_update_query(table: str, values: KV, filters: KV, schema: Optional[TableSchema] = None) -> Query:
 		"""Builds a query that updates rows. See db_test for examples.
 
 		:param table: The table to be updated
 		:param values: Key-value pairs that represent the new values
-		:param filters: Key-value pairs that the rows from table must satisfy
+		:param filters: Key-value pairs that the rows from table must satisfy. A key may end in __<operator>,
+						e.g. enrollment_year__gte or student_id__in. See FILTER_OPERATORS.
+		:param schema: If given, values and filters are checked against it and converted to their columns' types
 		:returns: A query string and any placeholder arguments
 		"""
-		pass
+		if schema is not None:
+			values = schema.convert_row(values)
+			filters = coerce_filters(schema, filters)
+		shape, args = compile_filters(filters)
+		return _update_template(table, tuple(values), shape), list(values.values()) + args
 
 	def update(self, table: str, values: KV, filters: KV) -> int:
 		"""Runs an update statement. You should use build_update_query and execute_query.
@@ -103,19 +866,28 @@ class DB:
 		:param table: The table to be updated
 		:param values: Key-value pairs that represent the new values
 		:param filters: Key-value pairs that the rows to be updated must satisfy
-		:returns: The number of rows affected
+		:returns: The number of rows matched, including rows that already had the new values
 		"""
-		pass
+		query, args = self.build_update_query(table, values, filters, self._checked_schema(table, filters))
+		try:
+			return self.execute_query(query, args, ret_result=False)
+		finally:
+			self.invalidate(table)
 
 	@staticmethod
-	def build_delete_query(table: str, filters: KV) -> Query:
+	def build_delete_query(table: str, filters: KV, schema: Optional[TableSchema] = None) -> Query:
 		"""Builds a query that deletes rows. See db_test for examples.
 
 		:param table: The table to be deleted from
-		:param filters: Key-value pairs that the rows to be deleted must satisfy
+		:param filters: Key-value pairs that the rows to be deleted must satisfy. A key may end in __<operator>,
+						e.g. enrollment_year__gte or student_id__in. See FILTER_OPERATORS.
+		:param schema: If given, filters are checked against it and converted to their columns' types
 		:returns: A query string and any placeholder arguments
 		"""
-		pass
+		if schema is not None:
+			filters = coerce_filters(schema, filters)
+		shape, args = compile_filters(filters)
+		return _delete_template(table, shape), args
 
 	def delete(self, table: str, filters: KV) -> int:
 		"""Runs a delete statement. You should use build_delete_query and execute_query.
@@ -124,4 +896,165 @@ class DB:
 		:param filters: Key-value pairs that the rows to be deleted must satisfy
 		:returns: The number of rows affected
 		"""
-		pass
+		query, args = self.build_delete_query(table, filters, self._checked_schema(table, filters))
+		try:
+			return self.execute_query(query, args, ret_result=False)
+		finally:
+			self.invalidate(table)
+
+	def apply_batch(
+		self,
+		table: str,
+		id_column: str,
+		creates: List[KV] = (),
+		updates: List[KV] = (),
+		deletes: List[Any] = (),
+		chunk_size: int = 1000,
+	) -> KV:
+		"""Applies many writes to a table in one transaction: either all of them take effect or none do.
+
+		Deletes run first (one DELETE ... WHERE id IN (...) per chunk of IDs), then updates (one UPDATE per
+		row), then creates (one multi-row INSERT per chunk), so a batch can delete a row and re-create its
+		unique values. If an update or delete matches fewer rows than it names, RowsNotFound is raised and
+		nothing is written: checking beforehand that the rows exist doesn't stop another process deleting them.
+
+		:param table: The table to be written to
+		:param id_column: The table's primary key
+		:param creates: The rows to be inserted
+		:param updates: The rows to be updated. Each contains its id_column value plus the new values.
+		:param deletes: The IDs of the rows to be deleted
+		:param chunk_size: The maximum number of rows or IDs per INSERT or DELETE
+		:returns: A dict with the number of rows created, updated and deleted
+		"""
+		counts = {"created": 0, "updated": 0, "deleted": 0}
+		schema = self.table_schema(table)
+		deletes = list(dict.fromkeys(deletes))
+		try:
+			with self.transaction() as conn:
+				with conn.cursor() as cur:
+					for i in range(0, len(deletes), chunk_size):
+						chunk = deletes[i:i + chunk_size]
+						query, args = self.build_delete_query(table, {f"{id_column}__in": chunk}, schema)
+						deleted = self._execute(cur, query, args)[0]
+						if deleted < len(chunk):
+							raise RowsNotFound(f"{len(chunk) - deleted} of the {table} rows to delete don't exist")
+						counts["deleted"] += deleted
+					for row in updates:
+						values = {k: v for k, v in row.items() if k != id_column}
+						if values:
+							query, args = self.build_update_query(table, values, {id_column: row[id_column]}, schema)
+							# The connection reports rows matched, so 0 means the row doesn't exist
+							if not self._execute(cur, query, args)[0]:
+								raise RowsNotFound(f"no {table} row has {id_column} {row[id_column]}")
+							counts["updated"] += 1
+					for chunk in self.chunk_rows(creates, chunk_size):
+						counts["created"] += self._insert_chunk(cur, table, chunk, False, schema)
+		finally:
+			self.invalidate(table)
+		return counts
+
+
+class AsyncDB:
+	def __init__(self, db: DB, max_workers: Optional[int] = None, max_streams: Optional[int] = None):
+		"""Wraps a DB so its queries can be awaited without blocking the event loop.
+
+		Each query runs on a bounded thread pool. By default the thread pool is as large as the
+		connection pool, so that the threads don't queue up waiting for connections.
+
+		A stream (see iter_select_batches) holds its connection between batches without holding a
+		thread, so it could be starved of threads by queries waiting for that very connection. Streams
+		therefore fetch on threads of their own, one per open stream, and at most max_streams are open
+		at once; the rest wait for one to finish without holding a thread or a connection.
+
+		:param db: The DB whose queries are run
+		:param max_workers: The number of worker threads
+		:param max_streams: The number of streams open at once, by default the connection pool's max_size
+		"""
+		self.db = db
+		self.executor = ThreadPoolExecutor(
+			max_workers=max_workers or db.pool.max_size,
+			thread_name_prefix="db",
+		)
+		max_streams = max_streams or db.pool.max_size
+		self.stream_executor = ThreadPoolExecutor(max_workers=max_streams, thread_name_prefix="db-stream")
+		self._streams = asyncio.Semaphore(max_streams)
+
+	async def run(self, func: Callable, *args, executor: Optional[ThreadPoolExecutor] = None, **kwargs) -> Any:
+		"""Runs func(*args, **kwargs) on the worker threads, or on executor, and waits for its result."""
+		loop = asyncio.get_running_loop()
+		return await loop.run_in_executor(executor or self.executor, functools.partial(func, *args, **kwargs))
+
+	async def execute_query(self, query: str, args: List, ret_result: bool) -> Union[List[KV], int]:
+		return await self.run(self.db.execute_query, query, args, ret_result)
+
+	async def select(self, table: str, columns: List[str], filters: KV, **page) -> List[KV]:
+		return await self.run(self.db.select, table, columns, filters, **page)
+
+	async def select_by_ids(self, table: str, id_column: str, ids: Iterable[Any], **kwargs) -> Dict[Any, KV]:
+		return await self.run(self.db.select_by_ids, table, id_column, ids, **kwargs)
+
+	async def iter_select_batches(
+		self, table: str, columns: List[str], filters: KV, batch_size: int = 1000
+	) -> AsyncIterator[List[KV]]:
+		"""Streams a select batch by batch. Each batch is fetched on the stream threads, see AsyncDB."""
+		async with self._streams:
+			batches = self.db.iter_select_batches(table, columns, filters, batch_size)
+			try:
+				while True:
+					batch = await self.run(next, batches, None, executor=self.stream_executor)
+					if batch is None:
+						return
+					yield batch
+			finally:
+				await self.run(batches.close, executor=self.stream_executor)
+
+	def prepare(
+		self, kind: str, table: str, columns: Sequence[str] = (), filter_keys: Sequence[str] = ()
+	) -> Callable[..., Awaitable[Union[List[KV], int]]]:
+		"""Like DB.prepare, but the returned callable is awaited and runs on the worker threads."""
+		statement = self.db.prepare(kind, table, columns, filter_keys)
+
+		async def run(*args) -> Union[List[KV], int]:
+			return await self.run(statement, *args)
+
+		run.query = statement.query
+		return run
+
+	async def insert(self, table: str, values: KV) -> int:
+		return await self.run(self.db.insert, table, values)
+
+	async def insert_many(self, table: str, rows: Iterable[KV], **kwargs) -> int:
+		return await self.run(self.db.insert_many, table, rows, **kwargs)
+
+	async def update(self, table: str, values: KV, filters: KV) -> int:
+		return await self.run(self.db.update, table, values, filters)
+
+	async def delete(self, table: str, filters: KV) -> int:
+		return await self.run(self.db.delete, table, filters)
+
+	async def apply_batch(self, table: str, id_column: str, **kwargs) -> KV:
+		return await self.run(self.db.apply_batch, table, id_column, **kwargs)
+
+	def write_version(self, table: str) -> str:
+		return self.db.write_version(table)
+
+	async def refresh_schemas(self) -> Dict[str, TableSchema]:
+		return await self.run(self.db.refresh_schemas)
+
+	def table_schema(self, table: str) -> Optional[TableSchema]:
+		return self.db.table_schema(table)
+
+	def pool_stats(self) -> KV:
+		return self.db.pool_stats()
+
+	@property
+	def metrics(self) -> Optional[QueryMetrics]:
+		return self.db.metrics
+
+	def cache_stats(self) -> Optional[KV]:
+		return self.db.cache_stats()
+
+	def close(self):
+		self.executor.shutdown(wait=True)
+		self.stream_executor.shutdown(wait=True)
+		self.db.close()
@@ -1,6 +1,103 @@
+import asyncio
 import unittest
 
-from db import DB
+from pymysql.err import DataError, IntegrityError, OperationalError
+
+from cache import ResultCache
+from db import (
+    DB, AsyncDB, ConstraintViolation, DuplicateKey, RowsNotFound, coerce_filters, quote_identifier, translate_error,
+    unindexed_filters,
+)
+from pool import ConnectionPool
+from schema import COLUMNS_QUERY, INDEXES_QUERY, Column, SchemaError, TableSchema
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.rows = []
+
+    def execute(self, query, args=None):
+        self.conn.statements.append((query, args))
+        if query.lstrip().startswith("SELECT"):
+            self.rows = [dict(row) for row in self.conn.results.get(query, self.conn.rows)]
+            return len(self.rows)
+        if self.conn.fail_on and query.startswith(self.conn.fail_on):
+            raise IntegrityError(1062, "Duplicate entry 'x' for key 'student.email'")
+        # One row per VALUES tuple or IN value, except the IDs in conn.missing
+        if query.startswith("INSERT"):
+            return query.count("), (") + 1
+        if " IN (" in query:
+            return sum(1 for a in args if a not in self.conn.missing)
+        return 0 if args and args[-1] in self.conn.missing else 1
+
+    def fetchall(self):
+        return self.fetchmany(len(self.rows))
+
+    def fetchmany(self, size):
+        batch, self.rows = self.rows[:size], self.rows[size:]
+        return batch
+
+    def close(self):
+        # Like an unbuffered cursor, closing reads the rest of the result
+        self.conn.drained += len(self.rows)
+        self.rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+class FakeConnection:
+    """Records statements and transaction calls. Statements starting with fail_on raise a duplicate key error.
+
+    SELECT statements return their rows in results, or else rows. UPDATE and DELETE statements match no
+    row whose ID is in missing.
+    """
+
+    def __init__(self, fail_on=None, rows=(), missing=(), results=None):
+        self.fail_on = fail_on
+        self.rows = rows
+        self.results = results or {}
+        self.missing = set(missing)
+        self.statements = []
+        self.events = []
+        self.drained = 0
+
+    def cursor(self, cursor_class=None):
+        return FakeCursor(self)
+
+    def begin(self):
+        self.events.append("begin")
+
+    def commit(self):
+        self.events.append("commit")
+
+    def rollback(self):
+        self.events.append("rollback")
+
+    def ping(self, reconnect=False):
+        pass
+
+    def close(self):
+        self.events.append("close")
+
+
+def student_schema():
+    return TableSchema(
+        "student",
+        [Column("student_id", "int", False), Column("email", "varchar", False), Column("enrollment_year", "int")],
+        {"PRIMARY": (("student_id",), True), "email": (("email",), True)},
+    )
+
+
+def fake_db(conn, **pool_args):
+    db = DB("localhost", 3306, "root", "", "test", min_size=0)
+    db.pool = ConnectionPool(lambda: conn, min_size=0, max_size=1, **pool_args)
+    return db
+
 
 class DBTest(unittest.TestCase):
     def run_test_table(self, func, tests):
@@ -16,17 +113,57 @@ class DBTest(unittest.TestCase):
             (
                 # Unit test 1
                 ("student", [], {}),  			# build_select_query parameters
-                ("SELECT * FROM student", [])  	# expected return value
+                ("SELECT * FROM `student`", [])  	# expected return value
             ),
             (
                 # Unit test 2
                 ("student", ["name"], {"ID": 1}),  					# build_select_query parameters
-                ("SELECT name FROM student WHERE ID = %s", [1])  	# expected return value
+                ("SELECT `name` FROM `student` WHERE `ID` = %s", [1])  	# expected return value
             ),
             (
                 # Unit test 3
                 ("student", ["name", "dept_name"], {"ID": 1, "name": "Joe"}),  						# build_select_query parameters
-                ("SELECT name, dept_name FROM student WHERE ID = %s AND name = %s", [1, "Joe"])  	# expected return value
+                ("SELECT `name`, `dept_name` FROM `student` WHERE `ID` = %s AND `name` = %s", [1, "Joe"])  	# expected return value
+            ),
+        ]
+
+        self.run_test_table(DB.build_select_query, tests)
+
+    def test_build_select_query_paginated(self):
+        tests = [
+            (
+                ("student", [], {}, "ID", 10),
+                ("SELECT * FROM `student` ORDER BY `ID` LIMIT %s", [10])
+            ),
+            (
+                ("student", ["name"], {}, "ID", 10, 20),
+                ("SELECT `name` FROM `student` WHERE `ID` > %s ORDER BY `ID` LIMIT %s", [20, 10])
+            ),
+            (
+                ("student", [], {"name": "Joe"}, "-ID", 10, 20),
+                ("SELECT * FROM `student` WHERE `name` = %s AND `ID` < %s ORDER BY `ID` DESC LIMIT %s", ["Joe", 20, 10])
+            ),
+        ]
+
+        self.run_test_table(DB.build_select_query, tests)
+
+    def test_build_select_query_operators(self):
+        tests = [
+            (
+                ("student", [], {"year__gte": 2020, "year__lt": 2023}),
+                ("SELECT * FROM `student` WHERE `year` >= %s AND `year` < %s", [2020, 2023])
+            ),
+            (
+                ("student", [], {"ID__in": "1,2,3", "name__ne": "Joe"}),
+                ("SELECT * FROM `student` WHERE `ID` IN (%s, %s, %s) AND `name` <> %s", ["1", "2", "3", "Joe"])
+            ),
+            (
+                ("student", [], {"ID__in": []}),
+                ("SELECT * FROM `student` WHERE FALSE", [])
+            ),
+            (
+                ("student", [], {"email__startswith": "j_d%", "dept_name__isnull": "true"}),
+                ("SELECT * FROM `student` WHERE `email` LIKE %s AND `dept_name` IS NULL", ["j\\_d\\%%"])
             ),
         ]
 
@@ -36,34 +173,66 @@ class DBTest(unittest.TestCase):
         tests = [
             (
                 ("student", {"ID": 1}),
-                ("INSERT INTO student (ID) VALUES (%s)", [1])
+                ("INSERT INTO `student` (`ID`) VALUES (%s)", [1])
             ),
             (
                 ("student", {"ID": 1, "name": "Joe"}),
-                ("INSERT INTO student (ID, name) VALUES (%s, %s)", [1, "Joe"])
+                ("INSERT INTO `student` (`ID`, `name`) VALUES (%s, %s)", [1, "Joe"])
             ),
             (
                 ("student", {"ID": 1, "name": "Joe", "dept_name": "CS"}),
-                ("INSERT INTO student (ID, name, dept_name) VALUES (%s, %s, %s)", [1, "Joe", "CS"])
+                ("INSERT INTO `student` (`ID`, `name`, `dept_name`) VALUES (%s, %s, %s)", [1, "Joe", "CS"])
             ),
         ]
 
         self.run_test_table(DB.build_insert_query, tests)
 
+    def test_build_insert_many_query(self):
+        tests = [
+            (
+                ("student", [{"ID": 1}, {"ID": 2}]),
+                ("INSERT INTO `student` (`ID`) VALUES (%s), (%s)", [1, 2])
+            ),
+            (
+                ("student", [{"ID": 1, "name": "Joe"}, {"ID": 2, "name": "Mike"}]),
+                ("INSERT INTO `student` (`ID`, `name`) VALUES (%s, %s), (%s, %s)", [1, "Joe", 2, "Mike"])
+            ),
+            (
+                ("student", [{"ID": 1, "name": "Joe"}, {"ID": 2, "dept_name": "CS"}]),
+                (
+                    "INSERT INTO `student` (`ID`, `name`, `dept_name`) VALUES (%s, %s, DEFAULT), (%s, DEFAULT, %s)",
+                    [1, "Joe", 2, "CS"]
+                )
+            ),
+        ]
+
+        self.run_test_table(DB.build_insert_many_query, tests)
+
+    def test_chunk_rows(self):
+        rows = [{"ID": i} for i in range(5)]
+        tests = [
+            ((rows, 2), [rows[0:2], rows[2:4], rows[4:]]),
+            ((rows, 10), [rows]),
+            # Each row is estimated at 11 bytes, so a 25-byte budget fits two rows
+            ((rows, 10, 25), [rows[0:2], rows[2:4], rows[4:]]),
+        ]
+
+        self.run_test_table(lambda *args: list(DB.chunk_rows(*args)), tests)
+
     def test_build_update_query(self):
         tests = [
             (
                 ("student", {"name": "Joe"}, {}),
-                ("UPDATE student SET name = %s", ["Joe"])
+                ("UPDATE `student` SET `name` = %s", ["Joe"])
             ),
             (
                 ("student", {"name": "Joe", "dept_name": "CS"}, {"name": "Mike"}),
-                ("UPDATE student SET name = %s, dept_name = %s WHERE name = %s", ["Joe", "CS", "Mike"])
+                ("UPDATE `student` SET `name` = %s, `dept_name` = %s WHERE `name` = %s", ["Joe", "CS", "Mike"])
             ),
             (
                 ("student", {"name": "Joe", "dept_name": "CS", "tot_cred": 5}, {"name": "Mike", "dept_name": "EE"}),
                 (
-                    "UPDATE student SET name = %s, dept_name = %s, tot_cred = %s WHERE name = %s AND dept_name = %s",
+                    "UPDATE `student` SET `name` = %s, `dept_name` = %s, `tot_cred` = %s WHERE `name` = %s AND `dept_name` = %s",
                     ["Joe", "CS", 5, "Mike", "EE"]
                 )
             ),
@@ -75,19 +244,285 @@ class DBTest(unittest.TestCase):
         tests = [
             (
                 ("student", {}),
-                ("DELETE FROM student", [])
+                ("DELETE FROM `student`", [])
             ),
             (
                 ("student", {"ID": 1}),
-                ("DELETE FROM student WHERE ID = %s", [1])
+                ("DELETE FROM `student` WHERE `ID` = %s", [1])
             ),
             (
                 ("student", {"ID": 1, "name": "Joe"}),
-                ("DELETE FROM student WHERE ID = %s AND name = %s", [1, "Joe"])
+                ("DELETE FROM `student` WHERE `ID` = %s AND `name` = %s", [1, "Joe"])
             ),
         ]
 
         self.run_test_table(DB.build_delete_query, tests)
 
+    def test_identifiers(self):
+        # Names are put into the SQL text, so without a schema to check them against, anything but a plain
+        # identifier is rejected
+        for name in ("", "1st", "first name", "name; DROP TABLE student", "name`", "s.name", "name--"):
+            for build in (
+                lambda: DB.build_select_query(name, [], {}),
+                lambda: DB.build_select_query("student", [name], {}),
+                lambda: DB.build_select_query("student", [], {"ID": 1}, order_by="-" + name),
+                lambda: DB.build_select_query("student", [], {f"{name}__in": [1]}),
+                lambda: DB.build_insert_query("student", {name: 1}),
+                lambda: DB.build_insert_many_query("student", [{"ID": 1}, {name: 1}]),
+                lambda: DB.build_update_query("student", {name: 1}, {"ID": 1}),
+                lambda: DB.build_delete_query(name, {"ID": 1}),
+            ):
+                with self.assertRaises(SchemaError, msg=name):
+                    build()
+        with self.assertRaises(SchemaError):
+            DB.build_select_query("student", [None], {})
+        self.assertEqual("`$tmp_2`", quote_identifier("$tmp_2"))
+
+    def test_statement_cache(self):
+        DB.clear_statement_cache()
+        for student_id in range(3):
+            DB.build_select_query("student", ["name"], {"ID": student_id})
+        DB.build_delete_query("student", {"ID": 1})
+
+        stats = DB.statement_cache_stats()
+        self.assertEqual({"hits": 2, "misses": 1, "size": 1}, stats["select"])
+        self.assertEqual({"hits": 2, "misses": 2, "size": 2}, {k: stats[k] for k in ("hits", "misses", "size")})
+
+    def test_prepare(self):
+        # prepare only builds the statement; execute_query is replaced so that no server is needed
+        db = DB("localhost", 3306, "root", "", "test", min_size=0)
+        db.execute_query = lambda query, args, ret_result: (query, args, ret_result)
+        tests = [
+            (
+                ("select", "student", ["name"], ["ID"]), (1,),
+                ("SELECT `name` FROM `student` WHERE `ID` = %s", [1], True)
+            ),
+            (
+                ("update", "student", ["name"], ["ID"]), ("Joe", 1),
+                ("UPDATE `student` SET `name` = %s WHERE `ID` = %s", ["Joe", 1], False)
+            ),
+        ]
+
+        for prepare_args, args, want in tests:
+            self.assertEqual(want, db.prepare(*prepare_args)(*args))
+        with self.assertRaises(TypeError):
+            db.prepare("delete", "student", filter_keys=["ID"])()
+
+    def test_write_version(self):
+        db = DB("localhost", 3306, "root", "", "test", min_size=0)
+        before = db.write_version("student")
+        self.assertEqual(before, db.write_version("student"))
+
+        db.invalidate("student")
+        self.assertNotEqual(before, db.write_version("student"))
+        self.assertEqual(db.write_version("employee"), db.write_version("employee"))
+        self.assertNotEqual(before, DB("localhost", 3306, "root", "", "test", min_size=0).write_version("student"))
+
+
+    def test_translate_error(self):
+        e = translate_error(IntegrityError(1062, "Duplicate entry 'jd@columbia.edu' for key 'student.email'"))
+        self.assertIsInstance(e, DuplicateKey)
+        self.assertIsInstance(e, IntegrityError)
+        self.assertEqual(("email", "jd@columbia.edu"), (e.key, e.value))
+        self.assertEqual("email", translate_error(IntegrityError(1062, "Duplicate entry 'x' for key 'email'")).key)
+
+        for error in (IntegrityError(1048, "Column 'email' cannot be null"), DataError(1265, "Data truncated"),
+                      OperationalError(3819, "Check constraint 'student_chk_1' is violated.")):
+            e = translate_error(error)
+            self.assertIs(type(e), ConstraintViolation)
+            self.assertEqual(error.args, (e.code, e.message))
+
+        error = OperationalError(2003, "Can't connect")
+        self.assertIs(error, translate_error(error))
+
+
+    def test_schema_checks(self):
+        schema = student_schema()
+
+        self.assertEqual(
+            {"student_id__in": [1, 2], "enrollment_year__gte": 2018, "email__isnull": False, "email__contains": "12"},
+            coerce_filters(schema, {
+                "student_id__in": "1,2", "enrollment_year__gte": "2018", "email__isnull": "false", "email__contains": 12
+            }),
+        )
+        for filters in ({"iq": 50}, {"enrollment_year": "abc"}, {"student_id__in": [1, "x"]}, {"email__isnull": "maybe"}):
+            with self.assertRaises(SchemaError):
+                coerce_filters(schema, filters)
+
+        self.assertEqual([], unindexed_filters(schema, {}))
+        self.assertEqual([], unindexed_filters(schema, {"enrollment_year": 2018, "email__startswith": "a"}))
+        self.assertEqual(
+            ["enrollment_year", "email__contains", "student_id__ne"],
+            unindexed_filters(schema, {"enrollment_year": 2018, "email__contains": "a", "student_id__ne": 1}),
+        )
+        with self.assertRaises(SchemaError):
+            unindexed_filters(schema, {"iq": 50})
+
+        self.assertEqual(
+            ("SELECT `email` FROM `student` WHERE `enrollment_year` = %s ORDER BY `student_id`", [2018]),
+            DB.build_select_query("student", ["email"], {"enrollment_year": "2018"}, order_by="student_id", schema=schema),
+        )
+        for columns, order_by in ((["iq"], None), ([], "-iq")):
+            with self.assertRaises(SchemaError):
+                DB.build_select_query("student", columns, {}, order_by=order_by, schema=schema)
+        self.assertEqual(
+            ("UPDATE `student` SET `enrollment_year` = %s WHERE `student_id` = %s", [2020, 1]),
+            DB.build_update_query("student", {"enrollment_year": "2020"}, {"student_id": "1"}, schema=schema),
+        )
+        with self.assertRaises(SchemaError):
+            DB.build_insert_query("student", {"email": None}, schema=schema)
+        with self.assertRaises(SchemaError):
+            DB.build_delete_query("student", {"iq": 1}, schema=schema)
+        self.assertEqual(
+            ("INSERT INTO `student` (`email`, `enrollment_year`) VALUES (%s, %s), (%s, DEFAULT)", ["a@x", 2020, "b@x"]),
+            DB.build_insert_many_query("student", [{"email": "a@x", "enrollment_year": "2020"}, {"email": "b@x"}], schema),
+        )
+        # Unknown keys never reach the SQL as column names
+        with self.assertRaises(SchemaError):
+            DB.build_insert_many_query("student", [{"email": "a@x"}, {"email": "b@x", "x) VALUES (1); -- ": 1}], schema)
+
+
+    def test_reject_unindexed(self):
+        columns = [
+            {"table_name": "student", "column_name": c, "data_type": "int", "column_type": "int", "is_nullable": "NO"}
+            for c in ("student_id", "enrollment_year")
+        ]
+        indexes = [{"table_name": "student", "index_name": "PRIMARY", "non_unique": 0, "column_name": "student_id"}]
+        conn = FakeConnection(results={COLUMNS_QUERY: columns, INDEXES_QUERY: indexes})
+        db = fake_db(conn)
+        db.reject_unindexed = True
+
+        # The schemas weren't loaded, so they are loaded on first use instead of the check being skipped
+        with self.assertRaises(SchemaError):
+            db.select("student", [], {"enrollment_year": 2018})
+        self.assertEqual([], db.select("student", [], {"student_id": 1}))
+        with self.assertRaises(SchemaError):
+            db.delete("student", {"enrollment_year__gte": 2018})
+        # A table that isn't in the schemas can't be checked, so it is rejected
+        with self.assertRaises(SchemaError):
+            db.select("course", [], {"course_id": 1})
+        self.assertEqual(
+            [COLUMNS_QUERY, INDEXES_QUERY, "SELECT * FROM `student` WHERE `student_id` = %s"],
+            [q for q, _ in conn.statements],
+        )
+
+        # Without reject_unindexed, queries aren't checked until refresh_schemas is called
+        conn = FakeConnection()
+        db = fake_db(conn)
+        db.select("student", [], {"enrollment_year": 2018})
+        self.assertEqual((None, 1), (db.schemas, len(conn.statements)))
+
+    def test_apply_batch(self):
+        conn = FakeConnection()
+        counts = fake_db(conn).apply_batch(
+            "student", "student_id",
+            creates=[{"email": "a@x"}, {"email": "b@x"}],
+            updates=[{"student_id": 1, "first_name": "A"}, {"student_id": 2}],
+            deletes=[3, 4, 5],
+            chunk_size=2,
+        )
+        self.assertEqual({"created": 2, "updated": 1, "deleted": 3}, counts)
+        self.assertEqual(["begin", "commit"], conn.events)
+        self.assertEqual([
+            "DELETE FROM `student` WHERE `student_id` IN (%s, %s)",
+            "DELETE FROM `student` WHERE `student_id` IN (%s)",
+            "UPDATE `student` SET `first_name` = %s WHERE `student_id` = %s",
+            "INSERT INTO `student` (`email`) VALUES (%s), (%s)",
+        ], [q for q, _ in conn.statements])
+
+        # A failing statement rolls back the writes before it, and the error still reaches the caller
+        conn = FakeConnection(fail_on="INSERT")
+        with self.assertRaises(DuplicateKey):
+            fake_db(conn).apply_batch("student", "student_id", creates=[{"email": "a@x"}], deletes=[1])
+        self.assertEqual(["begin", "rollback"], conn.events)
+
+        # A row deleted since the batch was validated rolls the batch back, and duplicate deletes are not short
+        for batch in (
+            {"creates": [{"email": "a@x"}], "deletes": [1, 9, 2]},
+            {"updates": [{"student_id": 1, "first_name": "A"}, {"student_id": 9, "first_name": "B"}]},
+        ):
+            conn = FakeConnection(missing=[9])
+            with self.assertRaises(RowsNotFound):
+                fake_db(conn).apply_batch("student", "student_id", **batch)
+            self.assertEqual(["begin", "rollback"], conn.events, batch)
+            self.assertFalse([q for q, _ in conn.statements if q.startswith("INSERT")], batch)
+        conn = FakeConnection()
+        self.assertEqual({"created": 0, "updated": 0, "deleted": 2},
+                         fake_db(conn).apply_batch("student", "student_id", deletes=[1, 2, 1]))
+
+        # With the schemas loaded, every statement is checked against them
+        for batch in (
+            {"creates": [{"email": "a@x", "x) VALUES (1); -- ": 1}]},
+            {"updates": [{"student_id": 1, "iq": 50}]},
+            {"deletes": [1, "x"]},
+        ):
+            conn = FakeConnection()
+            db = fake_db(conn)
+            db.schemas = {"student": student_schema()}
+            with self.assertRaises(SchemaError):
+                db.apply_batch("student", "student_id", **batch)
+            self.assertEqual(["begin", "rollback"], conn.events, batch)
+        with self.assertRaises(SchemaError):
+            db.insert_many("student", [{"email": "a@x"}, {"bogus": 1}])
+
+    def test_select_by_ids(self):
+        conn = FakeConnection(rows=[{"student_id": 2, "email": "b@x"}, {"student_id": 1, "email": "a@x"}])
+        db = fake_db(conn)
+        db.cache = ResultCache()
+        self.assertEqual({1: {"email": "a@x"}, 2: {"email": "b@x"}}, db.select_by_ids("student", "student_id", [1, 2, 1], ["email"]))
+        # Read past the result cache every time, so rows written by another process show up
+        self.assertEqual({1: {"student_id": 1, "email": "a@x"}, 2: {"student_id": 2, "email": "b@x"}},
+                         db.select_by_ids("student", "student_id", [2, 1]))
+        self.assertEqual([
+            ("SELECT `email`, `student_id` FROM `student` WHERE `student_id` IN (%s, %s)", [1, 2]),
+            ("SELECT * FROM `student` WHERE `student_id` IN (%s, %s)", [2, 1]),
+        ], conn.statements)
+        self.assertEqual(0, db.cache_stats()["entries"])
+
+    def test_iter_select_batches(self):
+        rows = [{"student_id": i} for i in range(5)]
+        conn = FakeConnection(rows=rows)
+        db = fake_db(conn)
+        self.assertEqual([rows[0:2], rows[2:4], rows[4:]], list(db.iter_select_batches("student", [], {}, batch_size=2)))
+        self.assertEqual(rows, list(db.iter_select("student", [], {}, batch_size=3)))
+        self.assertEqual(["SELECT * FROM `student`"] * 2, [q for q, _ in conn.statements])
+
+        self.assertEqual({"idle": 1, "recycled": 0}, {k: db.pool_stats()[k] for k in ("idle", "recycled")})
+
+        # The connection is held until the generator is exhausted or closed. Stopping early discards it
+        # instead of reading the rest of the result.
+        batches = db.iter_select_batches("student", [], {}, batch_size=2)
+        next(batches)
+        self.assertEqual(1, db.pool_stats()["in_use"])
+        batches.close()
+        self.assertEqual({"in_use": 0, "idle": 0, "recycled": 1},
+                         {k: db.pool_stats()[k] for k in ("in_use", "idle", "recycled")})
+        self.assertEqual((0, ["close"]), (conn.drained, conn.events))
+
+        # So does breaking out of iter_select
+        for row in fake_db(conn).iter_select("student", [], {}, batch_size=2):
+            break
+        self.assertEqual((0, ["close"] * 2), (conn.drained, conn.events))
+
+    def test_async_stream_is_not_starved(self):
+        # The stream holds the only connection between batches, while the select waits for it on the
+        # only worker thread. The stream must still be able to fetch, or both wait until PoolTimeout.
+        rows = [{"student_id": i} for i in range(4)]
+        adb = AsyncDB(fake_db(FakeConnection(rows=rows), timeout=2), max_workers=1)
+        self.addCleanup(adb.close)
+
+        async def run():
+            streamed = []
+            batches = adb.iter_select_batches("student", [], {}, batch_size=1)
+            streamed += await anext(batches)
+            select = asyncio.create_task(adb.select("student", [], {}))
+            await asyncio.sleep(0.05)
+            async for batch in batches:
+                streamed += batch
+            return streamed, await select
+
+        self.assertEqual((rows, rows), asyncio.run(run()))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,277 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from db import DB
+
+# The derived files are parsed with the streaming reader of examples/process_got, which writes them. It is
+# imported as a package from the repository root, like the examples do, and needs only the standard library.
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "..", ".."))
+if REPO_ROOT not in sys.path:
+	sys.path.append(REPO_ROOT)
+from examples.process_got.jsonstream import iter_json_array  # noqa: E402
+
+# Type definitions
+# Key-value pairs
+KV = Dict[str, Any]
+# A table schema: column name -> SQL type, in column order
+Schema = Dict[str, str]
+
+# The tables derived by examples/process_got/process_got.py, and the secondary indexes created on each
+# once its rows are loaded. Each table is loaded from <table>.json or <table>.ndjson.
+GOT_INDEXES: Dict[str, List[Tuple[str, ...]]] = {
+	"episodes_basics": [("seasonNum", "episodeNum")],
+	"episodes_locations": [("seasonNum", "episodeNum")],
+	"episodes_scenes": [("seasonNum", "episodeNum", "sceneNum")],
+	"episodes_characters": [("seasonNum", "episodeNum", "sceneNum"), ("characterName",)],
+	"episodes_scenes_characters_killedBy": [("characterName",), ("killedBy",)],
+	"characters_basic": [("characterName",)],
+	"character_relationships": [("sourceCharacter", "relationship"), ("targetCharacter",)],
+}
+
+# Strings up to this many characters get a VARCHAR column, longer ones TEXT
+MAX_VARCHAR = 255
+# Prefix length used when a TEXT column is indexed
+TEXT_INDEX_PREFIX = 191
+
+# MySQL's default LOAD DATA escaping (FIELDS ESCAPED BY '\\')
+_TSV_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r", "\0": "\\0"})
+
+
+def iter_records(file_name: str, read_size: int = 1 << 16) -> Iterator[KV]:
+	"""Yields the records of a derived file one at a time, without loading the whole file.
+
+	:param file_name: A JSON array of objects, or one object per line if the name ends in .ndjson
+	"""
+	if not file_name.endswith(".ndjson"):
+		yield from iter_json_array(file_name, read_size=read_size)
+		return
+	with open(file_name, "r") as in_file:
+		for line in in_file:
+			if line.strip():
+				yield json.loads(line)
+
+
+def infer_schema(records: Iterable[KV]) -> Schema:
+	"""Infers a column type for every key of the records, in the order the keys are first seen.
+
+	Integers become INT (BIGINT if they don't fit), floats DOUBLE, booleans BOOLEAN, strings VARCHAR
+	or TEXT depending on their longest value, and lists or objects JSON. A key whose values have
+	different types is stored as TEXT. A column is NOT NULL if no record lacks it or has null for it.
+	"""
+	kinds: Dict[str, set] = {}
+	longest: Dict[str, int] = {}
+	bounds: Dict[str, Tuple[int, int]] = {}
+	nullable: set = set()
+	count = 0
+	for record in records:
+		for key in kinds:
+			if key not in record:
+				nullable.add(key)
+		for key, value in record.items():
+			if key not in kinds:
+				kinds[key] = set()
+				if count:
+					nullable.add(key)
+			if value is None:
+				nullable.add(key)
+				continue
+			kind = type(value)
+			kinds[key].add(kind)
+			if kind is str:
+				longest[key] = max(longest.get(key, 0), len(value))
+			elif kind is int:
+				low, high = bounds.get(key, (value, value))
+				bounds[key] = (min(low, value), max(high, value))
+		count += 1
+
+	schema = {}
+	for key, types in kinds.items():
+		if types == {bool}:
+			sql_type = "BOOLEAN"
+		elif types == {int}:
+			low, high = bounds[key]
+			sql_type = "INT" if -2 ** 31 <= low and high < 2 ** 31 else "BIGINT"
+		elif types and types <= {int, float}:
+			sql_type = "DOUBLE"
+		elif types and types <= {list, dict}:
+			sql_type = "JSON"
+		elif types == {str} and longest[key] <= MAX_VARCHAR:
+			sql_type = f"VARCHAR({MAX_VARCHAR})"
+		else:
+			sql_type = "TEXT"
+		schema[key] = sql_type + ("" if key in nullable else " NOT NULL")
+	return schema
+
+
+def build_create_table(table: str, schema: Schema) -> str:
+	columns = ", ".join(f"{column} {sql_type}" for column, sql_type in schema.items())
+	return f"CREATE TABLE {table} ({columns}) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4"
+
+
+def build_add_indexes(table: str, schema: Schema, indexes: Sequence[Tuple[str, ...]]) -> Optional[str]:
+	"""Returns one ALTER TABLE that adds every index, so the table is rebuilt once, or None if there are none."""
+	clauses = []
+	for columns in indexes:
+		parts = [
+			f"{c}({TEXT_INDEX_PREFIX})" if schema.get(c, "").startswith("TEXT") else c
+			for c in columns
+		]
+		clauses.append(f"ADD INDEX ix_{'_'.join(columns)} ({', '.join(parts)})")
+	if not clauses:
+		return None
+	return f"ALTER TABLE {table} " + ", ".join(clauses)
+
+
+def to_row(record: KV, columns: Sequence[str]) -> KV:
+	"""Returns the record's values for columns, None for missing keys and lists or objects as JSON text."""
+	row = {}
+	for column in columns:
+		value = record.get(column)
+		row[column] = json.dumps(value) if isinstance(value, (list, dict)) else value
+	return row
+
+
+def tsv_field(value: Any) -> str:
+	"""Formats a value for LOAD DATA with the default FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\'."""
+	if value is None:
+		return "\\N"
+	if isinstance(value, bool):
+		return "1" if value else "0"
+	return str(value).translate(_TSV_ESCAPES)
+
+
+def load_data_infile(db: DB, table: str, columns: Sequence[str], rows: Iterable[KV]) -> int:
+	"""Writes rows to a temporary tab-separated file and loads it with one LOAD DATA LOCAL INFILE.
+
+	db must have been created with local_infile=True, and the server must allow local_infile.
+	"""
+	with tempfile.NamedTemporaryFile("w", suffix=".tsv", encoding="utf-8", delete=False) as out_file:
+		path = out_file.name
+		for row in rows:
+			out_file.write("\t".join(tsv_field(row[c]) for c in columns) + "\n")
+	try:
+		query = (
+			f"LOAD DATA LOCAL INFILE %s INTO TABLE {table} CHARACTER SET utf8mb4 "
+			f"LINES TERMINATED BY '\\n' ({', '.join(columns)})"
+		)
+		count = db.execute_query(query, [path], False)
+	finally:
+		os.unlink(path)
+		db.invalidate(table)
+	return count
+
+
+def load_table(
+	db: DB,
+	table: str,
+	file_name: str,
+	schema: Optional[Schema] = None,
+	indexes: Sequence[Tuple[str, ...]] = (),
+	method: str = "insert",
+	chunk_size: int = 5000,
+) -> KV:
+	"""Replaces table with the records of file_name.
+
+	The table is created without secondary indexes, loaded, and then indexed, since building an index
+	once is much cheaper than maintaining it row by row.
+
+	:param schema: Column types. If None, they are inferred from a first pass over the file.
+	:param method: "insert" loads through DB.insert_many with chunk_size rows per statement,
+					"infile" through load_data_infile
+	:returns: A dict with the table, its rows, and the seconds spent loading and indexing
+	"""
+	if method not in ("insert", "infile"):
+		raise ValueError(f"unknown load method {method!r}")
+	schema = schema or infer_schema(iter_records(file_name))
+	columns = list(schema)
+
+	db.execute_query(f"DROP TABLE IF EXISTS {table}", [], False)
+	db.execute_query(build_create_table(table, schema), [], False)
+
+	start = time.perf_counter()
+	rows = (to_row(r, columns) for r in iter_records(file_name))
+	if method == "infile":
+		count = load_data_infile(db, table, columns, rows)
+	else:
+		count = db.insert_many(table, rows, chunk_size=chunk_size)
+	loaded = time.perf_counter()
+
+	query = build_add_indexes(table, schema, indexes)
+	if query:
+		db.execute_query(query, [], False)
+	indexed = time.perf_counter()
+
+	return {"table": table, "rows": count, "load_seconds": loaded - start, "index_seconds": indexed - loaded}
+
+
+def find_input(in_dir: str, table: str) -> Optional[str]:
+	for suffix in (".json", ".ndjson"):
+		file_name = os.path.join(in_dir, table + suffix)
+		if os.path.exists(file_name):
+			return file_name
+	return None
+
+
+def main(argv: Optional[List[str]] = None):
+	parser = argparse.ArgumentParser(description="Loads the derived GoT files into MySQL tables.")
+	parser.add_argument("in_dir", help="directory holding the files written by process_got.py")
+	parser.add_argument("tables", nargs="*", help=f"tables to load (default: {', '.join(GOT_INDEXES)})")
+	parser.add_argument("--host", default="localhost")
+	parser.add_argument("--port", type=int, default=3306)
+	parser.add_argument("--user", default="root")
+	parser.add_argument("--password", default="dbuserdbuser")
+	parser.add_argument("--database", default="got")
+	parser.add_argument("--method", choices=["insert", "infile"], default="insert",
+						help="multi-row INSERTs, or LOAD DATA LOCAL INFILE from a temporary file")
+	parser.add_argument("--chunk-size", type=int, default=5000, help="rows per INSERT statement")
+	parser.add_argument("--schema", help="JSON file mapping table names to {column: SQL type}; "
+										 "tables it doesn't list have their schema inferred")
+	args = parser.parse_args(argv)
+
+	tables = args.tables or list(GOT_INDEXES)
+	unknown = [t for t in tables if t not in GOT_INDEXES]
+	if unknown:
+		parser.error("unknown tables: " + ", ".join(unknown))
+	schemas = {}
+	if args.schema:
+		with open(args.schema, "r") as in_file:
+			schemas = json.load(in_file)
+
+	db = DB(
+		host=args.host,
+		port=args.port,
+		user=args.user,
+		password=args.password,
+		database=args.database,
+		local_infile=args.method == "infile",
+	)
+	total_rows, total_seconds = 0, 0.0
+	try:
+		for table in tables:
+			file_name = find_input(args.in_dir, table)
+			if file_name is None:
+				print(f"{table}: no {table}.json or {table}.ndjson in {args.in_dir}, skipped")
+				continue
+			stats = load_table(
+				db, table, file_name, schemas.get(table), GOT_INDEXES[table], args.method, args.chunk_size
+			)
+			seconds = stats["load_seconds"] + stats["index_seconds"]
+			total_rows += stats["rows"]
+			total_seconds += seconds
+			print(
+				f"{table}: {stats['rows']} rows loaded in {stats['load_seconds']:.2f}s "
+				f"({stats['rows'] / max(stats['load_seconds'], 1e-9):.0f} rows/s), "
+				f"indexed in {stats['index_seconds']:.2f}s"
+			)
+	finally:
+		db.close()
+	print(f"total: {total_rows} rows in {total_seconds:.2f}s ({total_rows / max(total_seconds, 1e-9):.0f} rows/s)")
+
+
+if __name__ == "__main__":
+	main()
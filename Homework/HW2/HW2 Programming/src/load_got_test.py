@@ -0,0 +1,86 @@
+import json
+import os
+import tempfile
+import unittest
+
+import load_got
+
+
+class FakeDB:
+    def __init__(self):
+        self.statements = []
+        self.inserted = []
+
+    def execute_query(self, query, args, ret_result):
+        self.statements.append(query)
+        return 0
+
+    def insert_many(self, table, rows, chunk_size=1000):
+        self.inserted.extend(rows)
+        return len(self.inserted)
+
+
+class LoadGotTest(unittest.TestCase):
+    def write_file(self, suffix, text):
+        fd, path = tempfile.mkstemp(suffix=suffix)
+        with os.fdopen(fd, "w") as out_file:
+            out_file.write(text)
+        self.addCleanup(os.unlink, path)
+        return path
+
+    def test_iter_records(self):
+        records = [{"a": 1, "b": "x, ]"}, {"a": 2, "b": None}, {"a": 3, "b": [1, {"c": 2}]}]
+        tests = [
+            (".json", json.dumps(records, indent=2)),
+            (".json", json.dumps(records)),
+            (".ndjson", "\n".join(json.dumps(r) for r in records) + "\n"),
+        ]
+        for suffix, text in tests:
+            path = self.write_file(suffix, text)
+            self.assertEqual(records, list(load_got.iter_records(path, read_size=4)))
+
+        self.assertEqual([], list(load_got.iter_records(self.write_file(".json", " [ ] "))))
+
+    def test_infer_schema(self):
+        records = [
+            {"seasonNum": 1, "title": "Winter", "royal": True, "score": 1, "tags": ["a"]},
+            {"seasonNum": 2, "title": "x" * 300, "royal": False, "score": 1.5, "tags": None, "extra": "y"},
+        ]
+        self.assertEqual({
+            "seasonNum": "INT NOT NULL",
+            "title": "TEXT NOT NULL",
+            "royal": "BOOLEAN NOT NULL",
+            "score": "DOUBLE NOT NULL",
+            "tags": "JSON",
+            "extra": "VARCHAR(255)",
+        }, load_got.infer_schema(records))
+
+    def test_build_statements(self):
+        schema = {"seasonNum": "INT NOT NULL", "characterName": "TEXT"}
+        self.assertEqual(
+            "CREATE TABLE t (seasonNum INT NOT NULL, characterName TEXT) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4",
+            load_got.build_create_table("t", schema),
+        )
+        self.assertEqual(
+            "ALTER TABLE t ADD INDEX ix_seasonNum (seasonNum), ADD INDEX ix_characterName (characterName(191))",
+            load_got.build_add_indexes("t", schema, [("seasonNum",), ("characterName",)]),
+        )
+        self.assertIsNone(load_got.build_add_indexes("t", schema, []))
+        self.assertEqual(
+            ["\\N", "1", "a\\tb\\nc\\\\"],
+            [load_got.tsv_field(v) for v in (None, True, "a\tb\nc\\")],
+        )
+
+    def test_load_table_defers_indexes(self):
+        path = self.write_file(".json", json.dumps([{"a": 1, "b": ["x"]}, {"a": 2}]))
+        db = FakeDB()
+        stats = load_got.load_table(db, "t", path, indexes=[("a",)])
+
+        self.assertEqual(2, stats["rows"])
+        self.assertEqual([{"a": 1, "b": '["x"]'}, {"a": 2, "b": None}], db.inserted)
+        self.assertEqual(["DROP TABLE IF EXISTS t", "CREATE TABLE", "ALTER TABLE"],
+                         [s if s.startswith("DROP") else " ".join(s.split()[:2]) for s in db.statements])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,222 @@
+import argparse
+import re
+import time
+from typing import Callable, Dict, IO, Iterable, Iterator, List, Optional, Tuple
+
+from db import DB, MAX_PACKET_BYTES
+
+# A statement to run, and the table it inserts into (None if it isn't an INSERT)
+Statement = Tuple[str, Optional[str]]
+
+# One token of a SQL script: a run of plain text, a quoted string or identifier, a comment, or a single
+# character that doesn't start any of those. An unterminated string or comment matches nothing.
+_TOKEN = re.compile(
+	r"""
+	[^;'"`/#-]+
+	| '(?:[^'\\]|\\.|'')*'
+	| "(?:[^"\\]|\\.|"")*"
+	| `(?:[^`]|``)*`
+	| (?:--|\#)[^\n]*(?:\n|$)
+	| /\*.*?\*/
+	| ; | /(?!\*) | -(?!-)
+	""",
+	re.S | re.X,
+)
+
+_INSERT = re.compile(
+	r"\s*insert\s+(ignore\s+)?(?:into\s+)?(`[^`]+`|[\w$.]+)\s*(\([^()]*\))?\s*values\s*",
+	re.I,
+)
+_ON_DUPLICATE = re.compile(r"\)\s*on\s+duplicate\s+key\s+update\b", re.I)
+
+
+def iter_statements(in_file: IO[str], read_size: int = 1 << 16) -> Iterator[str]:
+	"""Splits a SQL script into statements while reading it, without loading the whole file.
+
+	Semicolons inside quoted strings, quoted identifiers and comments don't end a statement. Comments
+	are dropped, except MySQL's executable /*! ... */ comments. DELIMITER, a client command, isn't supported.
+	"""
+	buf, pos, eof = "", 0, False
+	parts: List[str] = []
+	while True:
+		m = _TOKEN.match(buf, pos)
+		# A token that reaches the end of the buffer may continue in the next chunk
+		if (m is None or m.end() == len(buf)) and not eof:
+			chunk = in_file.read(read_size)
+			eof = not chunk
+			buf, pos = buf[pos:] + chunk, 0
+			continue
+		if m is None:
+			break
+
+		token = m.group()
+		pos = m.end()
+		if token == ";":
+			statement = "".join(parts).strip()
+			parts = []
+			if statement:
+				yield statement
+		elif token.startswith(("--", "#")) or (token.startswith("/*") and not token.startswith("/*!")):
+			parts.append(" ")
+		else:
+			parts.append(token)
+
+	if pos < len(buf):
+		raise ValueError(f"unterminated string or comment: {buf[pos:pos + 40]!r}")
+	statement = "".join(parts).strip()
+	if statement:
+		yield statement
+
+
+def split_insert(statement: str) -> Optional[Tuple[str, str, str]]:
+	"""Splits INSERT ... VALUES (...), ... into (table, the part up to and including VALUES, the rows).
+
+	:returns: None if the statement isn't a plain INSERT ... VALUES, e.g. INSERT ... SELECT or
+				INSERT ... ON DUPLICATE KEY UPDATE
+	"""
+	if statement[:6].lower() != "insert":
+		return None
+	m = _INSERT.match(statement)
+	if m is None:
+		return None
+	rows = statement[m.end():].strip()
+	if not rows.startswith("(") or not rows.endswith(")") or _ON_DUPLICATE.search(rows):
+		return None
+	ignore, table, columns = m.groups()
+	prefix = f"INSERT {'IGNORE ' if ignore else ''}INTO {table} {columns or ''} VALUES "
+	return table.strip("`"), prefix, rows
+
+
+def coalesce_inserts(statements: Iterable[str], max_bytes: int = MAX_PACKET_BYTES) -> Iterator[Statement]:
+	"""Merges consecutive INSERTs into the same table and columns into multi-row INSERTs.
+
+	A merged statement stays under max_bytes, unless a single INSERT is larger already.
+	"""
+	table, prefix, rows, size = None, None, [], 0
+
+	for statement in statements:
+		if statement.startswith("DELIMITER"):
+			raise ValueError("DELIMITER is a client command and isn't supported")
+		insert = split_insert(statement)
+		if rows and (insert is None or insert[1] != prefix or size + len(insert[2]) + 1 > max_bytes):
+			yield prefix + ",".join(rows), table
+			rows, size = [], 0
+		if insert is None:
+			yield statement, None
+			continue
+		table, prefix, values = insert
+		rows.append(values)
+		size += len(values) + 1 + (0 if len(rows) > 1 else len(prefix))
+
+	if rows:
+		yield prefix + ",".join(rows), table
+
+
+def load_script(
+	db: DB,
+	file_name: str,
+	max_bytes: int = MAX_PACKET_BYTES,
+	transaction_rows: int = 100000,
+	relax_checks: bool = True,
+	progress: Optional[Callable[[str, int, float], None]] = None,
+) -> Dict[str, int]:
+	"""Runs a SQL script, with its INSERTs coalesced by coalesce_inserts.
+
+	Statements run on one connection in transactions of about transaction_rows inserted rows.
+	DDL commits implicitly, as usual. The script may change the session's database and settings,
+	so the connection is closed afterwards instead of being returned to the pool.
+
+	:param relax_checks: If True, foreign_key_checks and unique_checks are off while the script runs
+	:param progress: Called with (table, rows inserted so far, seconds spent on the table) after
+						each INSERT
+	:returns: The number of rows inserted into each table
+	"""
+	counts: Dict[str, int] = {}
+	seconds: Dict[str, float] = {}
+	conn = db.pool.acquire()
+	try:
+		with conn.cursor() as cur:
+			if relax_checks:
+				cur.execute("SET foreign_key_checks = 0, unique_checks = 0")
+			conn.begin()
+			pending = 0
+			with open(file_name, "r", encoding="utf-8") as in_file:
+				for statement, table in coalesce_inserts(iter_statements(in_file), max_bytes):
+					start = time.perf_counter()
+					count = cur.execute(statement)
+					if table is None:
+						continue
+					counts[table] = counts.get(table, 0) + count
+					seconds[table] = seconds.get(table, 0.0) + time.perf_counter() - start
+					pending += count
+					if pending >= transaction_rows:
+						conn.commit()
+						conn.begin()
+						pending = 0
+					if progress:
+						progress(table, counts[table], seconds[table])
+			conn.commit()
+	except BaseException:
+		try:
+			conn.rollback()
+		except Exception:
+			pass
+		raise
+	finally:
+		db.pool.release(conn, discard=True)
+		for table in counts:
+			db.invalidate(table)
+	return counts
+
+
+def main(argv: Optional[List[str]] = None):
+	parser = argparse.ArgumentParser(description="Runs SQL scripts, batching their single-row INSERTs.")
+	parser.add_argument("files", nargs="+", help="SQL scripts, run in order")
+	parser.add_argument("--host", default="localhost")
+	parser.add_argument("--port", type=int, default=3306)
+	parser.add_argument("--user", default="root")
+	parser.add_argument("--password", default="dbuserdbuser")
+	parser.add_argument("--database", default="db_book", help="database the scripts start in")
+	parser.add_argument("--max-bytes", type=int, default=MAX_PACKET_BYTES,
+						help="maximum size of a merged INSERT; keep it under max_allowed_packet")
+	parser.add_argument("--transaction-rows", type=int, default=100000, help="rows per transaction")
+	parser.add_argument("--keep-checks", action="store_true",
+						help="leave foreign_key_checks and unique_checks on")
+	parser.add_argument("--quiet", action="store_true", help="only print the totals")
+	args = parser.parse_args(argv)
+
+	db = DB(host=args.host, port=args.port, user=args.user, password=args.password, database=args.database)
+
+	current = {"table": None}
+
+	def progress(table: str, rows: int, seconds: float):
+		if table != current["table"]:
+			if current["table"] is not None:
+				print()
+			current["table"] = table
+		print(f"\r{table}: {rows} rows ({rows / max(seconds, 1e-9):.0f} rows/s)", end="", flush=True)
+
+	try:
+		for file_name in args.files:
+			current["table"] = None
+			start = time.perf_counter()
+			counts = load_script(
+				db,
+				file_name,
+				max_bytes=args.max_bytes,
+				transaction_rows=args.transaction_rows,
+				relax_checks=not args.keep_checks,
+				progress=None if args.quiet else progress,
+			)
+			elapsed = time.perf_counter() - start
+			if current["table"] is not None:
+				print()
+			rows = sum(counts.values())
+			print(f"{file_name}: {rows} rows into {len(counts)} tables in {elapsed:.2f}s "
+				  f"({rows / max(elapsed, 1e-9):.0f} rows/s)")
+	finally:
+		db.close()
+
+
+if __name__ == "__main__":
+	main()
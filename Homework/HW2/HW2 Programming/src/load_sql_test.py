@@ -0,0 +1,66 @@
+import io
+import unittest
+
+from load_sql import coalesce_inserts, iter_statements, split_insert
+
+
+class LoadSqlTest(unittest.TestCase):
+    def test_iter_statements(self):
+        script = (
+            "/* header; */ CREATE TABLE t (a int); -- comment; here\n"
+            "insert into t values ('x;y', 'it''s', \"a\\\"b;\");\n"
+            "# another; comment\n"
+            "/*!40101 SET NAMES utf8 */;\n"
+            "insert into `t;2` values (1 - -1)"
+        )
+        want = [
+            "CREATE TABLE t (a int)",
+            "insert into t values ('x;y', 'it''s', \"a\\\"b;\")",
+            "/*!40101 SET NAMES utf8 */",
+            "insert into `t;2` values (1 - -1)",
+        ]
+        # A tiny read size splits tokens across chunks
+        for read_size in (1, 3, 1 << 16):
+            self.assertEqual(want, list(iter_statements(io.StringIO(script), read_size)))
+
+        with self.assertRaises(ValueError):
+            list(iter_statements(io.StringIO("insert into t values ('x);")))
+
+    def test_split_insert(self):
+        tests = [
+            (
+                "insert into t values ( 'A', 1)",
+                ("t", "INSERT INTO t  VALUES ", "( 'A', 1)")
+            ),
+            (
+                "INSERT  INTO `t`(`a`,`b`) values \n(1,2),\n(3,4)",
+                ("t", "INSERT INTO `t` (`a`,`b`) VALUES ", "(1,2),\n(3,4)")
+            ),
+            ("insert into t select * from u", None),
+            ("insert into t values (1) on duplicate key update a = values(a)", None),
+            ("delete from t", None),
+        ]
+        for statement, want in tests:
+            self.assertEqual(want, split_insert(statement))
+
+    def test_coalesce_inserts(self):
+        statements = [
+            "delete from t",
+            "insert into t values (1)",
+            "insert into t values (2)",
+            "insert into u values (3)",
+            "insert into t values (4)",
+            "insert into t values (5)",
+            "insert into t values (6)",
+        ]
+        self.assertEqual([
+            ("delete from t", None),
+            ("INSERT INTO t  VALUES (1),(2)", "t"),
+            ("INSERT INTO u  VALUES (3)", "u"),
+            ("INSERT INTO t  VALUES (4),(5)", "t"),
+            ("INSERT INTO t  VALUES (6)", "t"),
+        ], list(coalesce_inserts(statements, max_bytes=30)))
+
+
+if __name__ == '__main__':
+    unittest.main()
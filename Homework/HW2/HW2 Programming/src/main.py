@@ -1,15 +1,35 @@
-from typing import Any, Dict
+import datetime
+import hashlib
+import json
+import time
+from decimal import Decimal
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
 
 # Simple starter project to test installation and environment.
 # Based on https://fastapi.tiangolo.com/tutorial/first-steps/
 from fastapi import FastAPI, Response, Request, status
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
 # Explicitly included uvicorn to enable starting within main program.
 # Starting within main program is a simple way to enable running
 # the code within the PyCharm debugger
 import uvicorn
-
-from db import DB
+from pymysql.err import IntegrityError
+
+from cache import ResultCache
+from db import DB, AsyncDB, ConstraintViolation, DuplicateKey, RowsNotFound
+from metrics import Histogram, QueryMetrics, RouteMetricsMiddleware, render_stats
+from schema import SchemaError
+
+# Optional: a faster JSON encoder, and brotli compression for clients that accept it
+try:
+	import orjson
+except ImportError:
+	orjson = None
+try:
+	import brotli
+except ImportError:
+	brotli = None
 
 # Type definitions
 KV = Dict[str, Any]  # Key-value pairs
@@ -20,20 +40,440 @@ app = FastAPI()
 # There are design patterns for passing confidential information to
 # application.
 # TODO: You may need to change the password
-db = DB(
+# Queries run on AsyncDB's worker threads so that a slow query doesn't block the event loop.
+# Select results are cached for a few seconds; writes through db invalidate them.
+# Every statement is timed, and statements slower than SLOW_QUERY_SECONDS are logged with their EXPLAIN.
+SLOW_QUERY_SECONDS = 0.5
+query_metrics = QueryMetrics(slow_query_seconds=SLOW_QUERY_SECONDS)
+db = AsyncDB(DB(
 	host="localhost",
 	port=3306,
 	user="root",
 	password="dbuserdbuser",
 	database="s24_hw2",
+	# Connections are opened on first use (startup loads the schemas), so importing main needs no database
+	min_size=0,
+	cache=ResultCache(ttl=5.0, max_entries=10000),
+	metrics=query_metrics,
+))
+
+ENROLLMENT_YEARS = range(2016, 2024)
+EMPLOYEE_TYPES = {"Professor", "Lecturer", "Staff"}
+# Values of the `stream` query parameter accepted by the list endpoints
+STREAM_FORMATS = {"json", "ndjson"}
+# Page size used when the list endpoints get a `cursor` without a `limit`, and the largest `limit` allowed
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+# The most IDs a batchGet request may ask for, and the most writes a batch request may contain
+MAX_BATCH_GET_SIZE = 10000
+MAX_BATCH_WRITE_SIZE = 10000
+# Responses smaller than this are sent uncompressed
+COMPRESS_MIN_BYTES = 1024
+# Seconds an ETag stays valid. Writes through db change the ETag at once, but writes by other processes
+# (other uvicorn workers included) only when it expires, as with the result cache's TTL.
+ETAG_MAX_AGE = 5
+
+# The counters among ConnectionPool.stats and ResultCache.stats; the other values are exported as gauges
+POOL_COUNTERS = {"checkouts", "timeouts", "created", "recycled", "total_wait"}
+CACHE_COUNTERS = {"hits", "misses", "evictions", "invalidations"}
+
+request_latency = Histogram(
+	"http_request_duration_seconds", "Time spent handling requests", ("method", "route", "status")
 )
 
+app.add_middleware(GZipMiddleware, minimum_size=COMPRESS_MIN_BYTES, compresslevel=6)
+app.add_middleware(RouteMetricsMiddleware, histogram=request_latency)
+
 @app.get("/")
 async def healthcheck():
 	return HTMLResponse(content="<h1>Heartbeat</h1>", status_code=status.HTTP_200_OK)
 
 
-# TODO: all methods below
+@app.get("/metrics")
+async def get_metrics():
+	"""Exports request and query latencies, query rows and errors, and pool and cache stats for Prometheus."""
+	lines = request_latency.render() + query_metrics.render() + render_stats("db_pool", db.pool_stats(), POOL_COUNTERS)
+	cache_stats = db.cache_stats()
+	if cache_stats is not None:
+		lines += render_stats("db_cache", cache_stats, CACHE_COUNTERS)
+	return Response(content="\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
+
+
+# --- HELPERS ---
+
+# Validates a request body, returning an error message or None
+Check = Callable[[KV], Optional[str]]
+
+
+def bad_request(detail: str) -> JSONResponse:
+	return JSONResponse(content={"detail": detail}, status_code=status.HTTP_400_BAD_REQUEST)
+
+
+def not_found() -> JSONResponse:
+	return JSONResponse(content={"detail": "Not Found"}, status_code=status.HTTP_404_NOT_FOUND)
+
+
+def check_enrollment_year(values: KV) -> Optional[str]:
+	if "enrollment_year" not in values:
+		return None
+	try:
+		year = int(values["enrollment_year"])
+	except (TypeError, ValueError):
+		return "enrollment_year must be a year"
+	if year not in ENROLLMENT_YEARS:
+		return f"enrollment_year must be between {ENROLLMENT_YEARS.start} and {ENROLLMENT_YEARS.stop - 1}"
+	return None
+
+
+def check_employee_type(values: KV) -> Optional[str]:
+	if "employee_type" in values and values["employee_type"] not in EMPLOYEE_TYPES:
+		return f"employee_type must be one of {', '.join(sorted(EMPLOYEE_TYPES))}"
+	return None
+
+
+def parse_query_params(req: Request) -> Tuple[List[str], KV]:
+	"""Splits the query parameters into the `fields` projection and the filters."""
+	filters = dict(req.query_params)
+	fields = filters.pop("fields", None)
+	columns = fields.split(",") if fields else []
+	return columns, filters
+
+
+def constraint_error(e: ConstraintViolation) -> JSONResponse:
+	if isinstance(e, DuplicateKey) and e.key == "email":
+		return bad_request("email already exists")
+	return bad_request(f"violates a constraint: {e.message}")
+
+
+def encode_default(value: Any) -> Any:
+	"""Encodes the MySQL column types JSON doesn't have, the way jsonable_encoder does."""
+	if isinstance(value, Decimal):
+		return int(value) if value.as_tuple().exponent >= 0 else float(value)
+	if isinstance(value, (datetime.date, datetime.time)):
+		return value.isoformat()
+	if isinstance(value, datetime.timedelta):
+		return value.total_seconds()
+	if isinstance(value, bytes):
+		return value.decode()
+	raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def dumps(content: Any) -> bytes:
+	if orjson is not None:
+		return orjson.dumps(content, default=encode_default)
+	return json.dumps(content, default=encode_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def json_response(content: Any, req: Request, headers: Optional[Dict[str, str]] = None) -> Response:
+	"""Encodes content with dumps rather than jsonable_encoder, brotli-compressed if the client accepts it.
+
+	Other responses are gzipped by GZipMiddleware.
+	"""
+	body = dumps(content)
+	headers = dict(headers or {})
+	if brotli is not None and len(body) >= COMPRESS_MIN_BYTES and "br" in req.headers.get("Accept-Encoding", ""):
+		body = brotli.compress(body, quality=4)
+		headers["Content-Encoding"] = "br"
+		headers["Vary"] = "Accept-Encoding"
+	return Response(content=body, media_type="application/json", headers=headers)
+
+
+def etag(table: str, req: Request) -> str:
+	"""Returns the ETag of a read of table: its write version, the current ETAG_MAX_AGE period, and a digest
+	of the path and query.
+
+	It is computed without touching MySQL. It changes whenever db writes to table, but db's write version
+	is per process, so it also changes every ETAG_MAX_AGE seconds: a write made elsewhere stops a client's
+	copy from being reported as current within that time.
+	"""
+	query = "&".join(sorted(f"{k}={v}" for k, v in req.query_params.multi_items()))
+	digest = hashlib.blake2b(f"{req.url.path}?{query}".encode(), digest_size=8).hexdigest()
+	period = int(time.time() // ETAG_MAX_AGE)
+	return f'W/"{db.write_version(table)}.{period}-{digest}"'
+
+
+def not_modified(req: Request, tag: str) -> bool:
+	"""Returns True if the request's If-None-Match header matches tag."""
+	header = req.headers.get("If-None-Match")
+	if not header:
+		return False
+	tags = {t.strip().removeprefix("W/") for t in header.split(",")}
+	return "*" in tags or tag.removeprefix("W/") in tags
+
+
+def conditional_headers(table: str, req: Request) -> Tuple[Optional[Response], Dict[str, str]]:
+	"""Returns a 304 Not Modified response if the client's copy is current, and the headers for a fresh one."""
+	tag = etag(table, req)
+	if not_modified(req, tag):
+		return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": tag}), {}
+	return None, {"ETag": tag, "Cache-Control": "no-cache"}
+
+
+async def encode_stream(first: List[KV], batches: AsyncIterator[List[KV]], ndjson: bool) -> AsyncIterator[bytes]:
+	"""Encodes streamed batches as one JSON array, or as one JSON object per line if ndjson is True."""
+	if ndjson:
+		batch = first
+		while batch is not None:
+			yield b"".join(dumps(row) + b"\n" for row in batch)
+			batch = await anext(batches, None)
+		return
+
+	yield b"["
+	sep = b""
+	batch = first
+	while batch is not None:
+		yield sep + b",".join(dumps(row) for row in batch)
+		sep = b","
+		batch = await anext(batches, None)
+	yield b"]"
+
+
+async def get_page(
+	table: str,
+	id_column: str,
+	columns: List[str],
+	filters: KV,
+	limit: Optional[str],
+	cursor: Optional[str],
+	req: Request,
+	headers: Dict[str, str],
+):
+	"""Returns one page of rows in primary key order, using keyset pagination on id_column.
+
+	The next page's cursor is sent in the X-Next-Cursor header, which is absent on the last page.
+	"""
+	try:
+		limit = int(limit) if limit is not None else DEFAULT_PAGE_SIZE
+		after = int(cursor) if cursor is not None else None
+	except ValueError:
+		return bad_request("limit and cursor must be integers")
+	if not 0 < limit <= MAX_PAGE_SIZE:
+		return bad_request(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+
+	# The cursor comes from the primary key, so select it even if `fields` leaves it out
+	hide_id = bool(columns) and id_column not in columns
+	if hide_id:
+		columns = columns + [id_column]
+
+	# Fetch one extra row to learn whether there is a next page
+	rows = await db.select(table, columns, filters, order_by=id_column, limit=limit + 1, after=after)
+	has_next = len(rows) > limit
+	rows = rows[:limit]
+	if has_next:
+		headers = {**headers, "X-Next-Cursor": str(rows[-1][id_column])}
+	if hide_id:
+		for row in rows:
+			del row[id_column]
+	return json_response(rows, req, headers)
+
+
+async def get_rows(table: str, id_column: str, req: Request):
+	columns, filters = parse_query_params(req)
+	stream = filters.pop("stream", None)
+	limit, cursor = filters.pop("limit", None), filters.pop("cursor", None)
+	unchanged, headers = conditional_headers(table, req)
+	if unchanged is not None:
+		return unchanged
+	if limit is not None or cursor is not None:
+		if stream is not None:
+			return bad_request("stream cannot be combined with limit or cursor")
+		return await get_page(table, id_column, columns, filters, limit, cursor, req, headers)
+	if stream is None:
+		return json_response(await db.select(table, columns, filters), req, headers)
+	if stream not in STREAM_FORMATS:
+		return bad_request(f"stream must be one of {', '.join(sorted(STREAM_FORMATS))}")
+
+	# Fetch the first batch before responding so that query errors still produce an error status
+	batches = db.iter_select_batches(table, columns, filters)
+	first = await anext(batches, [])
+	return StreamingResponse(
+		encode_stream(first, batches, ndjson=stream == "ndjson"),
+		media_type="application/x-ndjson" if stream == "ndjson" else "application/json",
+		headers=headers,
+	)
+
+
+async def get_row(table: str, id_column: str, row_id: int, req: Request):
+	unchanged, headers = conditional_headers(table, req)
+	if unchanged is not None:
+		return unchanged
+	rows = await db.select(table, [], {id_column: row_id})
+	if not rows:
+		return not_found()
+	return json_response(rows[0], req, headers)
+
+
+async def batch_get_rows(table: str, id_column: str, body: Any):
+	if not isinstance(body, dict) or not isinstance(body.get("ids"), list):
+		return bad_request("body must be a JSON object with a list of ids")
+	ids, fields = body["ids"], body.get("fields") or []
+	if not all(isinstance(i, int) and not isinstance(i, bool) for i in ids):
+		return bad_request("ids must be integers")
+	if len(ids) > MAX_BATCH_GET_SIZE:
+		return bad_request(f"at most {MAX_BATCH_GET_SIZE} ids can be requested at once")
+	if isinstance(fields, str):
+		fields = fields.split(",")
+	if not isinstance(fields, list) or not all(isinstance(f, str) for f in fields):
+		return bad_request("fields must be a list of attribute names")
+	# Checked here rather than by MySQL, which would fail the whole query with a 500
+	schema = db.table_schema(table)
+	if schema is None:
+		await db.refresh_schemas()
+		schema = db.table_schema(table)
+	try:
+		if schema is not None:
+			schema.check_columns(fields)
+	except SchemaError as e:
+		return bad_request(str(e))
+
+	found = await db.select_by_ids(table, id_column, ids, columns=fields)
+	ids = list(dict.fromkeys(ids))
+	return {
+		"found": [found[i] for i in ids if i in found],
+		"missing": [i for i in ids if i not in found],
+	}
+
+
+def is_id(value: Any) -> bool:
+	return isinstance(value, int) and not isinstance(value, bool)
+
+
+async def batch_write_rows(table: str, id_column: str, body: Any, check: Check):
+	"""Validates a batch of creates, updates and deletes, then applies them in one transaction.
+
+	Validation costs at most two queries per batch: one for the IDs being updated or deleted and one for
+	the emails being claimed. Both bypass the result cache, so they see writes by other processes. Nothing
+	is written if any record is invalid, or if a row is deleted between validation and the write.
+	"""
+	if not isinstance(body, dict):
+		return bad_request("body must be a JSON object")
+	creates, updates, deletes = body.get("create", []), body.get("update", []), body.get("delete", [])
+	if not (
+		isinstance(creates, list) and isinstance(updates, list) and isinstance(deletes, list)
+		and all(isinstance(row, dict) for row in creates + updates)
+	):
+		return bad_request("create and update must be lists of objects and delete a list of IDs")
+	if len(creates) + len(updates) + len(deletes) > MAX_BATCH_WRITE_SIZE:
+		return bad_request(f"a batch can contain at most {MAX_BATCH_WRITE_SIZE} writes")
+
+	errors = []
+
+	def error(op: str, index: int, detail: str):
+		errors.append({"op": op, "index": index, "detail": detail})
+
+	for i, row in enumerate(creates):
+		detail = "email is required" if row.get("email") is None else check(row)
+		if detail:
+			error("create", i, detail)
+	for i, row in enumerate(updates):
+		if not is_id(row.get(id_column)):
+			detail = f"{id_column} is required"
+		elif "email" in row and row["email"] is None:
+			detail = "email cannot be null"
+		else:
+			detail = check(row)
+		if detail:
+			error("update", i, detail)
+	for i, row_id in enumerate(deletes):
+		if not is_id(row_id):
+			error("delete", i, f"{id_column} must be an integer")
+	schema = db.table_schema(table)
+	if schema is not None:
+		for op, rows in (("create", creates), ("update", updates)):
+			for i, row in enumerate(rows):
+				try:
+					schema.convert_row(row)
+				except SchemaError as e:
+					error(op, i, str(e))
+	if errors:
+		return JSONResponse(content={"errors": errors}, status_code=status.HTTP_400_BAD_REQUEST)
+
+	# Who claims each email: (op, index, ID), where the ID is None for a create. Emails are compared
+	# case-insensitively, like MySQL's default collations do.
+	claims: Dict[str, Tuple[str, int, Optional[int]]] = {}
+	for op, rows in (("create", creates), ("update", updates)):
+		for i, row in enumerate(rows):
+			if "email" not in row:
+				continue
+			email = str(row["email"]).lower()
+			if email in claims:
+				error(op, i, "email appears more than once in the batch")
+			claims[email] = (op, i, row.get(id_column) if op == "update" else None)
+
+	ids = [row[id_column] for row in updates] + deletes
+	found = await db.select_by_ids(table, id_column, ids, columns=[id_column]) if ids else {}
+	for op, rows in (("update", [row[id_column] for row in updates]), ("delete", deletes)):
+		for i, row_id in enumerate(rows):
+			if row_id not in found:
+				error(op, i, "not found")
+
+	emails = [row["email"] for rows in (creates, updates) for row in rows if "email" in row]
+	owners = await db.select(table, [id_column, "email"], {"email__in": emails}, cached=False) if emails else []
+	deleted = set(deletes)
+	for owner in owners:
+		# An owner the collation matched but lowercasing doesn't (e.g. trailing spaces) is left to the
+		# UNIQUE index, which makes apply_batch raise and roll back
+		claim = claims.get(str(owner["email"]).lower())
+		if claim is None:
+			continue
+		op, i, claimant = claim
+		if owner[id_column] != claimant and owner[id_column] not in deleted:
+			error(op, i, "email already exists")
+
+	if errors:
+		return JSONResponse(content={"errors": errors}, status_code=status.HTTP_400_BAD_REQUEST)
+
+	try:
+		return await db.apply_batch(table, id_column, creates=creates, updates=updates, deletes=deletes)
+	except IntegrityError as e:
+		# A concurrent write got there first; the transaction was rolled back
+		return bad_request(f"batch conflicts with existing data: {e.args[-1]}")
+	except RowsNotFound as e:
+		return bad_request(f"batch conflicts with existing data: {e}")
+
+
+# Single-row writes are optimistic: the body is validated in-process, then the write is the only statement.
+# A duplicate email is caught by the UNIQUE index on email, and a missing row by the count of rows matched.
+
+async def create_row(table: str, id_column: str, body: KV, check: Check):
+	if body.get("email") is None:
+		return bad_request("email is required")
+	error = check(body)
+	if error:
+		return bad_request(error)
+
+	try:
+		await db.insert(table, body)
+	except ConstraintViolation as e:
+		return constraint_error(e)
+	return Response(status_code=status.HTTP_201_CREATED)
+
+
+async def update_row(table: str, id_column: str, row_id: int, body: KV, check: Check):
+	if "email" in body and body["email"] is None:
+		return bad_request("email cannot be null")
+	error = check(body)
+	if error:
+		return bad_request(error)
+	if not body:
+		# Nothing to write, but the row must still exist
+		found = await db.select(table, [id_column], {id_column: row_id})
+		return Response(status_code=status.HTTP_200_OK) if found else not_found()
+
+	try:
+		matched = await db.update(table, body, {id_column: row_id})
+	except ConstraintViolation as e:
+		return constraint_error(e)
+	if not matched:
+		return not_found()
+	return Response(status_code=status.HTTP_200_OK)
+
+
+async def delete_row(table: str, id_column: str, row_id: int):
+	if not await db.delete(table, {id_column: row_id}):
+		return not_found()
+	return Response(status_code=status.HTTP_200_OK)
+
 
 # --- STUDENTS ---
 
@@ -65,25 +505,73 @@ async def get_students(req: Request):
 
 	You can assume the query parameters are valid attribute names in the student table
 	(except `fields`).
+	Once the table schemas are loaded at startup, an unknown attribute in `fields` or the filters, or a filter
+	value that doesn't fit its attribute's type, gets 400 Bad Request without querying the database.
+
+	A query parameter may end in an operator, which is compiled into the SQL WHERE clause:
+		GET http://0.0.0.0:8002/students?enrollment_year__gte=2020&student_id__in=1,2,3
+	supports eq, ne, gt, gte, lt, lte, in (comma-separated), startswith, endswith, contains and isnull.
+
+	The optional `stream` query parameter streams the rows from a server-side cursor instead of
+	buffering them: `stream=json` sends a JSON array and `stream=ndjson` sends one JSON object per line.
+
+	The optional `limit` and `cursor` query parameters page through the rows in ID order. The
+	X-Next-Cursor response header holds the `cursor` for the next page and is absent on the last page.
+
+	Responses carry an ETag that changes whenever students are written through this service, and at least every
+	ETAG_MAX_AGE seconds. A request whose If-None-Match header matches it gets 304 Not Modified without
+	querying the database.
 
 	:param req: The request that optionally contains query parameters
 	:returns: A list of dicts representing students. The HTTP status should be set to 200 OK.
 	"""
 
-	# Use `dict(req.query_params)` to access query parameters
+	return await get_rows("student", "student_id", req)
 
-	try:
-		# raise NotImplemented()
-		result = [
-			{"cat": True},
-			{"canary": "Bird"}
-		]
-	except Exception as e:
-		response = JSONResponse(content=result, status_code=200)
+
+@app.post("/students:batchGet")
+async def batch_get_students(req: Request):
+	"""Gets many students by ID in one round trip.
+
+	For instance,
+		POST http://0.0.0.0:8002/students:batchGet
+		{
+			"ids": [1, 2, 100],
+			"fields": ["first_name", "email"]
+		}
+	should return students 1 and 2 under `found` (in the requested order) and 100 under `missing`.
+	`fields` is optional and may also be a comma-separated string.
+
+	:param req: The request, which contains the IDs in its body
+	:returns: A dict with the found students and the missing IDs, with HTTP status 200 OK.
+				If the body is malformed, the HTTP status should be set to 400 Bad Request.
+	"""
+	return await batch_get_rows("student", "student_id", await req.json())
+
+
+@app.post("/students:batch")
+async def batch_write_students(req: Request):
+	"""Creates, updates and deletes many students in one transaction.
+
+	For instance,
+		POST http://0.0.0.0:8002/students:batch
+		{
+			"create": [{"first_name": "John", "email": "jd@columbia.edu", "enrollment_year": 2020}, ...],
+			"update": [{"student_id": 1, "first_name": "Joe"}, ...],
+			"delete": [2, 3]
+		}
+	Each record is validated as in post_student and put_student. Every key is optional.
+
+	:param req: The request, which contains the batch in its body
+	:returns: If every record is valid, a dict with the number of students created, updated and deleted,
+				with HTTP status 200 OK. Otherwise nothing is written and the HTTP status is set to
+				400 Bad Request, with the index and reason of every invalid record.
+	"""
+	return await batch_write_rows("student", "student_id", await req.json(), check_enrollment_year)
 
 
 @app.get("/students/{student_id}")
-async def get_student(student_id: int):
+async def get_student(student_id: int, req: Request):
 	"""Gets a student by ID.
 
 	For instance,
@@ -93,11 +581,13 @@ async def get_student(student_id: int):
 
 	If the student ID doesn't exist, the HTTP status should be set to 404 Not Found.
 
+	Like GET /students, the response carries an ETag and honors If-None-Match.
+
 	:param student_id: The ID to be matched
 	:returns: If the student ID exists, a dict representing the student with HTTP status set to 200 OK.
 				If the student ID doesn't exist, the HTTP status should be set to 404 Not Found.
 	"""
-	pass
+	return await get_row("student", "student_id", student_id, req)
 
 @app.post("/students")
 async def post_student(req: Request):
@@ -124,9 +614,7 @@ async def post_student(req: Request):
 	:returns: If the request is valid, the HTTP status should be set to 201 Created.
 				If the request is not valid, the HTTP status should be set to 400 Bad Request.
 	"""
-
-	# Use `await req.json()` to access the request body
-	pass
+	return await create_row("student", "student_id", await req.json(), check_enrollment_year)
 
 @app.put("/students/{student_id}")
 async def put_student(student_id: int, req: Request):
@@ -153,9 +641,7 @@ async def put_student(student_id: int, req: Request):
 	:returns: If the request is valid, the HTTP status should be set to 200 OK.
 				If the request is not valid, the HTTP status should be set to the appropriate error code.
 	"""
-
-	# Use `await req.json()` to access the request body
-	pass
+	return await update_row("student", "student_id", student_id, await req.json(), check_enrollment_year)
 
 @app.delete("/students/{student_id}")
 async def delete_student(student_id: int):
@@ -171,7 +657,7 @@ async def delete_student(student_id: int):
 	:returns: If the request is valid, the HTTP status should be set to 200 OK.
 				If the request is not valid, the HTTP status should be set to 404 Not Found.
 	"""
-	pass
+	return await delete_row("student", "student_id", student_id)
 
 
 # --- EMPLOYEES ---
@@ -196,16 +682,53 @@ async def get_employees(req: Request):
 
 	You can assume the query parameters are valid attribute names in the employee table
 	(except `fields`).
+	Once the table schemas are loaded at startup, an unknown attribute in `fields` or the filters, or a filter
+	value that doesn't fit its attribute's type, gets 400 Bad Request without querying the database.
+
+	A query parameter may end in an operator, which is compiled into the SQL WHERE clause:
+		GET http://0.0.0.0:8002/employees?employee_type__in=Professor,Lecturer
+	supports eq, ne, gt, gte, lt, lte, in (comma-separated), startswith, endswith, contains and isnull.
+
+	The optional `stream` query parameter streams the rows from a server-side cursor instead of
+	buffering them: `stream=json` sends a JSON array and `stream=ndjson` sends one JSON object per line.
+
+	The optional `limit` and `cursor` query parameters page through the rows in ID order. The
+	X-Next-Cursor response header holds the `cursor` for the next page and is absent on the last page.
+
+	Responses carry an ETag that changes whenever employees are written through this service, and at least every
+	ETAG_MAX_AGE seconds. A request whose If-None-Match header matches it gets 304 Not Modified without
+	querying the database.
 
 	:param req: The request that optionally contains query parameters
 	:returns: A list of dicts representing employees. The HTTP status should be set to 200 OK.
 	"""
+	return await get_rows("employee", "employee_id", req)
+
+@app.post("/employees:batchGet")
+async def batch_get_employees(req: Request):
+	"""Gets many employees by ID in one round trip. See batch_get_students.
+
+	:param req: The request, which contains the IDs in its body
+	:returns: A dict with the found employees and the missing IDs, with HTTP status 200 OK.
+				If the body is malformed, the HTTP status should be set to 400 Bad Request.
+	"""
+	return await batch_get_rows("employee", "employee_id", await req.json())
+
+
+@app.post("/employees:batch")
+async def batch_write_employees(req: Request):
+	"""Creates, updates and deletes many employees in one transaction. See batch_write_students.
+
+	:param req: The request, which contains the batch in its body
+	:returns: If every record is valid, a dict with the number of employees created, updated and deleted,
+				with HTTP status 200 OK. Otherwise nothing is written and the HTTP status is set to
+				400 Bad Request, with the index and reason of every invalid record.
+	"""
+	return await batch_write_rows("employee", "employee_id", await req.json(), check_employee_type)
 
-	# Use `dict(req.query_params)` to access query parameters
-	pass
 
 @app.get("/employees/{employee_id}")
-async def get_employee(employee_id: int):
+async def get_employee(employee_id: int, req: Request):
 	"""Gets an employee by ID.
 
 	For instance,
@@ -215,11 +738,13 @@ async def get_employee(employee_id: int):
 
 	If the employee ID doesn't exist, the HTTP status should be set to 404 Not Found.
 
+	Like GET /employees, the response carries an ETag and honors If-None-Match.
+
 	:param employee_id: The ID to be matched
 	:returns: If the employee ID exists, a dict representing the employee with HTTP status set to 200 OK.
 				If the employee ID doesn't exist, the HTTP status should be set to 404 Not Found.
 	"""
-	pass
+	return await get_row("employee", "employee_id", employee_id, req)
 
 @app.post("/employees")
 async def post_employee(req: Request):
@@ -246,9 +771,7 @@ async def post_employee(req: Request):
 	:returns: If the request is valid, the HTTP status should be set to 201 Created.
 				If the request is not valid, the HTTP status should be set to 400 Bad Request.
 	"""
-
-	# Use `await req.json()` to access the request body
-	pass
+	return await create_row("employee", "employee_id", await req.json(), check_employee_type)
 
 @app.put("/employees/{employee_id}")
 async def put_employee(employee_id: int, req: Request):
@@ -275,9 +798,7 @@ async def put_employee(employee_id: int, req: Request):
 	:returns: If the request is valid, the HTTP status should be set to 200 OK.
 				If the request is not valid, the HTTP status should be set to the appropriate error code.
 	"""
-
-	# Use `await req.json()` to access the request body
-	pass
+	return await update_row("employee", "employee_id", employee_id, await req.json(), check_employee_type)
 
 @app.delete("/employees/{employee_id}")
 async def delete_employee(employee_id: int):
@@ -293,7 +814,24 @@ async def delete_employee(employee_id: int):
 	:returns: If the request is valid, the HTTP status should be set to 200 OK.
 				If the request is not valid, the HTTP status should be set to 404 Not Found.
 	"""
-	pass
+	return await delete_row("employee", "employee_id", employee_id)
+
+@app.on_event("startup")
+async def startup():
+	# Lets db check `fields` and filters against the tables' columns without a round trip, and flag
+	# filters that can't use an index. Call db.refresh_schemas again after changing the tables.
+	await db.refresh_schemas()
+
+
+@app.exception_handler(SchemaError)
+async def schema_error(req: Request, e: SchemaError):
+	return bad_request(str(e))
+
+
+@app.on_event("shutdown")
+def shutdown():
+	db.close()
+
 
 if __name__ == "__main__":
 	uvicorn.run(app, host="0.0.0.0", port=8002)
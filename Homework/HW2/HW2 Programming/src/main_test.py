@@ -0,0 +1,373 @@
+import asyncio
+import datetime
+import json
+import unittest
+from decimal import Decimal
+from unittest import mock
+
+from fastapi.testclient import TestClient
+from pymysql.err import IntegrityError
+from starlette.requests import Request
+
+import main
+from db import RowsNotFound
+from schema import Column, TableSchema
+
+
+class FakeAsyncDB:
+    """Stands in for main.db. Emails are matched case-insensitively, like MySQL's default collations."""
+
+    def __init__(self, rows, apply_error=None, schema=None):
+        self.rows = rows
+        self.apply_error = apply_error
+        self.schema = schema
+        self.applied = None
+        self.version = 1
+        self.refreshed = 0
+        self.cached_selects = 0
+
+    async def select_by_ids(self, table, id_column, ids, columns=()):
+        return {
+            i: {k: v for k, v in {id_column: i, **self.rows[i]}.items() if not columns or k in columns}
+            for i in ids if i in self.rows
+        }
+
+    async def select(self, table, columns, filters, cached=True):
+        self.cached_selects += cached
+        emails = {e.lower() for e in filters.get("email__in", [row["email"] for row in self.rows.values()])}
+        return [
+            {"student_id": i, "email": row["email"]} for i, row in self.rows.items() if row["email"].lower() in emails
+        ]
+
+    async def apply_batch(self, table, id_column, creates, updates, deletes):
+        if self.apply_error is not None:
+            raise self.apply_error
+        self.applied = (creates, updates, deletes)
+        return {"created": len(creates), "updated": len(updates), "deleted": len(deletes)}
+
+    def table_schema(self, table):
+        return self.schema
+
+    async def refresh_schemas(self):
+        self.refreshed += 1
+        return {self.schema.name: self.schema} if self.schema is not None else {}
+
+    async def iter_select_batches(self, table, columns, filters, batch_size=2):
+        rows = [{"student_id": i, **row} for i, row in self.rows.items()]
+        for i in range(0, len(rows), batch_size):
+            yield rows[i:i + batch_size]
+
+    def write_version(self, table):
+        return str(self.version)
+
+
+async def batches_of(*batches):
+    for batch in batches:
+        yield batch
+
+
+def get_rows(db, query):
+    """Runs a GET /students with query, and returns the status and body."""
+    main.db = db
+    req = Request({"type": "http", "method": "GET", "path": "/students", "query_string": query.encode(), "headers": []})
+
+    async def run():
+        response = await main.get_rows("student", "student_id", req)
+        if not hasattr(response, "body_iterator"):
+            return response.status_code, response.body
+        return response.status_code, b"".join([chunk async for chunk in response.body_iterator])
+
+    return asyncio.run(run())
+
+
+def run_batch(db, body):
+    main.db = db
+    response = asyncio.run(main.batch_write_rows("student", "student_id", body, main.check_enrollment_year))
+    if isinstance(response, dict):
+        return 200, response
+    return response.status_code, json.loads(response.body)
+
+
+def run_batch_get(db, body):
+    main.db = db
+    response = asyncio.run(main.batch_get_rows("student", "student_id", body))
+    if isinstance(response, dict):
+        return 200, response
+    return response.status_code, json.loads(response.body)
+
+
+class BatchGetTest(unittest.TestCase):
+    def setUp(self):
+        self.addCleanup(setattr, main, "db", main.db)
+        self.schema = TableSchema("student", [Column("student_id", "int", False), Column("email", "varchar", False)])
+        self.db = FakeAsyncDB({i: {"email": f"s{i}@x"} for i in (1, 2, 3)}, schema=self.schema)
+
+    def test_found_and_missing(self):
+        tests = [
+            # (ids, found IDs in order, missing)
+            ([], [], []),
+            ([3, 1, 2], [3, 1, 2], []),
+            ([2, 9, 1, 8], [2, 1], [9, 8]),
+            # Duplicates are returned once, where they first appear
+            ([2, 1, 2, 9, 9, 1], [2, 1], [9]),
+        ]
+        for ids, found, missing in tests:
+            code, content = run_batch_get(self.db, {"ids": ids})
+            self.assertEqual(200, code, ids)
+            self.assertEqual(found, [row["student_id"] for row in content["found"]], ids)
+            self.assertEqual(missing, content["missing"], ids)
+
+    def test_fields(self):
+        for fields in (["email"], "email"):
+            code, content = run_batch_get(self.db, {"ids": [1], "fields": fields})
+            self.assertEqual((200, [{"email": "s1@x"}]), (code, content["found"]), fields)
+
+        for fields in (["iq"], "email,iq", [1], {"email": 1}):
+            code, content = run_batch_get(self.db, {"ids": [1], "fields": fields})
+            self.assertEqual(400, code, fields)
+
+    def test_schema_loaded_on_demand(self):
+        # Before startup has loaded the schemas, unknown fields are still rejected rather than sent to MySQL
+        self.db.table_schema = lambda table: self.schema if self.db.refreshed else None
+        code, content = run_batch_get(self.db, {"ids": [1], "fields": ["iq"]})
+        self.assertEqual((400, "student has no column iq"), (code, content["detail"]))
+        self.assertEqual(1, self.db.refreshed)
+
+    def test_rejected(self):
+        for body in ([1], {}, {"ids": 1}, {"ids": ["1"]}, {"ids": [True]}):
+            code, _ = run_batch_get(self.db, body)
+            self.assertEqual(400, code, body)
+
+        with mock.patch.object(main, "MAX_BATCH_GET_SIZE", 3):
+            self.assertEqual(200, run_batch_get(self.db, {"ids": [1, 2, 3]})[0])
+            self.assertEqual(400, run_batch_get(self.db, {"ids": [1, 2, 3, 4]})[0])
+
+
+class BatchWriteTest(unittest.TestCase):
+    def setUp(self):
+        self.addCleanup(setattr, main, "db", main.db)
+
+    def new_db(self, **kwargs):
+        return FakeAsyncDB({1: {"email": "s1@x"}, 2: {"email": "s2@x"}}, **kwargs)
+
+    def test_rejected(self):
+        tests = [
+            ([], None),
+            ({"create": {}}, None),
+            ({"create": [{"first_name": "a"}]}, [("create", 0, "email is required")]),
+            ({"create": [{"email": "n@x", "enrollment_year": 2011}]}, [("create", 0, "enrollment_year must be between 2016 and 2023")]),
+            ({"update": [{"email": "n@x"}]}, [("update", 0, "student_id is required")]),
+            ({"update": [{"student_id": 1, "email": None}]}, [("update", 0, "email cannot be null")]),
+            ({"delete": ["1"]}, [("delete", 0, "student_id must be an integer")]),
+            ({"update": [{"student_id": 9, "first_name": "a"}], "delete": [1, 8]},
+             [("update", 0, "not found"), ("delete", 1, "not found")]),
+            ({"create": [{"email": "s1@x"}]}, [("create", 0, "email already exists")]),
+            # Matched by the collation, not by exact comparison
+            ({"create": [{"email": "S1@X"}]}, [("create", 0, "email already exists")]),
+            ({"update": [{"student_id": 2, "email": "s1@x"}]}, [("update", 0, "email already exists")]),
+            ({"create": [{"email": "n@x"}, {"email": "N@x"}]}, [("create", 1, "email appears more than once in the batch")]),
+        ]
+        for body, errors in tests:
+            db = self.new_db()
+            code, content = run_batch(db, body)
+            self.assertEqual(400, code, body)
+            if errors is not None:
+                self.assertEqual(errors, [(e["op"], e["index"], e["detail"]) for e in content["errors"]], body)
+            self.assertIsNone(db.applied, body)
+
+    def test_applied(self):
+        tests = [
+            {"create": [{"email": "n@x", "enrollment_year": 2020}]},
+            # An email can move to a new row when its owner is deleted in the same batch
+            {"create": [{"email": "S1@x"}], "delete": [1]},
+            # A row may keep its own email
+            {"update": [{"student_id": 2, "email": "s2@x", "first_name": "b"}]},
+        ]
+        for body in tests:
+            db = self.new_db()
+            code, content = run_batch(db, body)
+            self.assertEqual(200, code, content)
+            self.assertEqual((body.get("create", []), body.get("update", []), body.get("delete", [])), db.applied)
+
+    def test_conflict_rolls_back(self):
+        error = IntegrityError(1062, "Duplicate entry 's3@x' for key 'student.email'")
+        code, content = run_batch(self.new_db(apply_error=error), {"create": [{"email": "s3@x"}]})
+        self.assertEqual(400, code)
+        self.assertIn("conflicts", content["detail"])
+
+        # A row another process deleted after validation
+        error = RowsNotFound("no student row has student_id 2")
+        code, content = run_batch(self.new_db(apply_error=error), {"update": [{"student_id": 2, "first_name": "b"}]})
+        self.assertEqual((400, "batch conflicts with existing data: no student row has student_id 2"),
+                         (code, content["detail"]))
+
+    def test_validation_reads(self):
+        db = self.new_db()
+        calls = []
+
+        def check(row):
+            calls.append(row)
+            return None
+
+        main.db = db
+        body = {"create": [{"email": "n@x"}], "update": [{"student_id": 1, "email": "m@x"}], "delete": [2]}
+        response = asyncio.run(main.batch_write_rows("student", "student_id", body, check))
+        self.assertEqual({"created": 1, "updated": 1, "deleted": 1}, response)
+        # Each row is checked once, and the emails are looked up past the result cache
+        self.assertEqual(body["create"] + body["update"], calls)
+        self.assertEqual(0, db.cached_selects)
+
+    def test_schema(self):
+        schema = TableSchema("student", [
+            Column("student_id", "int", False), Column("email", "varchar", False), Column("enrollment_year", "int"),
+        ])
+        body = {
+            "create": [{"email": "n@x", "bogus) VALUES (1); -- ": 1}],
+            "update": [{"student_id": 1, "iq": 50}],
+        }
+        db = self.new_db(schema=schema)
+        code, content = run_batch(db, body)
+        self.assertEqual(400, code)
+        self.assertEqual([
+            ("create", 0, "student has no column bogus) VALUES (1); -- "),
+            ("update", 0, "student has no column iq"),
+        ], [(e["op"], e["index"], e["detail"]) for e in content["errors"]])
+        self.assertIsNone(db.applied)
+
+
+class StreamTest(unittest.TestCase):
+    def setUp(self):
+        self.addCleanup(setattr, main, "db", main.db)
+
+    def test_encode_stream(self):
+        tests = [
+            ([], [], False, b"[]"),
+            ([{"a": 1}], [[{"a": 2}, {"a": 3}]], False, b'[{"a":1},{"a":2},{"a":3}]'),
+            ([], [], True, b""),
+            ([{"a": 1}], [[{"a": 2}]], True, b'{"a":1}\n{"a":2}\n'),
+        ]
+        async def encode(first, rest, ndjson):
+            return b"".join([chunk async for chunk in main.encode_stream(first, batches_of(*rest), ndjson)])
+
+        for first, rest, ndjson, want in tests:
+            self.assertEqual(want, asyncio.run(encode(first, rest, ndjson)))
+
+    def test_stream(self):
+        db = FakeAsyncDB({1: {"email": "s1@x"}, 2: {"email": "s2@x"}, 3: {"email": "s3@x"}})
+        rows = [{"student_id": i, "email": f"s{i}@x"} for i in (1, 2, 3)]
+
+        code, body = get_rows(db, "stream=json")
+        self.assertEqual((200, rows), (code, json.loads(body)))
+        code, body = get_rows(db, "stream=ndjson")
+        self.assertEqual((200, rows), (code, [json.loads(line) for line in body.splitlines()]))
+
+        for query in ("stream=xml", "stream=json&limit=10"):
+            code, _ = get_rows(db, query)
+            self.assertEqual(400, code, query)
+
+
+def request(headers=()):
+    return Request({
+        "type": "http", "method": "GET", "path": "/students", "query_string": b"",
+        "headers": [(k.lower().encode(), v.encode()) for k, v in headers],
+    })
+
+
+class ConditionalTest(unittest.TestCase):
+    def setUp(self):
+        self.addCleanup(setattr, main, "db", main.db)
+        self.db = main.db = FakeAsyncDB({i: {"email": f"student{i}@columbia.edu"} for i in range(100)})
+        self.client = TestClient(main.app)
+
+    # Held in one ETAG_MAX_AGE period, see test_etag_expires
+    @mock.patch("main.time.time", return_value=1000.0)
+    def test_not_modified(self, _):
+        response = self.client.get("/students")
+        tag = response.headers["ETag"]
+        self.assertEqual((200, "no-cache"), (response.status_code, response.headers["Cache-Control"]))
+        self.assertTrue(tag.startswith('W/"'))
+
+        for if_none_match, want in (
+            (tag, 304),
+            (tag.removeprefix("W/"), 304),
+            ("*", 304),
+            (f'"other", {tag}', 304),
+            ('"other"', 200),
+        ):
+            response = self.client.get("/students", headers={"If-None-Match": if_none_match})
+            self.assertEqual(want, response.status_code, if_none_match)
+            if want == 304:
+                self.assertEqual((tag, b""), (response.headers["ETag"], response.content))
+
+        # Another query of the same table has its own ETag
+        self.assertNotEqual(tag, self.client.get("/students?fields=email").headers["ETag"])
+
+        # A write changes the ETag
+        self.db.version += 1
+        self.assertEqual(200, self.client.get("/students", headers={"If-None-Match": tag}).status_code)
+
+    def test_etag_expires(self):
+        # Writes by other processes don't change the write version, so an ETag is only good for ETAG_MAX_AGE
+        now = 1000 * main.ETAG_MAX_AGE
+        with mock.patch("main.time.time", return_value=now):
+            tag = main.etag("student", request())
+        with mock.patch("main.time.time", return_value=now + main.ETAG_MAX_AGE - 0.5):
+            self.assertEqual(tag, main.etag("student", request()))
+        with mock.patch("main.time.time", return_value=now + main.ETAG_MAX_AGE):
+            self.assertNotEqual(tag, main.etag("student", request()))
+
+    def test_compression(self):
+        big = [{"student_id": i, "email": f"student{i}@columbia.edu"} for i in range(100)]
+        small = [{"student_id": 1}]
+
+        response = self.client.get("/students", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual("gzip", response.headers.get("Content-Encoding"))
+        self.assertEqual(big, response.json())
+        response = self.client.get("/students", headers={"Accept-Encoding": "identity"})
+        self.assertNotIn("Content-Encoding", response.headers)
+
+        fake_brotli = mock.Mock()
+        fake_brotli.compress.side_effect = lambda body, quality: b"br:" + body
+        with mock.patch("main.brotli", fake_brotli):
+            response = main.json_response(big, request([("Accept-Encoding", "gzip, br")]))
+            self.assertEqual(("br", "Accept-Encoding"), (response.headers["Content-Encoding"], response.headers["Vary"]))
+            self.assertEqual(b"br:" + main.dumps(big), response.body)
+            # Small responses, and clients that don't accept br, aren't brotli-compressed
+            for content, accept in ((small, "br"), (big, "gzip")):
+                response = main.json_response(content, request([("Accept-Encoding", accept)]))
+                self.assertNotIn("Content-Encoding", response.headers)
+                self.assertEqual(main.dumps(content), response.body)
+        with mock.patch("main.brotli", None):
+            response = main.json_response(big, request([("Accept-Encoding", "br")]))
+            self.assertNotIn("Content-Encoding", response.headers)
+
+    def test_dumps(self):
+        content = [{
+            "id": 1,
+            "gpa": Decimal("3.50"),
+            "credits": Decimal("120"),
+            "born": datetime.date(2001, 2, 3),
+            "at": datetime.datetime(2024, 1, 2, 3, 4, 5),
+            "time": datetime.time(9, 30),
+            "duration": datetime.timedelta(minutes=90),
+            "blob": b"abc",
+            "name": "Zoë \"Z\"",
+            "none": None,
+            "flag": True,
+            "nested": [1.25, {"a": []}],
+        }]
+        want = (
+            '[{"id":1,"gpa":3.5,"credits":120,"born":"2001-02-03","at":"2024-01-02T03:04:05","time":"09:30:00",'
+            '"duration":5400.0,"blob":"abc","name":"Zoë \\"Z\\"","none":null,"flag":true,"nested":[1.25,{"a":[]}]}]'
+        ).encode("utf-8")
+        if main.orjson is not None:
+            self.assertEqual(want, main.dumps(content))
+        # The fallback without orjson writes the same bytes
+        with mock.patch("main.orjson", None):
+            self.assertEqual(want, main.dumps(content))
+        with self.assertRaises(TypeError):
+            main.dumps({"x": object()})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,282 @@
+import bisect
+import functools
+import logging
+import re
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Type definitions
+# Key-value pairs
+KV = Dict[str, Any]
+# The values of a metric's labels, in the order of its label names
+Labels = Tuple[str, ...]
+
+logger = logging.getLogger(__name__)
+
+# Latency histogram buckets, in seconds
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Label values that exceed a metric's max_series are folded into this one, so that
+# an unbounded set of values (e.g. ad hoc SQL) can't grow the metrics without bound
+OVERFLOW_LABEL = "other"
+
+# An IN list of placeholders, and a VALUES list of more than one row
+_IN_LIST = re.compile(r"\bIN \(%s(?:, %s)*\)", re.IGNORECASE)
+_VALUES_ROWS = re.compile(r"\bVALUES (\([^()]*\))(?:, \([^()]*\))+", re.IGNORECASE)
+
+
+def escape_label(value: str) -> str:
+	return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(names: Sequence[str], values: Iterable[str]) -> str:
+	pairs = ",".join(f'{n}="{escape_label(str(v))}"' for n, v in zip(names, values))
+	return "{" + pairs + "}" if pairs else ""
+
+
+@functools.lru_cache(maxsize=1000)
+def statement_label(query: str) -> str:
+	"""Returns the statement shape of query, with IN lists and multi-row VALUES lists collapsed,
+	e.g. "... WHERE id IN (%s, %s)" -> "... WHERE id IN (...)", so their lengths don't each make a series.
+	"""
+	query = _IN_LIST.sub("IN (...)", query)
+	return _VALUES_ROWS.sub(r"VALUES \1, ...", query)
+
+
+class _Metric:
+	kind = ""
+
+	def __init__(self, name: str, help: str, label_names: Sequence[str] = (), max_series: int = 1000):
+		self.name = name
+		self.help = help
+		self.label_names = tuple(label_names)
+		self.max_series = max_series
+		self._lock = threading.Lock()
+		self._series: Dict[Labels, Any] = {}
+		if not self.label_names:
+			self._series[()] = self._new()
+
+	def _get(self, labels: Labels) -> Any:
+		# Called with the lock held
+		series = self._series.get(labels)
+		if series is None:
+			if len(self._series) >= self.max_series:
+				labels = (OVERFLOW_LABEL,) * len(self.label_names)
+				series = self._series.get(labels)
+			if series is None:
+				series = self._series[labels] = self._new()
+		return series
+
+	def _new(self) -> Any:
+		raise NotImplementedError
+
+	def render(self) -> List[str]:
+		"""Returns the metric in the Prometheus text exposition format, one line per element."""
+		with self._lock:
+			series = [(labels, self._snapshot(s)) for labels, s in self._series.items()]
+		lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+		for labels, s in series:
+			lines.extend(self._render_series(labels, s))
+		return lines
+
+	def _snapshot(self, series: Any) -> Any:
+		return series
+
+	def _render_series(self, labels: Labels, series: Any) -> List[str]:
+		raise NotImplementedError
+
+
+class Counter(_Metric):
+	kind = "counter"
+
+	def _new(self) -> List[float]:
+		return [0.0]
+
+	def inc(self, labels: Labels = (), amount: float = 1.0):
+		with self._lock:
+			self._get(labels)[0] += amount
+
+	def _snapshot(self, series: List[float]) -> float:
+		return series[0]
+
+	def _render_series(self, labels: Labels, value: float) -> List[str]:
+		return [f"{self.name}{format_labels(self.label_names, labels)} {value:g}"]
+
+
+class Histogram(_Metric):
+	kind = "histogram"
+
+	def __init__(
+		self,
+		name: str,
+		help: str,
+		label_names: Sequence[str] = (),
+		buckets: Sequence[float] = DEFAULT_BUCKETS,
+		max_series: int = 1000,
+	):
+		super().__init__(name, help, label_names, max_series)
+		self.buckets = tuple(sorted(buckets))
+
+	def _new(self) -> List[Any]:
+		# [count per bucket (the last one is +Inf), sum]
+		return [[0] * (len(self.buckets) + 1), 0.0]
+
+	def observe(self, labels: Labels, value: float):
+		i = bisect.bisect_left(self.buckets, value)
+		with self._lock:
+			series = self._get(labels)
+			series[0][i] += 1
+			series[1] += value
+
+	def _snapshot(self, series: List[Any]) -> Tuple[List[int], float]:
+		return list(series[0]), series[1]
+
+	def _render_series(self, labels: Labels, series: Tuple[List[int], float]) -> List[str]:
+		counts, total = series
+		lines = []
+		cumulative = 0
+		for bound, count in zip(self.buckets + (float("inf"),), counts):
+			cumulative += count
+			le = "+Inf" if bound == float("inf") else f"{bound:g}"
+			lines.append(
+				f"{self.name}_bucket{format_labels(self.label_names + ('le',), labels + (le,))} {cumulative}"
+			)
+		lines.append(f"{self.name}_sum{format_labels(self.label_names, labels)} {total:g}")
+		lines.append(f"{self.name}_count{format_labels(self.label_names, labels)} {cumulative}")
+		return lines
+
+
+def render_stats(prefix: str, stats: KV, counters: Iterable[str] = ()) -> List[str]:
+	"""Renders a stats dict (e.g. ConnectionPool.stats) as one gauge, or counter, per numeric value.
+
+	A counter's name ends in _total, e.g. checkouts -> <prefix>_checkouts_total and total_wait -> <prefix>_wait_total.
+	"""
+	counters = set(counters)
+	lines = []
+	for key, value in stats.items():
+		if isinstance(value, bool) or not isinstance(value, (int, float)):
+			continue
+		kind = "counter" if key in counters else "gauge"
+		name = f"{prefix}_{key.removeprefix('total_')}_total" if kind == "counter" else f"{prefix}_{key}"
+		lines.extend([f"# TYPE {name} {kind}", f"{name} {value:g}"])
+	return lines
+
+
+class QueryMetrics:
+	def __init__(
+		self,
+		slow_query_seconds: Optional[float] = 1.0,
+		explain_interval: float = 60.0,
+		max_slow_queries: int = 100,
+		buckets: Sequence[float] = DEFAULT_BUCKETS,
+		max_statements: int = 1000,
+	):
+		"""Per-statement latency, row and error metrics for DB, and a log of slow queries.
+
+		Statements are labelled by their SQL template, so there is one series per statement shape
+		rather than per set of argument values. IN lists and multi-row inserts are one shape whatever
+		their length (see statement_label).
+
+		:param slow_query_seconds: Statements that take at least this long are logged, None disables the log
+		:param explain_interval: Seconds before the same slow statement is EXPLAINed again
+		:param max_slow_queries: The number of recent slow queries kept for slow_queries
+		:param max_statements: The number of statement shapes tracked. The rest are counted under "other".
+		"""
+		self.slow_query_seconds = slow_query_seconds
+		self.explain_interval = explain_interval
+
+		labels = ("statement",)
+		self.latency = Histogram(
+			"db_query_duration_seconds", "Time spent executing statements", labels, buckets, max_statements
+		)
+		self.rows = Counter("db_query_rows_total", "Rows returned or affected", labels, max_statements)
+		self.errors = Counter("db_query_errors_total", "Statements that raised", labels, max_statements)
+		self.slow = Counter("db_slow_queries_total", "Statements slower than the slow query threshold")
+		self.unindexed = Counter(
+			"db_unindexed_filters_total", "Queries whose filters can't use an index", ("table", "filters"),
+			max_statements,
+		)
+
+		self._lock = threading.Lock()
+		self._explained: Dict[str, float] = {}
+		self._slow_queries: Deque[KV] = deque(maxlen=max_slow_queries)
+
+	def record(self, query: str, seconds: float, rows: int, error: bool = False) -> bool:
+		"""Records one execution of query.
+
+		:returns: True if the statement was slow, in which case the caller should call log_slow
+		"""
+		labels = (statement_label(query),)
+		self.latency.observe(labels, seconds)
+		if error:
+			self.errors.inc(labels)
+		else:
+			self.rows.inc(labels, rows)
+		return self.slow_query_seconds is not None and seconds >= self.slow_query_seconds
+
+	def should_explain(self, query: str) -> bool:
+		"""Returns True at most once per explain_interval for each statement shape."""
+		query = statement_label(query)
+		now = time.monotonic()
+		with self._lock:
+			last = self._explained.get(query)
+			if last is not None and now - last < self.explain_interval:
+				return False
+			if len(self._explained) >= 10000:
+				self._explained.clear()
+			self._explained[query] = now
+			return True
+
+	def log_slow(self, query: str, seconds: float, rows: int, explain: Optional[List[KV]] = None):
+		self.slow.inc()
+		entry = {"query": query, "seconds": seconds, "rows": rows, "explain": explain, "at": time.time()}
+		with self._lock:
+			self._slow_queries.append(entry)
+		logger.warning("slow query (%.3fs, %d rows): %s%s", seconds, rows, query,
+					   f"\nEXPLAIN: {explain}" if explain is not None else "")
+
+	def record_unindexed(self, table: str, keys: Sequence[str]):
+		"""Counts a query on table whose filter keys can't use an index."""
+		self.unindexed.inc((table, ",".join(sorted(keys))))
+
+	def slow_queries(self) -> List[KV]:
+		"""Returns the most recent slow queries, oldest first."""
+		with self._lock:
+			return list(self._slow_queries)
+
+	def render(self) -> List[str]:
+		return (
+			self.latency.render() + self.rows.render() + self.errors.render() + self.slow.render()
+			+ self.unindexed.render()
+		)
+
+
+class RouteMetricsMiddleware:
+	def __init__(self, app: Any, histogram: Histogram):
+		"""ASGI middleware that observes each request's duration in histogram, labelled by method, route and status.
+
+		The route is the matched path template (e.g. /students/{student_id}), so IDs don't create series.
+		A streamed response is timed until its last chunk is sent.
+		"""
+		self.app = app
+		self.histogram = histogram
+
+	async def __call__(self, scope: KV, receive: Any, send: Any):
+		if scope["type"] != "http":
+			await self.app(scope, receive, send)
+			return
+
+		start = time.perf_counter()
+		status = [500]
+
+		async def send_with_status(message: KV):
+			if message["type"] == "http.response.start":
+				status[0] = message["status"]
+			await send(message)
+
+		try:
+			await self.app(scope, receive, send_with_status)
+		finally:
+			route = getattr(scope.get("route"), "path", None) or "unmatched"
+			self.histogram.observe((scope["method"], route, str(status[0])), time.perf_counter() - start)
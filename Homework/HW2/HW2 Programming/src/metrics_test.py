@@ -0,0 +1,93 @@
+import unittest
+
+from metrics import Counter, Histogram, QueryMetrics, render_stats, statement_label
+
+
+class MetricsTest(unittest.TestCase):
+    def test_histogram(self):
+        h = Histogram("latency_seconds", "Latency", ("route",), buckets=(0.1, 1.0))
+        h.observe(("/a",), 0.05)
+        h.observe(("/a",), 0.1)
+        h.observe(("/a",), 5.0)
+        self.assertEqual([
+            "# HELP latency_seconds Latency",
+            "# TYPE latency_seconds histogram",
+            'latency_seconds_bucket{route="/a",le="0.1"} 2',
+            'latency_seconds_bucket{route="/a",le="1"} 2',
+            'latency_seconds_bucket{route="/a",le="+Inf"} 3',
+            'latency_seconds_sum{route="/a"} 5.15',
+            'latency_seconds_count{route="/a"} 3',
+        ], h.render())
+
+    def test_counter(self):
+        c = Counter("rows_total", "Rows", ("statement",), max_series=2)
+        c.inc(("a",), 2)
+        c.inc(("b\n\"",))
+        # Over max_series, new label values are counted under "other"
+        c.inc(("c",))
+        c.inc(("d",))
+        self.assertEqual([
+            'rows_total{statement="a"} 2',
+            'rows_total{statement="b\\n\\""} 1',
+            'rows_total{statement="other"} 2',
+        ], c.render()[2:])
+
+        self.assertEqual(["# HELP total Total", "# TYPE total counter", "total 0"], Counter("total", "Total").render())
+
+    def test_render_stats(self):
+        stats = {"checkouts": 3, "total_wait": 0.5, "in_use": 1, "healthy": True, "name": "pool"}
+        self.assertEqual([
+            "# TYPE pool_checkouts_total counter",
+            "pool_checkouts_total 3",
+            "# TYPE pool_wait_total counter",
+            "pool_wait_total 0.5",
+            "# TYPE pool_in_use gauge",
+            "pool_in_use 1",
+        ], render_stats("pool", stats, {"checkouts", "total_wait"}))
+
+    def test_query_metrics(self):
+        m = QueryMetrics(slow_query_seconds=1.0, explain_interval=60, max_slow_queries=2)
+        q = "SELECT * FROM t WHERE id = %s"
+        self.assertFalse(m.record(q, 0.5, 1))
+        self.assertTrue(m.record(q, 1.5, 1))
+        m.record(q, 2.0, 0, error=True)
+
+        # Each statement is EXPLAINed at most once per explain_interval
+        self.assertTrue(m.should_explain(q))
+        self.assertFalse(m.should_explain(q))
+        self.assertTrue(m.should_explain("SELECT 1"))
+
+        for i in range(3):
+            m.log_slow(q, 1.0 + i, i)
+        self.assertEqual([1, 2], [s["rows"] for s in m.slow_queries()])
+
+        lines = m.render()
+        self.assertIn('db_query_duration_seconds_count{statement="SELECT * FROM t WHERE id = %s"} 3', lines)
+        self.assertIn('db_query_rows_total{statement="SELECT * FROM t WHERE id = %s"} 2', lines)
+        self.assertIn('db_query_errors_total{statement="SELECT * FROM t WHERE id = %s"} 1', lines)
+        self.assertIn("db_slow_queries_total 3", lines)
+
+        self.assertFalse(QueryMetrics(slow_query_seconds=None).record(q, 100.0, 1))
+
+    def test_statement_label(self):
+        tests = [
+            ("SELECT * FROM t WHERE id = %s", "SELECT * FROM t WHERE id = %s"),
+            ("SELECT * FROM t WHERE id IN (%s)", "SELECT * FROM t WHERE id IN (...)"),
+            ("DELETE FROM t WHERE id IN (%s, %s, %s) AND x NOT IN (%s, %s)",
+             "DELETE FROM t WHERE id IN (...) AND x NOT IN (...)"),
+            ("INSERT INTO t (a, b) VALUES (%s, %s)", "INSERT INTO t (a, b) VALUES (%s, %s)"),
+            ("INSERT INTO t (a, b) VALUES (%s, %s), (%s, DEFAULT), (%s, %s)", "INSERT INTO t (a, b) VALUES (%s, %s), ..."),
+        ]
+        for query, want in tests:
+            self.assertEqual(want, statement_label(query), query)
+
+        m = QueryMetrics()
+        for n in range(1, 50):
+            m.record("SELECT * FROM t WHERE id IN (" + ", ".join(["%s"] * n) + ")", 0.01, n)
+        self.assertIn('db_query_rows_total{statement="SELECT * FROM t WHERE id IN (...)"} 1225', m.render())
+        self.assertTrue(m.should_explain("SELECT * FROM t WHERE id IN (%s)"))
+        self.assertFalse(m.should_explain("SELECT * FROM t WHERE id IN (%s, %s)"))
+
+
+if __name__ == '__main__':
+    unittest.main()
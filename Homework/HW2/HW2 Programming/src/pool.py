@@ -0,0 +1,252 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Deque, Dict, Iterator, List, Tuple
+
+# Type definitions
+# Key-value pairs
+KV = Dict[str, Any]
+# A factory that opens a new DB-API connection
+Connect = Callable[[], Any]
+
+
+class PoolTimeout(Exception):
+	"""Raised when no connection could be checked out before the timeout expired."""
+	pass
+
+
+class ConnectionPool:
+	def __init__(
+		self,
+		connect: Connect,
+		min_size: int = 1,
+		max_size: int = 10,
+		timeout: float = 10.0,
+		max_idle: float = 300.0,
+		max_lifetime: float = 3600.0,
+		ping: bool = True,
+	):
+		"""A bounded, thread-safe pool of connections.
+
+		:param connect: Called with no arguments to open a new connection
+		:param min_size: Connections opened up front and kept open while idle
+		:param max_size: Upper bound on open connections, borrowed or idle
+		:param timeout: Seconds acquire waits for a free connection before raising PoolTimeout
+		:param max_idle: Connections idle for longer than this (in seconds) are closed on the next borrow
+							or release, as long as more than min_size connections are open
+		:param max_lifetime: Connections older than this (in seconds) are replaced on the next borrow
+		:param ping: If True, a connection is pinged before it is handed out and replaced if it is dead
+		"""
+		if not 0 <= min_size <= max_size or max_size < 1:
+			raise ValueError("need 0 <= min_size <= max_size and max_size >= 1")
+
+		self._connect = connect
+		self.min_size = min_size
+		self.max_size = max_size
+		self.timeout = timeout
+		self.max_idle = max_idle
+		self.max_lifetime = max_lifetime
+		self.ping = ping
+
+		self._cond = threading.Condition()
+		# Idle connections as (connection, created_at, released_at), most recently released last
+		self._idle: Deque[Tuple[Any, float, float]] = deque()
+		# Creation time of every connection currently borrowed, keyed by id()
+		self._borrowed: Dict[int, float] = {}
+		self._size = 0
+		self._closed = False
+
+		self._checkouts = 0
+		self._timeouts = 0
+		self._created = 0
+		self._recycled = 0
+		self._total_wait = 0.0
+		self._max_wait = 0.0
+
+		for _ in range(min_size):
+			now = time.monotonic()
+			self._idle.append((self._open(), now, now))
+			self._size += 1
+
+	def _open(self) -> Any:
+		conn = self._connect()
+		with self._cond:
+			self._created += 1
+		return conn
+
+	@staticmethod
+	def _close(conn: Any):
+		try:
+			conn.close()
+		except Exception:
+			pass
+
+	def _alive(self, conn: Any) -> bool:
+		try:
+			conn.ping(reconnect=False)
+			return True
+		except Exception:
+			return False
+
+	def _expired(self, created_at: float, released_at: float, now: float) -> bool:
+		if now - created_at > self.max_lifetime:
+			return True
+		return now - released_at > self.max_idle and self._size > self.min_size
+
+	def _reap(self, now: float) -> List[Any]:
+		"""Removes the connections that have been idle for longer than max_idle. Call with the lock held.
+
+		Connections are borrowed from the right of _idle, so the ones left over after a burst of traffic
+		sit at the left, in the order they were released. Close the returned connections outside the lock.
+		"""
+		reaped = []
+		while self._idle and self._size > self.min_size and now - self._idle[0][2] > self.max_idle:
+			reaped.append(self._idle.popleft()[0])
+			self._size -= 1
+			self._recycled += 1
+		if reaped:
+			self._cond.notify(len(reaped))
+		return reaped
+
+	def acquire(self) -> Any:
+		"""Borrows a connection, opening one if the pool is below max_size.
+
+		:returns: A live connection. It must be given back with release.
+		"""
+		start = time.monotonic()
+		deadline = start + self.timeout
+
+		while True:
+			conn, created_at, reaped = None, None, []
+			with self._cond:
+				while True:
+					if self._closed:
+						raise PoolTimeout("pool is closed")
+
+					now = time.monotonic()
+					reaped += self._reap(now)
+					while self._idle:
+						candidate, born, released = self._idle.pop()
+						if self._expired(born, released, now):
+							# Closing can block on the network, so it waits until the lock is released
+							self._size -= 1
+							self._recycled += 1
+							reaped.append(candidate)
+							continue
+						conn, created_at = candidate, born
+						break
+
+					if conn is not None:
+						break
+					if self._size < self.max_size:
+						# Reserve the slot now, open the connection outside the lock
+						self._size += 1
+						break
+
+					remaining = deadline - now
+					if remaining <= 0:
+						self._timeouts += 1
+						raise PoolTimeout(f"no connection available after {self.timeout}s")
+					self._cond.wait(remaining)
+
+			for idle in reaped:
+				self._close(idle)
+			if conn is None:
+				try:
+					conn = self._open()
+				except Exception:
+					with self._cond:
+						self._size -= 1
+						self._cond.notify()
+					raise
+				created_at = time.monotonic()
+			elif self.ping and not self._alive(conn):
+				self._discard(conn)
+				continue
+
+			waited = time.monotonic() - start
+			with self._cond:
+				self._borrowed[id(conn)] = created_at
+				self._checkouts += 1
+				self._total_wait += waited
+				self._max_wait = max(self._max_wait, waited)
+			return conn
+
+	def _discard(self, conn: Any):
+		self._close(conn)
+		with self._cond:
+			self._size -= 1
+			self._recycled += 1
+			self._cond.notify()
+
+	def release(self, conn: Any, discard: bool = False):
+		"""Gives a borrowed connection back to the pool.
+
+		:param conn: A connection returned by acquire
+		:param discard: If True, the connection is closed instead of being reused, e.g. after a
+						connection-level error
+		"""
+		with self._cond:
+			created_at = self._borrowed.pop(id(conn))
+			now = time.monotonic()
+			reaped = self._reap(now)
+			if discard or self._closed:
+				self._size -= 1
+				self._recycled += 1
+				self._cond.notify()
+				reaped.append(conn)
+			else:
+				self._idle.append((conn, created_at, now))
+				self._cond.notify()
+		for idle in reaped:
+			self._close(idle)
+
+	@contextmanager
+	def connection(self) -> Iterator[Any]:
+		"""Borrows a connection for the duration of a with block.
+
+		If the block raises and the connection no longer answers a ping, it is discarded rather than reused.
+		"""
+		conn = self.acquire()
+		try:
+			yield conn
+		except BaseException:
+			self.release(conn, discard=not self._alive(conn))
+			raise
+		else:
+			self.release(conn)
+
+	def stats(self) -> KV:
+		"""Returns a snapshot of the pool's counters, for sizing the pool under real traffic.
+
+		:returns: A dict with the current number of in_use/idle/open connections, max_size,
+					and cumulative checkouts, timeouts, created, recycled, total_wait and max_wait
+					(in seconds)
+		"""
+		with self._cond:
+			return {
+				"in_use": len(self._borrowed),
+				"idle": len(self._idle),
+				"size": self._size,
+				"max_size": self.max_size,
+				"checkouts": self._checkouts,
+				"timeouts": self._timeouts,
+				"created": self._created,
+				"recycled": self._recycled,
+				"total_wait": self._total_wait,
+				"max_wait": self._max_wait,
+				"avg_wait": self._total_wait / self._checkouts if self._checkouts else 0.0,
+			}
+
+	def close(self):
+		"""Closes every idle connection. Borrowed connections are closed as they are released."""
+		with self._cond:
+			self._closed = True
+			idle = list(self._idle)
+			self._idle.clear()
+			self._size -= len(idle)
+			self._cond.notify_all()
+		for conn, _, _ in idle:
+			self._close(conn)
+
@@ -0,0 +1,101 @@
+import unittest
+
+from pool import ConnectionPool, PoolTimeout
+
+
+class FakeConnection:
+    def __init__(self):
+        self.alive = True
+        self.closed = False
+
+    def ping(self, reconnect=False):
+        if not self.alive:
+            raise ConnectionError("gone away")
+
+    def close(self):
+        self.closed = True
+
+
+class SlowClosingConnection(FakeConnection):
+    """Records whether the pool's lock was held when it was closed, which would stall every other thread."""
+
+    pool = None
+
+    def close(self):
+        self.closed_under_lock = self.pool._cond._is_owned()
+        super().close()
+
+
+class ConnectionPoolTest(unittest.TestCase):
+    def test_reuses_connections(self):
+        pool = ConnectionPool(FakeConnection, min_size=1, max_size=2)
+        with pool.connection() as first:
+            pass
+        with pool.connection() as second:
+            pass
+
+        self.assertIs(first, second)
+        self.assertEqual(1, pool.stats()["created"])
+        self.assertEqual(2, pool.stats()["checkouts"])
+
+    def test_times_out_when_exhausted(self):
+        pool = ConnectionPool(FakeConnection, min_size=0, max_size=1, timeout=0.01)
+        conn = pool.acquire()
+
+        with self.assertRaises(PoolTimeout):
+            pool.acquire()
+        self.assertEqual({"in_use": 1, "idle": 0, "timeouts": 1},
+                         {k: pool.stats()[k] for k in ("in_use", "idle", "timeouts")})
+
+        pool.release(conn)
+        self.assertEqual(0, pool.stats()["in_use"])
+
+    def test_replaces_dead_and_aged_connections(self):
+        pool = ConnectionPool(FakeConnection, min_size=1, max_size=1)
+        dead = pool.acquire()
+        dead.alive = False
+        pool.release(dead)
+
+        conn = pool.acquire()
+        self.assertIsNot(dead, conn)
+        self.assertTrue(dead.closed)
+        pool.release(conn)
+
+        pool.max_lifetime = 0
+        self.assertIsNot(conn, pool.acquire())
+        self.assertEqual(2, pool.stats()["recycled"])
+
+    def test_reaps_idle_connections(self):
+        pool = ConnectionPool(FakeConnection, min_size=1, max_size=5, max_idle=60)
+        burst = [pool.acquire() for _ in range(5)]
+        for conn in burst:
+            pool.release(conn)
+
+        # Steady traffic only ever borrows the most recently released connection. The rest are
+        # closed once they have been idle for max_idle, down to min_size.
+        pool.max_idle = 0
+        for _ in range(3):
+            with pool.connection():
+                pass
+        self.assertEqual({"size": 1, "idle": 1, "recycled": 4},
+                         {k: pool.stats()[k] for k in ("size", "idle", "recycled")})
+        self.assertEqual(4, sum(conn.closed for conn in burst))
+
+    def test_closes_outside_the_lock(self):
+        pool = ConnectionPool(SlowClosingConnection, min_size=0, max_size=3, max_idle=60)
+        SlowClosingConnection.pool = pool
+        self.addCleanup(setattr, SlowClosingConnection, "pool", None)
+        conns = [pool.acquire() for _ in range(3)]
+        for conn in conns:
+            pool.release(conn)
+
+        # All three have outlived max_lifetime, so acquire drops them and opens a new one
+        pool.max_lifetime = 0
+        pool.release(pool.acquire())
+        self.assertEqual([True] * 3, [conn.closed for conn in conns])
+        self.assertEqual([False] * 3, [conn.closed_under_lock for conn in conns])
+        self.assertEqual(3, pool.stats()["recycled"])
+
+
+if __name__ == '__main__':
+    unittest.main()
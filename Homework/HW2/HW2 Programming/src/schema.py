@@ -0,0 +1,177 @@
+import datetime
+import re
+from decimal import Decimal, InvalidOperation
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Type definitions
+# Key-value pairs
+KV = Dict[str, Any]
+
+# Every column of every table in the current database, in column order
+COLUMNS_QUERY = """
+	SELECT TABLE_NAME AS table_name, COLUMN_NAME AS column_name, DATA_TYPE AS data_type,
+		COLUMN_TYPE AS column_type, IS_NULLABLE AS is_nullable
+	FROM information_schema.COLUMNS
+	WHERE TABLE_SCHEMA = DATABASE()
+	ORDER BY TABLE_NAME, ORDINAL_POSITION
+"""
+# Every index of every table in the current database, with its columns in index order
+INDEXES_QUERY = """
+	SELECT TABLE_NAME AS table_name, INDEX_NAME AS index_name, NON_UNIQUE AS non_unique,
+		COLUMN_NAME AS column_name
+	FROM information_schema.STATISTICS
+	WHERE TABLE_SCHEMA = DATABASE()
+	ORDER BY TABLE_NAME, INDEX_NAME, SEQ_IN_INDEX
+"""
+
+INTEGER_TYPES = {"tinyint", "smallint", "mediumint", "int", "integer", "bigint", "year"}
+FLOAT_TYPES = {"float", "double", "real"}
+DECIMAL_TYPES = {"decimal", "numeric"}
+DATETIME_TYPES = {"datetime", "timestamp"}
+
+_ENUM_VALUE = re.compile(r"'((?:[^']|'')*)'")
+
+
+class SchemaError(ValueError):
+	"""An unknown table column, or a value that can't be converted to its column's type."""
+
+
+def to_int(value: Any) -> int:
+	if isinstance(value, bool):
+		raise TypeError(value)
+	if isinstance(value, float) and not value.is_integer():
+		raise ValueError(value)
+	return int(value) if isinstance(value, (int, float)) else int(str(value).strip())
+
+
+def to_date(value: Any) -> datetime.date:
+	return value if isinstance(value, datetime.date) else datetime.date.fromisoformat(str(value))
+
+
+def to_datetime(value: Any) -> datetime.datetime:
+	return value if isinstance(value, datetime.datetime) else datetime.datetime.fromisoformat(str(value))
+
+
+# Converters by DATA_TYPE, with what the error message says a value must be. Other types keep their values.
+CONVERTERS: Dict[str, Tuple[Callable[[Any], Any], str]] = {
+	**{t: (to_int, "an integer") for t in INTEGER_TYPES},
+	**{t: (float, "a number") for t in FLOAT_TYPES},
+	**{t: (lambda v: Decimal(str(v)), "a number") for t in DECIMAL_TYPES},
+	**{t: (to_datetime, "an ISO 8601 date and time") for t in DATETIME_TYPES},
+	"date": (to_date, "an ISO 8601 date"),
+	"char": (str, "a string"),
+	"varchar": (str, "a string"),
+	"text": (str, "a string"),
+}
+
+
+class Column:
+	def __init__(self, name: str, data_type: str, nullable: bool = True, enum_values: Sequence[str] = ()):
+		"""A table column and the converter for its values, chosen once from its type.
+
+		:param data_type: information_schema's DATA_TYPE, e.g. int or varchar
+		:param enum_values: The values of an ENUM column
+		"""
+		self.name = name
+		self.data_type = data_type.lower()
+		self.nullable = nullable
+		self.enum_values = tuple(enum_values)
+
+		if self.enum_values:
+			# ENUM comparisons ignore case under the default collations
+			canonical = {v.lower(): v for v in self.enum_values}
+			self._convert = lambda v: canonical[str(v).lower()]
+			self._expected = "one of " + ", ".join(self.enum_values)
+		else:
+			self._convert, self._expected = CONVERTERS.get(self.data_type, (None, ""))
+
+	def convert(self, value: Any) -> Any:
+		"""Returns value as this column's Python type, e.g. "2018" as 2018 for an int column.
+
+		:raises SchemaError: If value can't be converted, or is None for a NOT NULL column
+		"""
+		if value is None:
+			if not self.nullable:
+				raise SchemaError(f"{self.name} cannot be null")
+			return None
+		if self._convert is None:
+			return value
+		try:
+			return self._convert(value)
+		except (ArithmeticError, KeyError, TypeError, ValueError, InvalidOperation):
+			raise SchemaError(f"{self.name} must be {self._expected}") from None
+
+
+class TableSchema:
+	def __init__(
+		self,
+		name: str,
+		columns: Iterable[Column],
+		indexes: Optional[Dict[str, Tuple[Tuple[str, ...], bool]]] = None,
+	):
+		"""A table's columns and indexes.
+
+		:param indexes: Index name -> (the indexed columns in order, whether the index is unique). The
+						primary key is named PRIMARY.
+		"""
+		self.name = name
+		self.columns: Dict[str, Column] = {c.name: c for c in columns}
+		self.indexes = dict(indexes or {})
+		self.primary_key: Tuple[str, ...] = self.indexes.get("PRIMARY", ((), True))[0]
+		self.unique = [cols for cols, unique in self.indexes.values() if unique]
+		# An index can only narrow a lookup on its first column (without its other columns filtered too)
+		self.leading_columns = {cols[0] for cols, _ in self.indexes.values() if cols}
+
+	def column(self, name: str) -> Column:
+		column = self.columns.get(name)
+		if column is None:
+			raise SchemaError(f"{self.name} has no column {name}")
+		return column
+
+	def check_columns(self, names: Iterable[str]):
+		"""Raises SchemaError if any of names isn't a column."""
+		for name in names:
+			if name not in self.columns:
+				raise SchemaError(f"{self.name} has no column {name}")
+
+	def convert_row(self, values: KV) -> KV:
+		"""Returns values with each value converted to its column's type. See Column.convert."""
+		return {k: self.column(k).convert(v) for k, v in values.items()}
+
+	def is_indexed(self, column: str) -> bool:
+		"""Returns True if an index starts with column."""
+		return column in self.leading_columns
+
+
+def enum_values(column_type: str) -> List[str]:
+	"""Returns the values of an ENUM's COLUMN_TYPE, e.g. enum('a','b') -> ["a", "b"]."""
+	return [v.replace("''", "'") for v in _ENUM_VALUE.findall(column_type)]
+
+
+def build_schemas(column_rows: Iterable[KV], index_rows: Iterable[KV]) -> Dict[str, TableSchema]:
+	"""Builds each table's schema from the rows of COLUMNS_QUERY and INDEXES_QUERY."""
+	columns: Dict[str, List[Column]] = {}
+	for row in column_rows:
+		data_type = row["data_type"].lower()
+		values = enum_values(row["column_type"]) if data_type == "enum" else ()
+		columns.setdefault(row["table_name"], []).append(
+			Column(row["column_name"], data_type, row["is_nullable"] == "YES", values)
+		)
+
+	indexes: Dict[str, Dict[str, Tuple[Tuple[str, ...], bool]]] = {}
+	for row in index_rows:
+		table = indexes.setdefault(row["table_name"], {})
+		cols, _ = table.get(row["index_name"], ((), False))
+		table[row["index_name"]] = (cols + (row["column_name"],), not int(row["non_unique"]))
+
+	schemas = {}
+	for table, cols in columns.items():
+		table_indexes = {}
+		for name, (idx_cols, unique) in indexes.get(table, {}).items():
+			# A functional index part has no column. Only the columns before it are usable for lookups.
+			if None in idx_cols:
+				idx_cols = idx_cols[:idx_cols.index(None)]
+			if idx_cols:
+				table_indexes[name] = (idx_cols, unique)
+		schemas[table] = TableSchema(table, cols, table_indexes)
+	return schemas
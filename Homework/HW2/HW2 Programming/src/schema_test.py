@@ -0,0 +1,87 @@
+import datetime
+import unittest
+from decimal import Decimal
+
+from schema import Column, SchemaError, build_schemas, enum_values
+
+
+def column_row(table, name, data_type, column_type=None, nullable=True):
+    return {
+        "table_name": table, "column_name": name, "data_type": data_type,
+        "column_type": column_type or data_type, "is_nullable": "YES" if nullable else "NO",
+    }
+
+
+def index_row(table, name, column, unique=False):
+    return {"table_name": table, "index_name": name, "non_unique": 0 if unique else 1, "column_name": column}
+
+
+class SchemaTest(unittest.TestCase):
+    def test_column_convert(self):
+        tests = [
+            (Column("a", "int"), "2018", 2018),
+            (Column("a", "int"), 7.0, 7),
+            (Column("a", "decimal"), "1.50", Decimal("1.50")),
+            (Column("a", "double"), "0.5", 0.5),
+            (Column("a", "date"), "2024-02-01", datetime.date(2024, 2, 1)),
+            (Column("a", "datetime"), "2024-02-01T10:00:00", datetime.datetime(2024, 2, 1, 10)),
+            (Column("a", "varchar"), 12, "12"),
+            (Column("a", "enum", enum_values=["Professor", "Staff"]), "staff", "Staff"),
+            (Column("a", "json"), {"k": 1}, {"k": 1}),
+            (Column("a", "int"), None, None),
+        ]
+        for column, value, want in tests:
+            self.assertEqual(want, column.convert(value))
+
+        for column, value in [
+            (Column("a", "int"), "abc"),
+            (Column("a", "int"), 1.5),
+            (Column("a", "int"), True),
+            (Column("a", "date"), "yesterday"),
+            (Column("a", "decimal"), "x"),
+            (Column("a", "enum", enum_values=["Professor", "Staff"]), "Janitor"),
+            (Column("a", "varchar", nullable=False), None),
+        ]:
+            with self.assertRaises(SchemaError):
+                column.convert(value)
+
+    def test_enum_values(self):
+        self.assertEqual(["a", "it's", "b,c"], enum_values("enum('a','it''s','b,c')"))
+
+    def test_build_schemas(self):
+        columns = [
+            column_row("student", "student_id", "int", nullable=False),
+            column_row("student", "email", "varchar", "varchar(255)", nullable=False),
+            column_row("student", "last_name", "varchar"),
+            column_row("student", "enrollment_year", "int"),
+            column_row("employee", "employee_type", "enum", "enum('Professor','Lecturer','Staff')"),
+        ]
+        indexes = [
+            index_row("student", "PRIMARY", "student_id", unique=True),
+            index_row("student", "email", "email", unique=True),
+            index_row("student", "name_year", "last_name"),
+            index_row("student", "name_year", "enrollment_year"),
+            index_row("student", "lower_email", None),
+        ]
+        schemas = build_schemas(columns, indexes)
+
+        student = schemas["student"]
+        self.assertEqual(["student_id", "email", "last_name", "enrollment_year"], list(student.columns))
+        self.assertEqual(("student_id",), student.primary_key)
+        self.assertEqual([("student_id",), ("email",)], student.unique)
+        self.assertEqual(("last_name", "enrollment_year"), student.indexes["name_year"][0])
+        self.assertNotIn("lower_email", student.indexes)
+        self.assertTrue(student.is_indexed("last_name"))
+        self.assertFalse(student.is_indexed("enrollment_year"))
+        self.assertFalse(student.columns["email"].nullable)
+
+        self.assertEqual(("Professor", "Lecturer", "Staff"), schemas["employee"].columns["employee_type"].enum_values)
+        self.assertEqual({}, schemas["employee"].indexes)
+
+        with self.assertRaises(SchemaError):
+            student.check_columns(["email", "iq"])
+        self.assertEqual({"enrollment_year": 2019}, student.convert_row({"enrollment_year": "2019"}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,189 @@
+import argparse
+import json
+import os
+import re
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Iterator, List
+
+from examples.Neo4j.simple_examples import close_driver, get_driver, query
+from examples.process_got.jsonstream import iter_json_array
+
+#
+# Loads the derived GoT files (see examples/process_got) into Neo4j:
+# characters_basic.json becomes (:Character) nodes and character_relationships.json
+# becomes one relationship type per relationship name, e.g. (:Character)-[:parentOf]->(:Character).
+# Rows are sent in batches with UNWIND, so each batch is one round trip and one transaction.
+#
+# Run it from the repository root: python -m examples.Neo4j.graph_loader <in_dir>
+
+characters_file = "characters_basic.json"
+relationships_file = "character_relationships.json"
+
+constraints = [
+    "CREATE CONSTRAINT character_name IF NOT EXISTS FOR (c:Character) REQUIRE c.characterName IS UNIQUE",
+]
+
+merge_characters = query("""
+    UNWIND $rows AS row
+    MERGE (c:Character {characterName: row.characterName})
+    SET c += row
+""")
+
+# Relationship types can't be parameters, so they are checked against this before being put into a query.
+relationship_type = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+
+# Every character a relationship names is merged before the relationships are written, since a
+# character can be related to one that has no record of its own.
+merge_character_names = query("""
+    UNWIND $rows AS name
+    MERGE (:Character {characterName: name})
+""")
+
+
+def merge_relationships(rel_type: str) -> str:
+    if not relationship_type.match(rel_type):
+        raise ValueError("not a valid relationship type: %r" % rel_type)
+    # The endpoints exist by now, so they are only matched: no node is created, or locked for creating it.
+    return query("""
+        UNWIND $rows AS row
+        MATCH (s:Character {characterName: row.sourceCharacter})
+        MATCH (t:Character {characterName: row.targetCharacter})
+        MERGE (s)-[:`%s`]->(t)
+    """ % rel_type)
+
+
+def read_records(file_name: str) -> Iterator[dict]:
+    """
+    Yields the records of a JSON array file, or of one record per line if the name ends in .ndjson,
+    one at a time without loading the whole file.
+    """
+    if not file_name.endswith(".ndjson"):
+        yield from iter_json_array(file_name)
+        return
+    with open(file_name, "r") as in_file:
+        for line in in_file:
+            if line.strip():
+                yield json.loads(line)
+
+
+def batches(rows: Iterable[dict], batch_size: int) -> Iterator[List[dict]]:
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def create_constraints():
+    for c in constraints:
+        get_driver().execute_query(query(c))
+
+
+def write_batches(q: str, rows: Iterable[dict], batch_size: int) -> dict:
+    """
+    Runs q once per batch of rows, each in its own write transaction, on one session.
+    The driver retries a transaction that fails with a transient error such as a deadlock.
+    Returns the rows written and the nodes and relationships created.
+    """
+
+    result = {"rows": 0, "nodes_created": 0, "relationships_created": 0}
+
+    def run(tx, batch):
+        return tx.run(q, rows=batch).consume().counters
+
+    with get_driver().session() as session:
+        for batch in batches(rows, batch_size):
+            counters = session.execute_write(run, batch)
+            result["rows"] += len(batch)
+            result["nodes_created"] += counters.nodes_created
+            result["relationships_created"] += counters.relationships_created
+    return result
+
+
+def load_characters(file_name: str, batch_size: int = 10000) -> dict:
+    # Null properties can't be stored, so they are dropped instead of being SET.
+    rows = ({k: v for k, v in c.items() if v is not None} for c in read_records(file_name))
+    return write_batches(merge_characters, rows, batch_size)
+
+
+def load_relationships(file_name: str, batch_size: int = 10000, workers: int = 4) -> dict:
+    """
+    Loads the relationships in two streaming passes over the file. The first merges every character
+    named in it, one batch at a time. The second groups the rows into a batch per relationship type
+    and writes each full batch on one of workers threads, with at most 2 * workers batches in flight.
+
+    Creating a relationship locks both of its endpoint nodes, so concurrent batches that share a
+    character wait for each other whatever their types, and two batches that lock the same characters
+    in different orders deadlock. The driver retries the transaction that Neo4j aborts (see
+    write_batches), which repeats its whole batch, so with many shared characters fewer workers or
+    smaller batches can be faster.
+    """
+
+    names = set()
+    for r in read_records(file_name):
+        names.add(r["sourceCharacter"])
+        names.add(r["targetCharacter"])
+    nodes = write_batches(merge_character_names, sorted(names), batch_size)
+
+    statements, pending, results = {}, deque(), []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        def submit(rel_type, rows):
+            if rel_type not in statements:
+                statements[rel_type] = merge_relationships(rel_type)
+            pending.append(executor.submit(write_batches, statements[rel_type], rows, batch_size))
+            while len(pending) > 2 * workers:
+                results.append(pending.popleft().result())
+
+        by_type = {}
+        for r in read_records(file_name):
+            rows = by_type.setdefault(r["relationship"], [])
+            rows.append({"sourceCharacter": r["sourceCharacter"], "targetCharacter": r["targetCharacter"]})
+            if len(rows) >= batch_size:
+                submit(r["relationship"], rows)
+                by_type[r["relationship"]] = []
+        for rel_type, rows in by_type.items():
+            if rows:
+                submit(rel_type, rows)
+        results.extend(f.result() for f in pending)
+
+    result = {k: sum(r[k] for r in results) for k in ("rows", "nodes_created", "relationships_created")}
+    result["nodes_created"] += nodes["nodes_created"]
+    return result
+
+
+def report(name: str, result: dict, seconds: float):
+    print("%s: %d rows in %.2fs (%.0f rows/s), %d nodes and %d relationships created" % (
+        name, result["rows"], seconds, result["rows"] / max(seconds, 1e-9),
+        result["nodes_created"], result["relationships_created"]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Loads the derived GoT characters and relationships into Neo4j.")
+    parser.add_argument("in_dir", help="directory holding the files written by process_got.py")
+    parser.add_argument("--batch-size", type=int, default=10000, help="rows per UNWIND transaction")
+    parser.add_argument("--workers", type=int, default=4,
+                        help="relationship types written in parallel")
+    args = parser.parse_args(argv)
+
+    try:
+        create_constraints()
+
+        start = time.perf_counter()
+        result = load_characters(os.path.join(args.in_dir, characters_file), args.batch_size)
+        report("characters", result, time.perf_counter() - start)
+
+        start = time.perf_counter()
+        result = load_relationships(os.path.join(args.in_dir, relationships_file), args.batch_size, args.workers)
+        report("relationships", result, time.perf_counter() - start)
+    finally:
+        close_driver()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+import json
+import os
+import tempfile
+import threading
+import unittest
+
+try:
+    from examples.Neo4j import graph_loader, simple_examples
+except ImportError:
+    graph_loader = simple_examples = None
+
+
+class FakeCounters:
+    def __init__(self, nodes_created, relationships_created):
+        self.nodes_created = nodes_created
+        self.relationships_created = relationships_created
+
+
+class FakeResult:
+    def __init__(self, counters):
+        self.counters = counters
+
+    def consume(self):
+        return self
+
+
+class FakeTransaction:
+    def __init__(self, driver):
+        self.driver = driver
+
+    def run(self, q, rows):
+        with self.driver.lock:
+            self.driver.writes.append((q, rows))
+        # Merging names creates a node per name, any other query a relationship per row
+        if "AS name" in q:
+            return FakeResult(FakeCounters(len(rows), 0))
+        return FakeResult(FakeCounters(0, len(rows)))
+
+
+class FakeSession:
+    def __init__(self, driver):
+        self.driver = driver
+
+    def execute_write(self, fn, *args):
+        return fn(FakeTransaction(self.driver), *args)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+class FakeDriver:
+    """Records the rows of every write transaction."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.writes = []
+        self.closed = False
+
+    def session(self, **config):
+        return FakeSession(self)
+
+    def execute_query(self, q, **kwargs):
+        return [], None, None
+
+    def close(self):
+        self.closed = True
+
+
+@unittest.skipIf(graph_loader is None, "needs the neo4j driver")
+class GraphLoaderTest(unittest.TestCase):
+    def use_driver(self):
+        driver = FakeDriver()
+        self.addCleanup(setattr, simple_examples, "_driver", simple_examples._driver)
+        simple_examples._driver = driver
+        return driver
+
+    def write_file(self, name, records):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        with open(os.path.join(tmp.name, name), "w") as out_file:
+            json.dump(records, out_file, indent=2)
+        return tmp.name
+
+    def test_batches(self):
+        tests = [
+            (range(0), 2, []),
+            (range(4), 2, [[0, 1], [2, 3]]),
+            (range(5), 2, [[0, 1], [2, 3], [4]]),
+            (range(3), 10, [[0, 1, 2]]),
+        ]
+        for items, batch_size, want in tests:
+            self.assertEqual(want, list(graph_loader.batches(iter(items), batch_size)), (items, batch_size))
+
+    def test_merge_relationships(self):
+        self.assertIn("MERGE (s)-[:`parentOf`]->(t)", graph_loader.merge_relationships("parentOf"))
+        # The type is put into the Cypher text, so anything but a plain name is rejected
+        for rel_type in ("", "1st", "parent Of", "x`]->(t) DETACH DELETE s //", "a-b"):
+            with self.assertRaises(ValueError, msg=rel_type):
+                graph_loader.merge_relationships(rel_type)
+
+    def test_load_relationships(self):
+        relationships = [
+            {"sourceCharacter": "s%d" % (i % 3), "relationship": ("parentOf", "killed")[i % 2], "targetCharacter": "t%d" % i}
+            for i in range(7)
+        ]
+        in_dir = self.write_file(graph_loader.relationships_file, relationships)
+        driver = self.use_driver()
+
+        result = graph_loader.load_relationships(
+            os.path.join(in_dir, graph_loader.relationships_file), batch_size=2, workers=2
+        )
+        self.assertEqual({"rows": 7, "nodes_created": 10, "relationships_created": 7}, result)
+
+        # Every character is merged before any relationship is written
+        names = [(q, rows) for q, rows in driver.writes if "AS name" in q]
+        self.assertEqual(names, driver.writes[:len(names)])
+        self.assertEqual(sorted({"s0", "s1", "s2"} | {"t%d" % i for i in range(7)}), [n for _, rows in names for n in rows])
+
+        # Each batch holds rows of one type, in file order
+        by_type = {}
+        for q, rows in driver.writes[len(names):]:
+            self.assertLessEqual(len(rows), 2)
+            rel_type = "parentOf" if "`parentOf`" in q else "killed"
+            by_type.setdefault(rel_type, []).extend(r["targetCharacter"] for r in rows)
+        self.assertEqual({"parentOf": ["t0", "t2", "t4", "t6"], "killed": ["t1", "t3", "t5"]}, by_type)
+
+    def test_main_closes_driver(self):
+        in_dir = self.write_file(graph_loader.characters_file, [{"characterName": "Hodor", "royal": None}])
+        driver = self.use_driver()
+        # There is no relationships file, so loading fails after the characters
+        with self.assertRaises(FileNotFoundError):
+            graph_loader.main([in_dir])
+        self.assertTrue(driver.closed)
+        self.assertEqual([[{"characterName": "Hodor"}]], [rows for _, rows in driver.writes])
+
+
+if __name__ == '__main__':
+    unittest.main()
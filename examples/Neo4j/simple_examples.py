@@ -1,17 +1,53 @@
-
 import logging
-import os
-from json import dumps
+import time
 from textwrap import dedent
-from typing import cast
+from typing import Any, Dict, Iterator, List, Optional, cast
 
 import neo4j
 
 from neo4j import GraphDatabase, basic_auth
 from typing_extensions import LiteralString
 
-driver = GraphDatabase.driver("bolt://localhost:7687",
-                              auth=basic_auth("dbuser", "dbuserdbuser"))
+logger = logging.getLogger(__name__)
+
+uri = "bolt://localhost:7687"
+auth = basic_auth("dbuser", "dbuserdbuser")
+
+# Connection pool settings for the driver. See the neo4j.GraphDatabase.driver documentation.
+driver_config = {
+    "max_connection_pool_size": 50,
+    "connection_acquisition_timeout": 30.0,
+    "max_connection_lifetime": 3600,
+    "keep_alive": True,
+}
+
+# Records fetched from the server per round trip when streaming a result.
+default_fetch_size = 1000
+
+_driver = None
+
+
+def get_driver() -> neo4j.Driver:
+    """Returns the shared driver, creating it on first use instead of at import time."""
+    global _driver
+    if _driver is None:
+        _driver = GraphDatabase.driver(uri, auth=auth, **driver_config)
+    return _driver
+
+
+def close_driver():
+    global _driver
+    if _driver is not None:
+        _driver.close()
+        _driver = None
+
+
+def __getattr__(name):
+    # Keeps simple_examples.driver working, while still creating the driver lazily.
+    if name == "driver":
+        return get_driver()
+    raise AttributeError(name)
+
 
 #
 # Copied from GitHub example.
@@ -22,18 +58,106 @@ def query(q: LiteralString) -> LiteralString:
     return cast(LiteralString, dedent(q).strip())
 
 
+def stream(q: LiteralString, fetch_size: int = default_fetch_size, database: Optional[str] = None,
+           timings: Optional[Dict[str, Any]] = None, **params) -> Iterator[neo4j.Record]:
+    """
+    Yields the records of q as they arrive, instead of materializing them like driver.execute_query.
+    The session fetches fetch_size records per round trip, so client memory holds about one batch.
+
+    Once the records are consumed, the server's timings are logged and, if timings is given,
+    stored in it: available_after and consumed_after (ms, from the server) and elapsed (s, client side).
+    """
+
+    start = time.perf_counter()
+    with get_driver().session(database=database, fetch_size=fetch_size) as session:
+        result = session.run(q, params)
+        count = 0
+        for record in result:
+            count += 1
+            yield record
+        summary = result.consume()
+
+    t = {
+        "records": count,
+        "available_after": summary.result_available_after,
+        "consumed_after": summary.result_consumed_after,
+        "elapsed": time.perf_counter() - start,
+    }
+    logger.info("query returned %(records)d records: available after %(available_after)s ms, "
+                "consumed after %(consumed_after)s ms, %(elapsed).3f s elapsed", t)
+    if timings is not None:
+        timings.update(t)
+
+
+def paginate(q: LiteralString, page_size: int = 1000, **params) -> Iterator[List[neo4j.Record]]:
+    """
+    Yields the pages of q, which must end in SKIP $skip LIMIT $limit (and should ORDER BY something
+    stable). Each page is a separate query. Use paginate_keyset for deep traversals, since the server
+    still walks the skipped records.
+    """
+
+    skip = 0
+    while True:
+        page = list(stream(q, fetch_size=page_size, skip=skip, limit=page_size, **params))
+        if page:
+            yield page
+        if len(page) < page_size:
+            return
+        skip += page_size
+
+
+def paginate_keyset(q: LiteralString, key: str, page_size: int = 1000, after: Any = None,
+                    **params) -> Iterator[List[neo4j.Record]]:
+    """
+    Yields the pages of q, which must return only records whose key is greater than $after (all records
+    when $after is null), ordered by key and limited to $limit, e.g.
+
+        MATCH (c:Character) WHERE $after IS NULL OR c.characterName > $after
+        RETURN c.characterName AS name ORDER BY name LIMIT $limit
+
+    Every page starts where the previous one ended, so with an index on key each page costs the same.
+    """
+
+    while True:
+        page = list(stream(q, fetch_size=page_size, after=after, limit=page_size, **params))
+        if page:
+            yield page
+        if len(page) < page_size:
+            return
+        after = page[-1][key]
+
+
 def t1():
-    records, _, _ = driver.execute_query(
+    timings = {}
+    records = stream(
         query("""
             MATCH (m:Movie)<-[:ACTED_IN]-(a:Person)
             RETURN m.title AS movie, collect(a.name) AS cast
             LIMIT $limit
         """),
+        timings=timings,
         limit=10
     )
 
-    print("Records = ", records)
+    for r in records:
+        print("Record = ", r)
+    print("Timings = ", timings)
+
+
+def t2():
+    pages = paginate_keyset(
+        query("""
+            MATCH (p:Person) WHERE $after IS NULL OR p.name > $after
+            RETURN p.name AS name ORDER BY name LIMIT $limit
+        """),
+        key="name",
+        page_size=50
+    )
+
+    for i, page in enumerate(pages):
+        print("Page", i, "=", [r["name"] for r in page])
 
 
 if __name__ == "__main__":
-    t1()
\ No newline at end of file
+    t1()
+    close_driver()
@@ -0,0 +1,107 @@
+import unittest
+
+try:
+    from examples.Neo4j import simple_examples
+except ImportError:
+    simple_examples = None
+
+
+class FakeSummary:
+    result_available_after = 1
+    result_consumed_after = 2
+
+
+class FakeResult:
+    def __init__(self, records):
+        self.records = records
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def consume(self):
+        return FakeSummary()
+
+
+class FakeSession:
+    def __init__(self, driver, **config):
+        self.driver = driver
+        self.config = config
+
+    def run(self, q, params):
+        self.driver.queries.append((q, dict(params), self.config))
+        names = ["p%03d" % i for i in range(self.driver.total)]
+        if "skip" in params:
+            names = names[params["skip"]:]
+        elif params.get("after") is not None:
+            names = [n for n in names if n > params["after"]]
+        return FakeResult([{"name": n} for n in names[:params.get("limit")]])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.driver.closed += 1
+
+
+class FakeDriver:
+    """Returns the characters p000, p001, ... honoring $skip, $after and $limit, and records the queries."""
+
+    def __init__(self, total):
+        self.total = total
+        self.queries = []
+        self.closed = 0
+
+    def session(self, **config):
+        return FakeSession(self, **config)
+
+
+@unittest.skipIf(simple_examples is None, "needs the neo4j driver")
+class SimpleExamplesTest(unittest.TestCase):
+    def use_driver(self, total):
+        driver = FakeDriver(total)
+        self.addCleanup(setattr, simple_examples, "_driver", simple_examples._driver)
+        simple_examples._driver = driver
+        return driver
+
+    def test_stream(self):
+        driver = self.use_driver(3)
+        timings = {}
+        records = simple_examples.stream("MATCH (c) RETURN c", fetch_size=2, database="got", timings=timings, x=1)
+
+        # Nothing runs until the records are consumed
+        self.assertEqual([], driver.queries)
+        self.assertEqual(["p000", "p001", "p002"], [r["name"] for r in records])
+        self.assertEqual([("MATCH (c) RETURN c", {"x": 1}, {"database": "got", "fetch_size": 2})], driver.queries)
+        self.assertEqual(1, driver.closed)
+        self.assertEqual((3, 1, 2), (timings["records"], timings["available_after"], timings["consumed_after"]))
+
+    def test_paginate(self):
+        tests = [
+            # (records, pages, skip of every query)
+            (120, [50, 50, 20], [0, 50, 100]),
+            (100, [50, 50], [0, 50, 100]),
+            (0, [], [0]),
+        ]
+        for total, pages, skips in tests:
+            driver = self.use_driver(total)
+            got = list(simple_examples.paginate("MATCH (c) RETURN c SKIP $skip LIMIT $limit", page_size=50))
+            self.assertEqual(pages, [len(p) for p in got], total)
+            self.assertEqual(["p%03d" % i for i in range(total)], [r["name"] for p in got for r in p])
+            self.assertEqual(skips, [params["skip"] for _, params, _ in driver.queries])
+            self.assertTrue(all(params["limit"] == 50 for _, params, _ in driver.queries))
+
+    def test_paginate_keyset(self):
+        tests = [
+            (120, None, [50, 50, 20], [None, "p049", "p099"]),
+            (100, None, [50, 50], [None, "p049", "p099"]),
+            (120, "p099", [20], ["p099"]),
+        ]
+        for total, after, pages, afters in tests:
+            driver = self.use_driver(total)
+            got = list(simple_examples.paginate_keyset("MATCH (c) RETURN c", "name", page_size=50, after=after))
+            self.assertEqual(pages, [len(p) for p in got], (total, after))
+            self.assertEqual(afters, [params["after"] for _, params, _ in driver.queries])
+
+
+if __name__ == '__main__':
+    unittest.main()
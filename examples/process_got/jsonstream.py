@@ -0,0 +1,102 @@
+import json
+import re
+
+#
+# Streams the elements of a JSON array from a file one at a time. Shared by process_got, which
+# reads the GoT exports with it, and the loaders of its outputs (Homework/HW2 load_got.py and
+# examples/Neo4j/graph_loader.py). It only needs the standard library, so the loaders don't
+# pull in process_got's numpy and pandas.
+
+_whitespace = re.compile(r"[ \t\n\r]*")
+# What is left at the end of a chunk that cut a number short after its integer or fraction part
+_number_tail = re.compile(r"[.eE][+-]?[0-9]*")
+
+
+class _JsonReader:
+    """
+    Reads JSON values one at a time from a file, keeping only the unread part of the current
+    chunk in memory.
+    """
+
+    def __init__(self, in_file, read_size):
+        self.in_file = in_file
+        self.read_size = read_size
+        self.decoder = json.JSONDecoder()
+        self.buf = ""
+        self.pos = 0
+
+    def fill(self):
+        # Read at least as much as is buffered, so that a value spanning many chunks
+        # is re-decoded only O(log n) times.
+        chunk = self.in_file.read(max(self.read_size, len(self.buf) - self.pos))
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return bool(chunk)
+
+    def peek(self):
+        """Skips whitespace and returns the next character, or "" at the end of the file."""
+        while True:
+            self.pos = _whitespace.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                return ""
+
+    def expect(self, c):
+        if self.peek() != c:
+            raise ValueError("expected %r at %r" % (c, self.buf[self.pos:self.pos + 20]))
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if not self.fill():
+                    raise
+                continue
+            # A number at the end of the buffer may continue in the next chunk, also when the chunk
+            # ends in its fraction or exponent (raw_decode stops before a bare "." or "e").
+            partial = end == len(self.buf) or (
+                isinstance(value, (int, float)) and _number_tail.fullmatch(self.buf, end) is not None)
+            if partial and self.fill():
+                continue
+            self.pos = end
+            return value
+
+
+def iter_json_array(file_name, top_element=None, read_size=1 << 16):
+    """
+    Yields the elements of a JSON array one at a time, reading the file incrementally, so memory
+    holds one element instead of the whole document. The array is either the whole document or
+    the value of top_element in the top-level object.
+    """
+
+    with open(file_name, "r") as in_file:
+        reader = _JsonReader(in_file, read_size)
+
+        if reader.peek() == "{" and top_element:
+            reader.pos += 1
+            while True:
+                if reader.peek() == "}":
+                    raise KeyError(top_element)
+                key = reader.value()
+                reader.expect(":")
+                if key == top_element and reader.peek() == "[":
+                    break
+                reader.value()
+                if reader.peek() == ",":
+                    reader.pos += 1
+
+        reader.expect("[")
+        if reader.peek() == "]":
+            return
+        while True:
+            yield reader.value()
+            c = reader.peek()
+            reader.pos += 1
+            if c == "]":
+                return
+            if c != ",":
+                raise ValueError("expected ',' or ']' in array, got %r" % c)
@@ -0,0 +1,60 @@
+import io
+import json
+import os
+import tempfile
+import unittest
+
+from examples.process_got import jsonstream
+
+
+class JsonReaderTest(unittest.TestCase):
+    def test_iter_json_array(self):
+        records = [{"a": 1, "b": "x, ] \\\" é"}, -12.5e3, [], {}, None, True, "tail", 1234567890]
+        tests = [
+            (json.dumps(records), None),
+            (json.dumps(records, indent=2), None),
+            (json.dumps({"episodes": records}, indent=2), "episodes"),
+            # The array is found after other keys, whatever their values
+            (json.dumps({"n": 10, "skip": {"episodes": [1]}, "list": [1, 2], "episodes": records}), "episodes"),
+        ]
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "in.json")
+            for text, top_element in tests:
+                with open(path, "w") as out_file:
+                    out_file.write(text)
+                # Small reads split every token, including numbers, across chunks
+                for read_size in (1, 2, 3, 7, 1 << 16):
+                    self.assertEqual(
+                        records, list(jsonstream.iter_json_array(path, top_element, read_size)), (text, read_size)
+                    )
+
+            for text, top_element, error in (
+                (" [ ] ", None, None),
+                ('{"episodes": []}', "episodes", None),
+                ('{"characters": [1]}', "episodes", KeyError),
+                ("[1 2]", None, ValueError),
+                ("[1, 2", None, ValueError),
+                ('{"episodes": 1}', "episodes", KeyError),
+            ):
+                with open(path, "w") as out_file:
+                    out_file.write(text)
+                if error is None:
+                    self.assertEqual([], list(jsonstream.iter_json_array(path, top_element, read_size=2)))
+                else:
+                    with self.assertRaises(error, msg=text):
+                        list(jsonstream.iter_json_array(path, top_element, read_size=2))
+
+    def test_json_reader(self):
+        reader = jsonstream._JsonReader(io.StringIO(' 12345 ,\n "ab" : [1, {"c": null}]'), read_size=2)
+        self.assertEqual(12345, reader.value())
+        reader.expect(",")
+        self.assertEqual("ab", reader.value())
+        reader.expect(":")
+        self.assertEqual([1, {"c": None}], reader.value())
+        self.assertEqual("", reader.peek())
+        with self.assertRaises(ValueError):
+            reader.expect("]")
+
+
+if __name__ == '__main__':
+    unittest.main()
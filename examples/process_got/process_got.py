@@ -1,13 +1,30 @@
+import argparse
+import hashlib
+import importlib.util
 import json
+import os
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import islice
+
+import numpy as np
 import pandas as pd
 
+try:
+    from .jsonstream import iter_json_array
+except ImportError:
+    # Run as a script, or imported from this directory (e.g. by the notebook)
+    from jsonstream import iter_json_array
+
 
 character_relationships = [
  'abducted',
  'abductedBy',
  'allies',
  'guardedBy',
- 'guardianOf'
+ 'guardianOf',
  'killed',
  'killedBy',
  'marriedEngaged',
@@ -19,6 +36,10 @@ character_relationships = [
  'siblings',
  ]
 
+episode_basic_keys = ['seasonNum', 'episodeNum', 'episodeTitle', 'episodeLink',
+                      'episodeAirDate', 'episodeDescription'
+                      ]
+
 character_properties = [
     'characterName',
 'actorLink',
@@ -33,133 +54,681 @@ character_properties = [
 ]
 
 
+episodes_file = "/Users/donaldferguson/Dropbox/000/000-Data/GoT/episodes.json"
+characters_file = "/Users/donaldferguson/Dropbox/000/000-Data/GoT/characters.json"
+
+# The outputs derived from the episodes, and the file each one is written to.
+episode_outputs = {
+    "basics": "episodes_basics.json",
+    "locations": "episodes_locations.json",
+    "scenes": "episodes_scenes.json",
+    "characters": "episodes_characters.json",
+    "killedBy": "episodes_scenes_characters_killedBy.json",
+}
+
+# The outputs derived from the characters.
+character_outputs = {
+    "characters_basic": "characters_basic.json",
+    "relationships": "character_relationships.json",
+}
+
+
 def get_json_from_file(file_name, top_element_remove=None):
 
     with open(file_name, "r") as in_file:
         result = json.load(in_file)
 
-        if top_element_remove:
+        # Some exports are the bare array, without the top element.
+        if top_element_remove and isinstance(result, dict):
             result = result[top_element_remove]
 
     return result
 
 
-def get_episodes():
-    fn = "/Users/donaldferguson/Dropbox/000/000-Data/GoT/episodes.json"
+def get_episodes(file_name=None, stream=False):
+    fn = file_name or episodes_file
+    if stream:
+        return iter_json_array(fn, "episodes")
     result = get_json_from_file(fn, "episodes")
     return result
 
 
-def get_episodes_basics(episodes):
+def flatten_episode(e, result):
+    """
+    Walks one episode, its scenes and their characters once, appending the derived records
+    to every list in result. result maps output names (see episode_outputs) to lists; outputs
+    that are not in result are skipped.
+    """
+
+    season_num, episode_num = e["seasonNum"], e["episodeNum"]
+
+    basics = result.get("basics")
+    if basics is not None:
+        basics.append({k: e[k] for k in episode_basic_keys})
+
+    locations = result.get("locations")
+    if locations is not None:
+        for l in e.get('openingSequenceLocations', None) or []:
+            locations.append({
+                "seasonNum": season_num,
+                "episodeNum": episode_num,
+                "openingSequenceLocation": l
+            })
+
+    scenes = result.get("scenes")
+    characters = result.get("characters")
+    killed_by = result.get("killedBy")
+    if scenes is None and characters is None and killed_by is None:
+        return
+
+    for i, t in enumerate(e.get('scenes', None) or []):
+        if scenes is not None:
+            scenes.append({
+                "seasonNum": season_num,
+                "episodeNum": episode_num,
+                "sceneNum": i,
+                "sceneStart": t["sceneStart"],
+                "sceneEnd": t["sceneEnd"],
+                "sceneLocation": t.get("location", None),
+                "sceneSubLocation": t.get("subLocation", None)
+            })
+
+        if characters is None and killed_by is None:
+            continue
+
+        for c in t.get('characters', None) or []:
+            if characters is not None:
+                characters.append({
+                    "seasonNum": season_num,
+                    "episodeNum": episode_num,
+                    "sceneNum": i,
+                    "characterName": c["name"]
+                })
+            if killed_by is not None:
+                for k in c.get('killedBy', None) or []:
+                    killed_by.append({
+                        "seasonNum": season_num,
+                        "episodeNum": episode_num,
+                        "sceneNum": i,
+                        "characterName": c["name"],
+                        "killedBy": k
+                    })
 
-    basic_keys = ['seasonNum', 'episodeNum', 'episodeTitle', 'episodeLink',
-                  'episodeAirDate', 'episodeDescription'
-                  ]
-    result = []
 
-    for e in episodes:
-        new_e = {k:e[k] for k in basic_keys}
-        result.append(new_e)
+def flatten_episodes(episodes, outputs):
+    """
+    Derives every requested output in one pass over the episodes.
+    Returns a dict mapping each output name to its list of records.
+    """
 
+    result = {o: [] for o in outputs}
+    for e in episodes:
+        flatten_episode(e, result)
     return result
 
-def get_episodes_basics_location(episodes):
 
-    result = []
+def iter_flattened(episodes, output):
+    """
+    Yields the records of one output (see episode_outputs) episode by episode, so only one
+    episode's records are held at a time.
+    """
 
     for e in episodes:
-        locations = e.get('openingSequenceLocations', None)
-
-        if locations:
-            for l in locations:
-                new_l = {
-                    "seasonNum": e["seasonNum"],
-                    "episodeNum": e["episodeNum"],
-                    "openingSequenceLocation": l
-                }
-                result.append(new_l)
+        result = {output: []}
+        flatten_episode(e, result)
+        yield from result[output]
 
-    return result
 
-def get_episodes_basics_scenes(episodes):
+def iter_episodes_basics(episodes):
+    return iter_flattened(episodes, "basics")
 
-    result = []
 
-    for e in episodes:
-        scenes = e.get('scenes', None)
-
-        if scenes:
-            for i in range(0, len(scenes)):
-                t = scenes[i]
-                new_s = {
-                    "seasonNum": e["seasonNum"],
-                    "episodeNum": e["episodeNum"],
-                    "sceneNum": i,
-                    "sceneStart": t["sceneStart"],
-                    "sceneEnd": t["sceneEnd"],
-                    "sceneLocation": t.get("location", None),
-                    "sceneSubLocation": t.get("subLocation", None)
+def iter_episodes_basics_location(episodes):
+    return iter_flattened(episodes, "locations")
 
-                }
-                result.append(new_s)
 
-    return result
+def iter_episodes_basics_scenes(episodes):
+    return iter_flattened(episodes, "scenes")
 
 
-def get_episodes_basics_scenes_characters(episodes):
+def iter_episodes_basics_scenes_characters(episodes):
+    return iter_flattened(episodes, "characters")
 
-    result = []
 
-    for e in episodes:
-        scenes = e.get('scenes', None)
+def iter_episodes_scenes_characters_killed_by(episodes):
+    return iter_flattened(episodes, "killedBy")
 
-        if scenes:
-            for i in range(0, len(scenes)):
-                t = scenes[i]
-                characters = t.get('characters', None)
 
-                for c in characters:
-                    new_c = {
-                        "seasonNum": e["seasonNum"],
-                        "episodeNum": e["episodeNum"],
-                        "sceneNum": i,
-                        "characterName": c["name"]
-                    }
-                    result.append(new_c)
+def get_episodes_basics(episodes):
+    return flatten_episodes(episodes, ["basics"])["basics"]
 
-    return result
+def get_episodes_basics_location(episodes):
+    return flatten_episodes(episodes, ["locations"])["locations"]
 
+def get_episodes_basics_scenes(episodes):
+    return flatten_episodes(episodes, ["scenes"])["scenes"]
+
+
+def get_episodes_basics_scenes_characters(episodes):
+    return flatten_episodes(episodes, ["characters"])["characters"]
+
+
+def get_episodes_scenes_characters_killed_by(episodes):
+    return flatten_episodes(episodes, ["killedBy"])["killedBy"]
+
+
+def encode_record(record, fmt="json", compact=False):
+    """Returns the text RecordWriter writes for one record, without the separator before it."""
+
+    if fmt == "ndjson":
+        if compact:
+            return json.dumps(record, separators=(",", ":")) + "\n"
+        return json.dumps(record) + "\n"
+    if compact:
+        return json.dumps(record, separators=(",", ":"))
+    # json.dumps escapes newlines inside strings, so every newline here is indentation.
+    return json.dumps(record, indent=2).replace("\n", "\n  ")
+
+
+class RecordWriter:
+    """
+    Writes records to a file as they are produced, instead of building the whole list first.
+
+    fmt is "json" (one array) or "ndjson" (one record per line). compact drops the indentation
+    and the spaces after separators. With fmt "json" and compact False the file is byte-for-byte
+    what json.dump(records, out_file, indent=2) writes.
+
+    write_encoded takes the text of a record from encode_record instead, so the encoding can be
+    done elsewhere, e.g. in a worker process. It also takes a block of n records joined with
+    separator, such as a span copied from an earlier run of the file. The file is written as
+    UTF-8 in binary mode, without newline translation, so position is a byte offset that can be
+    seeked to on any platform, even if the text isn't ASCII.
+    """
+
+    def __init__(self, file_name, fmt="json", compact=False):
+        if fmt not in ("json", "ndjson"):
+            raise ValueError("unknown format %r" % fmt)
+        self.out_file = open(file_name, "wb")
+        self.fmt = fmt
+        self.compact = compact
+        self.count = 0
+        self.position = 0
+
+    @property
+    def separator(self):
+        """The text between two encoded records."""
+        if self.fmt == "ndjson":
+            return ""
+        return "," if self.compact else ",\n  "
+
+    def write(self, record):
+        self.write_encoded(encode_record(record, self.fmt, self.compact))
+
+    def write_encoded(self, text, n=1):
+        """Writes the text of n records and returns the byte position it starts at."""
+        if self.fmt == "ndjson":
+            prefix = ""
+        elif self.count:
+            prefix = self.separator
+        else:
+            prefix = "[" if self.compact else "[\n  "
+        self._write(prefix)
+        start = self.position
+        self._write(text)
+        self.count += n
+        return start
+
+    def _write(self, text):
+        data = text.encode("utf-8")
+        self.out_file.write(data)
+        self.position += len(data)
+
+    def write_all(self, records):
+        for r in records:
+            self.write(r)
+
+    def close(self):
+        if self.fmt == "json":
+            if not self.count:
+                self._write("[]")
+            else:
+                self._write("]" if self.compact else "\n]")
+        self.out_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ColumnarWriter:
+    """
+    Writes records as a columnar table instead of repeating every key in every record.
+
+    Every column is dictionary-encoded while records arrive, so memory holds one integer code per
+    cell plus the distinct values. On close, columns of non-null integers or booleans are decoded
+    into typed arrays (integers in the smallest dtype that fits). Other columns stay dictionary-encoded:
+    int32 codes, -1 for null, plus the distinct values, which are JSON-encoded unless they are all strings.
+    The distinct values are stored as one UTF-8 buffer and an array of offsets into it.
+
+    fmt "npy" writes a directory with one .npy file per array and a _schema.json, which load_columnar
+    memory-maps. fmt "parquet" writes one Parquet file with categorical columns; it needs pyarrow.
+    """
+
+    def __init__(self, file_name, fmt="npy"):
+        if fmt not in ("npy", "parquet"):
+            raise ValueError("unknown format %r" % fmt)
+        if fmt == "parquet":
+            import pyarrow  # noqa: F401 -- fail before doing any work
+        self.file_name = file_name
+        self.fmt = fmt
+        self.count = 0
+        # column name -> (value key -> code, distinct values, codes)
+        self.columns = {}
+
+    @staticmethod
+    def _key(value):
+        if isinstance(value, str):
+            return value
+        return ("json", json.dumps(value, sort_keys=True))
+
+    def write(self, record):
+        for name, value in record.items():
+            column = self.columns.get(name)
+            if column is None:
+                # A column first seen now is null in every earlier record.
+                column = self.columns[name] = ({}, [], array("q", [-1] * self.count))
+        for name, (lookup, values, codes) in self.columns.items():
+            value = record.get(name, None)
+            if value is None:
+                codes.append(-1)
+                continue
+            key = self._key(value)
+            code = lookup.get(key)
+            if code is None:
+                code = lookup[key] = len(values)
+                values.append(value)
+            codes.append(code)
+        self.count += 1
+
+    def write_all(self, records):
+        for r in records:
+            self.write(r)
+
+    def _encode(self, values, codes):
+        """Returns (kind, arrays) for one column."""
+        # array "q" is 64 bits on every platform, unlike "l" and np.int_ (32 bits on Windows).
+        codes = np.frombuffer(codes, dtype=np.int64) if len(codes) else np.zeros(0, dtype=np.int64)
+        has_nulls = bool((codes < 0).any())
+
+        if values and not has_nulls:
+            if all(isinstance(v, bool) for v in values):
+                return "bool", {"": np.array(values, dtype=bool)[codes]}
+            if all(isinstance(v, int) and not isinstance(v, bool) for v in values):
+                decoded = np.array(values, dtype=np.int64)[codes]
+                dtype = np.result_type(np.min_scalar_type(decoded.min()), np.min_scalar_type(decoded.max()))
+                return "int", {"": decoded.astype(dtype)}
+
+        kind = "str" if all(isinstance(v, str) for v in values) else "json"
+        encoded = [(v if kind == "str" else json.dumps(v)).encode("utf-8") for v in values]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(e) for e in encoded])
+        return kind, {
+            ".codes": codes.astype(np.int32),
+            ".categories": np.frombuffer(b"".join(encoded), dtype=np.uint8),
+            ".offsets": offsets,
+        }
+
+    def close(self):
+        schema = {"rows": self.count, "columns": []}
+        encoded = {}
+        for name, (_, values, codes) in self.columns.items():
+            kind, arrays = self._encode(values, codes)
+            schema["columns"].append({"name": name, "kind": kind})
+            encoded[name] = arrays
+
+        if self.fmt == "parquet":
+            _columnar_frame(schema, encoded).to_parquet(self.file_name, index=False)
+            return
+
+        os.makedirs(self.file_name, exist_ok=True)
+        for name, arrays in encoded.items():
+            for suffix, a in arrays.items():
+                np.save(os.path.join(self.file_name, name + suffix + ".npy"), a)
+        with open(os.path.join(self.file_name, "_schema.json"), "w") as out_file:
+            json.dump(schema, out_file, indent=2)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _columnar_frame(schema, arrays):
+    data = {}
+    for column in schema["columns"]:
+        name, kind = column["name"], column["kind"]
+        if kind in ("int", "bool"):
+            data[name] = arrays[name][""]
+            continue
+        blob, offsets = arrays[name][".categories"].tobytes(), arrays[name][".offsets"]
+        categories = [blob[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(len(offsets) - 1)]
+        codes = arrays[name][".codes"]
+        if kind == "json":
+            categories = [json.loads(c) for c in categories]
+            if any(isinstance(c, (list, dict)) for c in categories):
+                # Lists and objects can't be categories. Decode them, with the null code -1 picking the None at the end.
+                values = np.empty(len(categories) + 1, dtype=object)
+                for i, c in enumerate(categories):
+                    values[i] = c
+                data[name] = values[codes]
+                continue
+        data[name] = pd.Categorical.from_codes(codes, categories=pd.Index(categories, dtype=object))
+    return pd.DataFrame(data, columns=[c["name"] for c in schema["columns"]])
+
+
+def load_columnar(file_name, mmap=True):
+    """
+    Loads a table written by ColumnarWriter into a pandas DataFrame. For the npy format the
+    arrays are memory-mapped rather than read, unless mmap is False.
+    """
+
+    if file_name.endswith(".parquet"):
+        return pd.read_parquet(file_name, memory_map=mmap)
+
+    with open(os.path.join(file_name, "_schema.json"), "r") as in_file:
+        schema = json.load(in_file)
+    mmap_mode = "r" if mmap else None
+    arrays = {}
+    for column in schema["columns"]:
+        name = column["name"]
+        suffixes = [""] if column["kind"] in ("int", "bool") else [".codes", ".categories", ".offsets"]
+        arrays[name] = {
+            suffix: np.load(os.path.join(file_name, name + suffix + ".npy"), mmap_mode=mmap_mode)
+            for suffix in suffixes
+        }
+    return _columnar_frame(schema, arrays)
+
+
+# Formats written by RecordWriter and by ColumnarWriter, and the file name suffix of each.
+record_formats = {"json": ".json", "ndjson": ".ndjson"}
+columnar_formats = {"npy": ".columns", "parquet": ".parquet"}
+
+
+def output_file_name(file_name, fmt="json"):
+    suffix = record_formats.get(fmt) or columnar_formats[fmt]
+    return os.path.splitext(file_name)[0] + suffix
+
+
+def open_writers(outputs, file_names, out_dir=".", fmt="json", compact=False):
+    writers = {}
+    for o in outputs:
+        path = os.path.join(out_dir, output_file_name(file_names[o], fmt))
+        if fmt in columnar_formats:
+            writers[o] = ColumnarWriter(path, fmt)
+        else:
+            writers[o] = RecordWriter(path, fmt, compact)
+    return writers
+
+
+def close_writers(writers):
+    for w in writers.values():
+        w.close()
+
+
+def iter_chunks(items, chunk_size):
+    """Yields lists of up to chunk_size consecutive items."""
+
+    items = iter(items)
+    while True:
+        chunk = list(islice(items, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _derive_chunk(derive, outputs, fmt, compact, indexed, chunk):
+    """
+    Runs in a worker process. Derives the outputs of one chunk of input records and, for the
+    record formats, encodes them too, so the parent only concatenates text. The indexed outputs
+    are returned as records as well, for an index builder.
+    """
+
+    result = derive(chunk, outputs + [o for o in indexed if o not in outputs])
+    records = {o: result[o] for o in indexed}
+    if fmt in record_formats:
+        return {o: [encode_record(r, fmt, compact) for r in result[o]] for o in outputs}, records
+    return result, records
+
+
+def parallel_derive(derive, items, outputs, workers, chunk_size=256, fmt="json", compact=False, indexed=()):
+    """
+    Shards items into chunks, derives each chunk in one of workers processes, and yields the
+    results chunk by chunk in input order, so the output is the same as a serial run.
+    At most 2 * workers chunks are in flight, so a streamed input stays streamed.
+    Each result is a pair: the outputs (encoded, for the record formats), and the records of
+    the indexed outputs.
+    """
+
+    work = partial(_derive_chunk, derive, list(outputs), fmt, compact, list(indexed))
+    with ProcessPoolExecutor(workers) as executor:
+        pending = deque()
+        for chunk in iter_chunks(items, chunk_size):
+            pending.append(executor.submit(work, chunk))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def write_outputs(derive, items, outputs, writers, fmt="json", compact=False, workers=1, chunk_size=256,
+                  index=None):
+    """
+    Derives outputs from items and writes them. derive(items, outputs) returns a dict mapping each
+    output name to its list of records. With one worker every item is derived and written in turn,
+    otherwise see parallel_derive. If index is given (see EpisodeIndexBuilder), the outputs it
+    reads are derived too and added to it as they go by, so the indexes take no pass of their own.
+    """
+
+    indexed = index.outputs if index is not None else []
+    if workers <= 1:
+        derived = outputs + [o for o in indexed if o not in outputs]
+        for item in items:
+            result = derive([item], derived)
+            for o in outputs:
+                writers[o].write_all(result[o])
+            if index is not None:
+                index.add(result)
+        return
+
+    for result, records in parallel_derive(derive, items, outputs, workers, chunk_size, fmt, compact, indexed):
+        for o in outputs:
+            if fmt in record_formats:
+                for text in result[o]:
+                    writers[o].write_encoded(text)
+            else:
+                writers[o].write_all(result[o])
+        if index is not None:
+            index.add(records)
+
+
+manifest_file = "_manifest.json"
+
+
+def record_hash(record):
+    """A fingerprint of an input record's content, independent of key order and formatting."""
+    text = json.dumps(record, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def load_manifest(out_dir):
+    try:
+        with open(os.path.join(out_dir, manifest_file), "r") as in_file:
+            return json.load(in_file)
+    except FileNotFoundError:
+        return {}
+
+
+def file_fingerprint(path):
+    """The size and SHA-1 of a file, or None if it doesn't exist."""
+    digest = hashlib.sha1()
+    size = 0
+    try:
+        with open(path, "rb") as in_file:
+            for block in iter(partial(in_file.read, 1 << 20), b""):
+                digest.update(block)
+                size += len(block)
+    except FileNotFoundError:
+        return None
+    return [size, digest.hexdigest()]
+
+
+def save_manifest(out_dir, manifest):
+    path = os.path.join(out_dir, manifest_file)
+    with open(path + ".tmp", "w") as out_file:
+        json.dump(manifest, out_file)
+    os.replace(path + ".tmp", path)
+
+
+def write_outputs_incremental(group, derive, load, outputs, file_names, out_dir=".", fmt="json", compact=False,
+                              index=None):
+    """
+    Writes outputs like write_outputs, but only derives the input records that changed since the
+    last incremental run into out_dir.
+
+    The manifest records, for every input record of group ("episodes" or "characters"), the hash
+    of its content and the byte span of every output file that was derived from it. A record whose hash
+    is in the manifest has its spans copied from the previous files instead of being derived again;
+    since a record's outputs depend only on its own content, this holds even if records moved.
+    If every hash matches, in order, the files are left alone. The manifest also records each
+    output file's size and hash; if a file was changed since, e.g. rewritten by a run that wasn't
+    incremental, its spans can't be trusted and every record is derived again. load() returns a fresh iterable
+    over the input records; it is called twice, once to hash them and once to write. If index is
+    given, every record is added to it in the first pass, whether or not it is derived again.
+
+    Only the record formats can be patched this way.
+
+    :returns: A dict with the number of records reused, derived and removed, and whether the
+              files were rewritten
+    """
+
+    if fmt not in record_formats:
+        raise ValueError("incremental mode needs one of the record formats: %s" % ", ".join(record_formats))
+
+    manifest = load_manifest(out_dir)
+    previous = manifest.get(group) or {}
+    paths = {o: os.path.join(out_dir, output_file_name(file_names[o], fmt)) for o in outputs}
+    files = previous.get("files") or {}
+    if (previous.get("fmt"), previous.get("compact"), sorted(previous.get("outputs", []))) != (fmt, compact, sorted(outputs)) \
+            or any(files.get(o) != file_fingerprint(p) for o, p in paths.items()):
+        previous = {"records": []}
+
+    hashes = []
+    for r in load():
+        hashes.append(record_hash(r))
+        if index is not None:
+            index.add(derive([r], index.outputs))
+    if previous["records"] and hashes == [entry["hash"] for entry in previous["records"]]:
+        return {"reused": len(hashes), "derived": 0, "removed": 0, "rewritten": False}
+
+    old = {}
+    for entry in previous["records"]:
+        old.setdefault(entry["hash"], deque()).append(entry["spans"])
+
+    old_files = {o: open(p, "rb") for o, p in paths.items() if previous["records"]}
+    writers = {o: RecordWriter(p + ".tmp", fmt, compact) for o, p in paths.items()}
+    records = []
+    stats = {"reused": 0, "derived": 0, "removed": 0, "rewritten": True}
+    try:
+        for h, item in zip(hashes, load()):
+            candidates = old.get(h)
+            if candidates:
+                spans = candidates.popleft()
+                blocks = {}
+                for o in outputs:
+                    start, length, n = spans[o]
+                    old_files[o].seek(start)
+                    blocks[o] = (old_files[o].read(length).decode("utf-8"), n)
+                stats["reused"] += 1
+            else:
+                result = derive([item], outputs)
+                blocks = {
+                    o: (writers[o].separator.join(encode_record(r, fmt, compact) for r in result[o]), len(result[o]))
+                    for o in outputs
+                }
+                stats["derived"] += 1
+
+            spans = {}
+            for o, (text, n) in blocks.items():
+                start = writers[o].write_encoded(text, n) if n else writers[o].position
+                spans[o] = [start, writers[o].position - start, n]
+            records.append({"hash": h, "spans": spans})
+    finally:
+        for f in old_files.values():
+            f.close()
+        close_writers(writers)
+
+    for o, p in paths.items():
+        os.replace(p + ".tmp", p)
+    stats["removed"] = sum(len(c) for c in old.values())
+    manifest[group] = {
+        "fmt": fmt,
+        "compact": compact,
+        "outputs": outputs,
+        "files": {o: file_fingerprint(p) for o, p in paths.items()},
+        "records": records,
+    }
+    save_manifest(out_dir, manifest)
+    return stats
+
+
+def process_episode_outputs(outputs=None, file_name=None, out_dir=".", stream=False, fmt="json", compact=False,
+                            workers=1, chunk_size=256, incremental=False, index=None):
+    """
+    Parses the episodes once and writes every requested output (default: all of episode_outputs).
+    Records are written episode by episode. With stream, the episodes are parsed one at a time
+    too, so memory stays bounded by the largest episode. With more than one worker, chunks of
+    chunk_size episodes are flattened in parallel (see write_outputs). With incremental, only the
+    episodes that changed since the last incremental run are flattened (see write_outputs_incremental),
+    and the counts are returned. index, an EpisodeIndexBuilder, is filled in the same pass.
+    """
+
+    outputs = list(outputs or episode_outputs)
+    if incremental:
+        episodes = None if stream else get_episodes(file_name)
+        load = (lambda: get_episodes(file_name, stream=True)) if stream else (lambda: episodes)
+        return write_outputs_incremental("episodes", flatten_episodes, load, outputs, episode_outputs,
+                                         out_dir, fmt, compact, index)
+
+    episodes = get_episodes(file_name, stream)
+    writers = open_writers(outputs, episode_outputs, out_dir, fmt, compact)
+    try:
+        write_outputs(flatten_episodes, episodes, outputs, writers, fmt, compact, workers, chunk_size, index)
+    finally:
+        close_writers(writers)
 
 
 def process_episodes():
-    episodes = get_episodes()
-    episodes_basics = get_episodes_basics(episodes)
-    with open("episodes_basics.json", "w") as out_file:
-        json.dump(episodes_basics, out_file, indent=2)
+    process_episode_outputs(["basics"])
 
 def process_locations():
-    episodes = get_episodes()
-    episodes_locations = get_episodes_basics_location(episodes)
-    with open("episodes_locations.json", "w") as out_file:
-        json.dump(episodes_locations, out_file, indent=2)
+    process_episode_outputs(["locations"])
 
 
 def process_scenes():
-    episodes = get_episodes()
-    scenes = get_episodes_basics_scenes(episodes)
-    with open("episodes_scenes.json", "w") as out_file:
-        json.dump(scenes, out_file, indent=2)
+    process_episode_outputs(["scenes"])
 
 
 def process_episodes_characters():
-    episodes = get_episodes()
-    characters = get_episodes_basics_scenes_characters(episodes)
-    with open("episodes_characters.json", "w") as out_file:
-        json.dump(characters, out_file, indent=2)
+    process_episode_outputs(["characters"])
 
 
-def get_characters():
-    fn = "/Users/donaldferguson/Dropbox/000/000-Data/GoT/characters.json"
+def get_characters(file_name=None, stream=False):
+    fn = file_name or characters_file
+    if stream:
+        return iter_json_array(fn, "characters")
     result = get_json_from_file(fn, "characters")
     return result
 
@@ -176,10 +745,7 @@ def get_characters_basics(characters):
     return result
 
 def process_characters_core():
-    the_characters = get_characters()
-    the_characters = get_characters_basics(the_characters)
-    with open("characters_basic.json", "w") as out_file:
-        json.dump(the_characters, out_file, indent=2)
+    process_character_outputs(["characters_basic"])
 
 
 def get_character_relationship(c):
@@ -202,23 +768,245 @@ def get_character_relationship(c):
     return result
 
 
-def process_characters_relationships():
-    the_characters = get_characters()
+def get_characters_relationships(characters):
+
     result = []
 
-    for c in the_characters:
+    for c in characters:
         tmp = get_character_relationship(c)
         result.extend(tmp)
 
-    with open("character_relationships.json", "w") as out_file:
-        json.dump(result, out_file, indent=2)
+    return result
+
+
+def process_characters_relationships():
+    process_character_outputs(["relationships"])
+
+
+def derive_characters(characters, outputs):
+    """Returns a dict mapping each requested output (see character_outputs) to its list of records."""
+
+    derive = {
+        "characters_basic": get_characters_basics,
+        "relationships": get_characters_relationships,
+    }
+    return {o: derive[o](characters) for o in outputs}
+
+
+def process_character_outputs(outputs=None, file_name=None, out_dir=".", stream=False, fmt="json", compact=False,
+                              workers=1, chunk_size=256, incremental=False, index=None):
+    """
+    Parses the characters once and writes every requested output (default: all of character_outputs),
+    character by character. index is a CharacterIndexBuilder. See process_episode_outputs.
+    """
+
+    outputs = list(outputs or character_outputs)
+    if incremental:
+        the_characters = None if stream else get_characters(file_name)
+        load = (lambda: get_characters(file_name, stream=True)) if stream else (lambda: the_characters)
+        return write_outputs_incremental("characters", derive_characters, load, outputs, character_outputs,
+                                         out_dir, fmt, compact, index)
+
+    the_characters = get_characters(file_name, stream)
+    writers = open_writers(outputs, character_outputs, out_dir, fmt, compact)
+    try:
+        write_outputs(derive_characters, the_characters, outputs, writers, fmt, compact, workers, chunk_size, index)
+    finally:
+        close_writers(writers)
+
+
+# The lookup indexes, and the file each one is persisted to.
+index_files = {
+    "character_scenes": "index_character_scenes.json",
+    "episode_scenes": "index_episode_scenes.json",
+    "season_kills": "index_season_kills.json",
+    "relationships": "index_relationships.json",
+}
+
+
+def episode_key(season_num, episode_num):
+    return "%s:%s" % (season_num, episode_num)
+
+
+class EpisodeIndexBuilder:
+    """
+    Builds the episode indexes from the flattened records, as write_outputs derives them:
+
+    character_scenes: characterName -> [[seasonNum, episodeNum, sceneNum], ...] in scene order
+    episode_scenes: "seasonNum:episodeNum" -> [start, end), the rows of episodes_scenes.json for the episode
+    season_kills: seasonNum -> [{"characterName", "killedBy", "episodeNum", "sceneNum"}, ...]
+
+    An episode without scenes has no episode_scenes entry, which scene_rows reads as an empty range.
+    """
+
+    outputs = ["scenes", "characters", "killedBy"]
+
+    def __init__(self):
+        self.character_scenes, self.episode_scenes, self.season_kills = {}, {}, {}
+        self.row = 0
+        self._last_key = None
+
+    def add(self, result):
+        """Adds the records of the next episodes, a dict with a list of records for each of outputs."""
+        for s in result["scenes"]:
+            key = episode_key(s["seasonNum"], s["episodeNum"])
+            if key != self._last_key:
+                self.episode_scenes[key] = [self.row, self.row]
+                self._last_key = key
+            self.row += 1
+            self.episode_scenes[key][1] = self.row
+        for c in result["characters"]:
+            self.character_scenes.setdefault(c["characterName"], []).append(
+                [c["seasonNum"], c["episodeNum"], c["sceneNum"]])
+        for k in result["killedBy"]:
+            self.season_kills.setdefault(str(k["seasonNum"]), []).append(
+                {key: k[key] for key in ("characterName", "killedBy", "episodeNum", "sceneNum")})
+
+    def indexes(self):
+        return {"character_scenes": self.character_scenes, "episode_scenes": self.episode_scenes,
+                "season_kills": self.season_kills}
+
+
+class CharacterIndexBuilder:
+    """
+    Builds relationships: relationship -> sourceCharacter -> [targetCharacter, ...], the adjacency
+    list of every relationship type in character_relationships. See EpisodeIndexBuilder.
+    """
+
+    outputs = ["relationships"]
+
+    def __init__(self):
+        self.relationships = {}
+
+    def add(self, result):
+        for r in result["relationships"]:
+            self.relationships.setdefault(r["relationship"], {}).setdefault(r["sourceCharacter"], []).append(
+                r["targetCharacter"])
+
+    def indexes(self):
+        return {"relationships": self.relationships}
+
+
+def build_episode_indexes(episodes):
+    """Builds the episode indexes (see EpisodeIndexBuilder) in one pass over the episodes."""
+
+    builder = EpisodeIndexBuilder()
+    for e in episodes:
+        builder.add(flatten_episodes([e], builder.outputs))
+    return builder.indexes()
+
+
+def build_character_indexes(characters):
+    """Builds the character indexes (see CharacterIndexBuilder) in one pass over the characters."""
+
+    builder = CharacterIndexBuilder()
+    for c in characters:
+        builder.add(derive_characters([c], builder.outputs))
+    return builder.indexes()
+
+
+def save_indexes(indexes, out_dir="."):
+    for name, index in indexes.items():
+        with open(os.path.join(out_dir, index_files[name]), "w") as out_file:
+            json.dump(index, out_file, separators=(",", ":"))
+
+
+class GotIndexes:
+    """
+    Point lookups over the derived data, using the indexes saved by save_indexes in out_dir.
+    Each index file is loaded the first time a lookup needs it, after which lookups are dict accesses.
+    """
+
+    def __init__(self, out_dir="."):
+        self.out_dir = out_dir
+        self._indexes = {}
+
+    def index(self, name):
+        result = self._indexes.get(name)
+        if result is None:
+            with open(os.path.join(self.out_dir, index_files[name]), "r") as in_file:
+                result = self._indexes[name] = json.load(in_file)
+        return result
+
+    def scenes_of(self, character_name):
+        """Returns the (seasonNum, episodeNum, sceneNum) of every scene the character is in."""
+        return [tuple(s) for s in self.index("character_scenes").get(character_name, [])]
+
+    def scene_rows(self, season_num, episode_num):
+        """Returns the range of rows of episodes_scenes.json that hold the episode's scenes."""
+        start, end = self.index("episode_scenes").get(episode_key(season_num, episode_num), (0, 0))
+        return range(start, end)
+
+    def kills_in_season(self, season_num):
+        """Returns who killed whom in the season, as {"characterName", "killedBy", "episodeNum", "sceneNum"}."""
+        return self.index("season_kills").get(str(season_num), [])
+
+    def related(self, character_name, relationship):
+        """Returns the characters that character_name has relationship with, e.g. "parentOf" or "sibling"."""
+        return self.index("relationships").get(relationship, {}).get(character_name, [])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Flattens the GoT episodes and characters into derived JSON files.")
+    parser.add_argument("outputs", nargs="*",
+                        help="outputs to write, any of: %s (default: all)"
+                             % ", ".join(list(episode_outputs) + list(character_outputs)))
+    parser.add_argument("--episodes", default=episodes_file, help="path of episodes.json")
+    parser.add_argument("--characters", default=characters_file, help="path of characters.json")
+    parser.add_argument("--out-dir", default=".", help="directory the outputs are written to")
+    parser.add_argument("--stream", action="store_true",
+                        help="parse the inputs incrementally instead of loading them whole")
+    parser.add_argument("--format", choices=list(record_formats) + list(columnar_formats), default="json",
+                        help="write each output as one JSON array, one record per line (ndjson), "
+                             "or a columnar table (npy directory or parquet, see ColumnarWriter)")
+    parser.add_argument("--compact", action="store_true", help="write the outputs without indentation")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of processes that derive and encode the records (default: 1, no pool)")
+    parser.add_argument("--chunk-size", type=int, default=256,
+                        help="number of episodes or characters handed to a worker at a time")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only re-derive the episodes and characters that changed since the last "
+                             "incremental run, using the manifest in --out-dir")
+    parser.add_argument("--indexes", action="store_true",
+                        help="also build the lookup indexes that GotIndexes reads (see index_files)")
+    args = parser.parse_args(argv)
+    if args.workers < 1 or args.chunk_size < 1:
+        parser.error("--workers and --chunk-size must be at least 1")
+    if args.incremental and args.format not in record_formats:
+        parser.error("--incremental needs --format %s" % " or ".join(record_formats))
+    if args.format == "parquet" and importlib.util.find_spec("pyarrow") is None:
+        parser.error("--format parquet needs pyarrow, which is not installed (--format npy needs only numpy)")
+
+    outputs = args.outputs or list(episode_outputs) + list(character_outputs)
+    unknown = [o for o in outputs if o not in episode_outputs and o not in character_outputs]
+    if unknown:
+        parser.error("unknown outputs: " + ", ".join(unknown))
+    selected_episode_outputs = [o for o in outputs if o in episode_outputs]
+    selected_character_outputs = [o for o in outputs if o in character_outputs]
+
+    options = dict(out_dir=args.out_dir, stream=args.stream, fmt=args.format, compact=args.compact,
+                   workers=args.workers, chunk_size=args.chunk_size, incremental=args.incremental)
+    stats = {}
+    # The indexes are built from the records as they are flattened, not from another read of the inputs
+    episode_index = EpisodeIndexBuilder() if args.indexes else None
+    character_index = CharacterIndexBuilder() if args.indexes else None
+    if selected_episode_outputs:
+        stats["episodes"] = process_episode_outputs(selected_episode_outputs, args.episodes, index=episode_index,
+                                                    **options)
+        if episode_index is not None:
+            save_indexes(episode_index.indexes(), args.out_dir)
+    if selected_character_outputs:
+        stats["characters"] = process_character_outputs(selected_character_outputs, args.characters,
+                                                        index=character_index, **options)
+        if character_index is not None:
+            save_indexes(character_index.indexes(), args.out_dir)
+
+    if args.incremental:
+        for group, s in stats.items():
+            print("%s: %d unchanged (skipped), %d re-derived, %d removed%s"
+                  % (group, s["reused"], s["derived"], s["removed"], "" if s["rewritten"] else ", outputs up to date"))
 
 
 if __name__ == "__main__":
-    # process_episodes()
-    # process_locations()
-    # process_scenes()
-    # process_episodes_characters()
-    # process_characters_core()
-    process_characters_relationships()
+    main()
 
@@ -0,0 +1,263 @@
+import json
+import os
+import tempfile
+import unittest
+
+from examples.process_got import process_got
+
+
+def episode(season_num, episode_num, location="Winterfell", killed=()):
+    return {
+        "seasonNum": season_num,
+        "episodeNum": episode_num,
+        "episodeTitle": "Episode %d" % episode_num,
+        "episodeLink": "/title/%d/" % episode_num,
+        "episodeAirDate": "2011-04-17",
+        "episodeDescription": "\"Quotes\", commas, ] and unicode — dash",
+        "openingSequenceLocations": [location, "King's Landing"],
+        "scenes": [
+            {
+                "sceneStart": "0:00:40",
+                "sceneEnd": "0:01:45",
+                "location": location,
+                "subLocation": "Castle",
+                "characters": [{"name": "Jon Snow"}, {"name": "Waymar Royce", "killedBy": list(killed)}],
+            },
+            {"sceneStart": "0:01:45", "sceneEnd": "0:02:10", "location": "The Wall", "characters": []},
+        ],
+    }
+
+
+EPISODES = [episode(1, 1, killed=["White Walker"]), episode(1, 2), episode(2, 1, "Dragonstone")]
+CHARACTERS = [
+    {"characterName": "Eddard Stark", "royal": True, "parentOf": ["Arya Stark", "Jon Snow"], "killedBy": ["Ilyn Payne"]},
+    {"characterName": "Arya Stark", "parents": ["Eddard Stark"], "siblings": ["Jon Snow"], "killed": ["Walder Frey"]},
+    {"characterName": "Hodor", "guardianOf": ["Bran Stark"]},
+]
+
+
+class RecordWriterTest(unittest.TestCase):
+    def test_formats(self):
+        tests = [[], [{"a": 1}], [{"a": 1, "b": [1, {"c": "d\ne"}], "f": {}}, {"a": None, "g": "—"}, {}]]
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "out")
+            for records in tests:
+                for fmt, compact, want in (
+                    ("json", False, json.dumps(records, indent=2)),
+                    ("json", True, json.dumps(records, separators=(",", ":"))),
+                    ("ndjson", False, "".join(json.dumps(r) + "\n" for r in records)),
+                    ("ndjson", True, "".join(json.dumps(r, separators=(",", ":")) + "\n" for r in records)),
+                ):
+                    with process_got.RecordWriter(path, fmt, compact) as w:
+                        w.write_all(records)
+                    # Byte for byte, e.g. what json.dump(records, out_file, indent=2) writes
+                    with open(path, "rb") as in_file:
+                        self.assertEqual(want.encode("ascii"), in_file.read(), (fmt, compact, records))
+                    self.assertEqual(len(records), w.count)
+
+            # Pre-encoded text, e.g. from a worker, gives the same file
+            records = tests[-1]
+            with process_got.RecordWriter(path) as w:
+                w.write_encoded(process_got.encode_record(records[0]))
+                w.write_encoded(w.separator.join(process_got.encode_record(r) for r in records[1:]), 2)
+            with open(path, "r") as in_file:
+                self.assertEqual(json.dumps(records, indent=2), in_file.read())
+
+        with self.assertRaises(ValueError):
+            process_got.RecordWriter(os.devnull, "csv")
+
+    def test_positions(self):
+        # Text that isn't ASCII, and newlines, which text mode would translate on Windows
+        texts = ['{"a": "\u2014"}', '{"b": "—é"}', '{\n    "c": 1\n  }']
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "out")
+            with process_got.RecordWriter(path) as w:
+                starts = [w.write_encoded(t) for t in texts]
+            with open(path, "rb") as in_file:
+                for start, text in zip(starts, texts):
+                    in_file.seek(start)
+                    self.assertEqual(text, in_file.read(len(text.encode("utf-8"))).decode("utf-8"))
+                in_file.seek(0)
+                self.assertEqual([{"a": "—"}, {"b": "—é"}, {"c": 1}], json.loads(in_file.read().decode("utf-8")))
+
+
+class OutputsTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = tmp.name
+        self.episodes_file = os.path.join(self.dir, "episodes.json")
+        self.characters_file = os.path.join(self.dir, "characters.json")
+        self.write_inputs(EPISODES, CHARACTERS)
+
+    def write_inputs(self, episodes, characters):
+        with open(self.episodes_file, "w") as out_file:
+            json.dump({"episodes": episodes}, out_file, indent=2)
+        with open(self.characters_file, "w") as out_file:
+            json.dump({"characters": characters}, out_file, indent=2)
+
+    def expected(self, episodes=EPISODES, characters=CHARACTERS):
+        """The records of every output, derived by the original one-list-per-output functions."""
+        return {
+            "basics": process_got.get_episodes_basics(episodes),
+            "locations": process_got.get_episodes_basics_location(episodes),
+            "scenes": process_got.get_episodes_basics_scenes(episodes),
+            "characters": process_got.get_episodes_basics_scenes_characters(episodes),
+            "killedBy": process_got.get_episodes_scenes_characters_killed_by(episodes),
+            "characters_basic": process_got.get_characters_basics(characters),
+            "relationships": process_got.get_characters_relationships(characters),
+        }
+
+    def run_main(self, out_dir, *args):
+        os.makedirs(out_dir, exist_ok=True)
+        process_got.main(
+            ["--episodes", self.episodes_file, "--characters", self.characters_file, "--out-dir", out_dir] + list(args)
+        )
+
+    def read_outputs(self, out_dir, fmt="json"):
+        result = {}
+        for outputs in (process_got.episode_outputs, process_got.character_outputs):
+            for o, file_name in outputs.items():
+                with open(os.path.join(out_dir, process_got.output_file_name(file_name, fmt)), "r") as in_file:
+                    result[o] = in_file.read()
+        return result
+
+    def test_flatten(self):
+        want = self.expected()
+        self.assertEqual(["White Walker"], [k["killedBy"] for k in want["killedBy"]])
+        self.assertEqual(
+            {o: want[o] for o in process_got.episode_outputs},
+            process_got.flatten_episodes(EPISODES, list(process_got.episode_outputs)),
+        )
+        self.assertEqual(want["scenes"], list(process_got.iter_episodes_basics_scenes(EPISODES)))
+        self.assertEqual({"locations": want["locations"]}, process_got.flatten_episodes(EPISODES, ["locations"]))
+
+    def test_outputs(self):
+        want = {o: json.dumps(records, indent=2) for o, records in self.expected().items()}
+        # Streamed, parallel and chunked runs write the same bytes as a serial run
+        for args in ([], ["--stream"], ["--workers", "2", "--chunk-size", "1"], ["--stream", "--workers", "2"]):
+            out_dir = os.path.join(self.dir, "-".join(args) or "serial")
+            self.run_main(out_dir, *args)
+            self.assertEqual(want, self.read_outputs(out_dir), args)
+
+        out_dir = os.path.join(self.dir, "ndjson")
+        self.run_main(out_dir, "--format", "ndjson", "--compact", "--workers", "2")
+        self.assertEqual(
+            {o: [json.loads(line) for line in text.splitlines()] for o, text in self.read_outputs(out_dir, "ndjson").items()},
+            self.expected(),
+        )
+
+    def test_incremental(self):
+        out_dir = os.path.join(self.dir, "out")
+        tests = [
+            # (episodes, characters, expected stats of the episodes)
+            (EPISODES, CHARACTERS, {"reused": 0, "derived": 3, "removed": 0, "rewritten": True}),
+            (EPISODES, CHARACTERS, {"reused": 3, "derived": 0, "removed": 0, "rewritten": False}),
+            # Changed, moved and removed episodes
+            ([EPISODES[2], episode(1, 2, "Braavos")], CHARACTERS[1:],
+             {"reused": 1, "derived": 1, "removed": 2, "rewritten": True}),
+            (EPISODES + [episode(3, 1)], CHARACTERS, {"reused": 0, "derived": 4, "removed": 0, "rewritten": True}),
+        ]
+        options = dict(out_dir=out_dir, incremental=True)
+        os.makedirs(out_dir)
+        for episodes, characters, stats in tests:
+            self.write_inputs(episodes, characters)
+            if stats["reused"] == 0 and stats["derived"] == 4:
+                # Rewritten by a run that wasn't incremental, so nothing can be reused
+                self.run_main(out_dir, "--compact")
+            self.assertEqual(stats, process_got.process_episode_outputs(file_name=self.episodes_file, **options))
+            process_got.process_character_outputs(file_name=self.characters_file, **options)
+            want = {o: json.dumps(records, indent=2) for o, records in self.expected(episodes, characters).items()}
+            self.assertEqual(want, self.read_outputs(out_dir), stats)
+            self.check_spans(out_dir, "episodes", episodes, process_got.flatten_episodes)
+
+        with self.assertRaises(ValueError):
+            process_got.process_episode_outputs(file_name=self.episodes_file, fmt="npy", **options)
+
+    def check_spans(self, out_dir, group, items, derive):
+        """Seeks to every span in the manifest and checks that it holds the item's records."""
+        entries = process_got.load_manifest(out_dir)[group]["records"]
+        self.assertEqual(len(items), len(entries))
+        for item, entry in zip(items, entries):
+            result = derive([item], list(entry["spans"]))
+            for o, (start, length, n) in entry["spans"].items():
+                with open(os.path.join(out_dir, process_got.episode_outputs[o]), "rb") as in_file:
+                    in_file.seek(start)
+                    block = in_file.read(length).decode("utf-8")
+                self.assertEqual(result[o], json.loads("[" + block + "]") if n else [], (o, start))
+
+    def test_indexes(self):
+        # Built in the same pass as the outputs, however that pass runs
+        for args in ([], ["--stream"], ["--workers", "2", "--chunk-size", "2"], ["--incremental"]):
+            out_dir = os.path.join(self.dir, "-".join(args) or "serial")
+            self.run_main(out_dir, "--indexes", *args)
+            self.check_indexes(out_dir)
+
+        # Only the indexes of the groups whose outputs were written
+        out_dir = os.path.join(self.dir, "relationships")
+        self.run_main(out_dir, "--indexes", "relationships")
+        self.assertEqual(["Bran Stark"], process_got.GotIndexes(out_dir).related("Hodor", "guardianOf"))
+        self.assertFalse(os.path.exists(os.path.join(out_dir, process_got.index_files["character_scenes"])))
+
+    def check_indexes(self, out_dir):
+        indexes = process_got.GotIndexes(out_dir)
+        self.assertEqual([(1, 1, 0), (1, 2, 0), (2, 1, 0)], indexes.scenes_of("Jon Snow"))
+        self.assertEqual([], indexes.scenes_of("Nobody"))
+
+        with open(os.path.join(out_dir, process_got.episode_outputs["scenes"]), "r") as in_file:
+            scenes = json.load(in_file)
+        self.assertEqual(range(2, 4), indexes.scene_rows(1, 2))
+        self.assertEqual([(1, 2)] * 2, [(scenes[i]["seasonNum"], scenes[i]["episodeNum"]) for i in indexes.scene_rows(1, 2)])
+        self.assertEqual(range(0, 0), indexes.scene_rows(9, 9))
+
+        self.assertEqual(
+            [{"characterName": "Waymar Royce", "killedBy": "White Walker", "episodeNum": 1, "sceneNum": 0}],
+            indexes.kills_in_season(1),
+        )
+        self.assertEqual([], indexes.kills_in_season(2))
+        self.assertEqual(["Arya Stark", "Jon Snow"], indexes.related("Eddard Stark", "parentOf"))
+        self.assertEqual(["Jon Snow"], indexes.related("Arya Stark", "siblings"))
+        self.assertEqual([], indexes.related("Hodor", "parentOf"))
+        self.assertEqual(["Bran Stark"], indexes.related("Hodor", "guardianOf"))
+        self.assertEqual(["Walder Frey"], indexes.related("Arya Stark", "killed"))
+        self.assertNotIn("guardianOfkilled", indexes.index("relationships"))
+
+
+class ColumnarTest(unittest.TestCase):
+    def test_round_trip(self):
+        records = [
+            {"seasonNum": 1, "episodeNum": 1, "title": "Winter Is Coming", "royal": True, "tags": ["a"]},
+            {"seasonNum": 1, "episodeNum": 2, "title": "The Kingsroad", "royal": False, "tags": [1, 2]},
+            {"seasonNum": 8, "episodeNum": 6, "title": None, "royal": True, "tags": {"b": 1}, "big": 2 ** 40},
+        ]
+        with tempfile.TemporaryDirectory() as out_dir:
+            path = os.path.join(out_dir, "t.columns")
+            with process_got.ColumnarWriter(path) as w:
+                w.write_all(records)
+            for mmap in (True, False):
+                frame = process_got.load_columnar(path, mmap=mmap)
+                self.assertEqual(["seasonNum", "episodeNum", "title", "royal", "tags", "big"], list(frame.columns))
+                self.assertEqual([1, 1, 8], frame["seasonNum"].tolist())
+                self.assertEqual("uint8", str(frame["seasonNum"].dtype))
+                self.assertEqual([True, False, True], frame["royal"].tolist())
+                self.assertEqual(["Winter Is Coming", "The Kingsroad"], frame["title"].tolist()[:2])
+                self.assertTrue(frame["title"].isna()[2])
+                self.assertEqual([["a"], [1, 2], {"b": 1}], frame["tags"].tolist())
+                self.assertEqual(2 ** 40, frame["big"].tolist()[2])
+
+            with process_got.ColumnarWriter(os.path.join(out_dir, "empty.columns")):
+                pass
+            self.assertEqual(0, len(process_got.load_columnar(os.path.join(out_dir, "empty.columns"))))
+
+    def test_parquet_without_pyarrow(self):
+        try:
+            import pyarrow  # noqa: F401
+            self.skipTest("pyarrow is installed")
+        except ImportError:
+            pass
+        with self.assertRaises(SystemExit):
+            process_got.main(["--format", "parquet", "basics"])
+
+
+if __name__ == '__main__':
+    unittest.main()